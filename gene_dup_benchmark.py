@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks and legacy-equivalence checks for the gene duplicability engines.
+
+Purpose:
+    1) Time each stage separately: the survival kernel (over q and n_max), the pratio surface, batches of scenarios,
+       the csv and binary exports, and headless figure rendering.
+    2) Check the engines against the scalar reference functions kept in gene_dup_oct_2023_submission.py and the
+       Dec 2022 script at both scales (survival by time, calculate_pratio / calculate_pratio_2d), and fail if any result drifts
+       beyond legacy_tolerance.
+    3) Append every run to a JSON lines history (one record per run: when, which commit, versions, timings and
+       checks), and report the stages that got slower than the fastest earlier run of the same benchmark.
+
+Usage:
+    python gene_dup_benchmark.py [--quick] [--sizes 51 201 ...] [--history FILE | --no-history] [--max-slowdown FACTOR]
+    The exit status is 1 if a legacy check fails, or with --max-slowdown if a stage is slower than FACTOR times its
+    best earlier time.
+
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+import gene_dup_grids
+import gene_dup_io
+import gene_dup_plots
+import gene_dup_pratio
+import gene_dup_runner
+import gene_dup_survival
+
+###########################################################################
+#initialize parameters
+benchmark_sizes = (51, 201, 1001, 5001)
+quick_sizes = (51, 201)
+benchmark_n_max = (100, 170, None)
+#the survival kernel is also timed with the series truncated adaptively at each of these tolerances
+benchmark_series_tolerances = (gene_dup_survival.series_tolerance,)
+scenario_counts = (1, 16)
+#the long format csv of a 5001 x 5001 grid is 25 million rows, so csv export stops at 1001
+csv_export_sizes = (51, 201, 1001)
+figure_sizes = (51, 201)
+figure_kinds = ('scatter', 'surface', 'survival')
+#best of this many runs is recorded for every timing
+repeats = 3
+
+benchmark_composition = (0.3, 0.45, 0.25)
+benchmark_switch = 0.25
+
+#largest accepted relative difference between an engine and the scalar reference functions
+legacy_tolerance = 1e-10
+legacy_compositions = [(0.3, 0.45, 0.25), (0.75, 0.0, 0.25), (0.0, 0.25, 0.75), (1.0, 0.0, 0.0)]
+legacy_switches = [0.0, 0.25, 0.75]
+
+history_file = 'benchmark_history.jsonl'
+
+
+###########################################################################
+#Functions
+
+def best_time(function, repeats=repeats):
+    #fastest wall time of repeats calls, in seconds
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+def benchmark_grid(q):
+    return gene_dup_grids.uniform_grid(0.01, 0.5 / max(1, q - 1), q)
+
+def benchmark_survival_kernel(sizes, n_max_values=benchmark_n_max, series_tolerances=benchmark_series_tolerances):
+    results = []
+    for q in sizes:
+        time_range = benchmark_grid(q)
+        for n_max in n_max_values:
+            seconds = best_time(lambda: gene_dup_survival.calculate_category_survival_curves(time_range, n_max=n_max))
+            results.append({'stage': 'survival_kernel', 'q': q, 'n_max': n_max, 'seconds': seconds})
+        for tolerance in series_tolerances:
+            seconds = best_time(lambda: gene_dup_survival.calculate_category_survival_curves(time_range, tolerance=tolerance))
+            results.append({'stage': 'survival_kernel', 'q': q, 'series_tolerance': tolerance, 'seconds': seconds})
+    return results
+
+def benchmark_pratio_surface(sizes):
+    results = []
+    for q in sizes:
+        time_range = benchmark_grid(q)
+        survival = gene_dup_survival.calculate_category_survival_curves(time_range)
+        seconds = best_time(lambda: gene_dup_pratio.calculate_pratio_surface(survival, survival, *benchmark_composition, benchmark_switch))
+        results.append({'stage': 'pratio_surface', 'q': q, 'seconds': seconds})
+    return results
+
+def benchmark_scenarios(counts=scenario_counts, q=51, workers=1):
+    #whole scenarios (survival through the cache, surface, no output files), one composition each
+    results = []
+    compositions = gene_dup_pratio.composition_simplex_grid(0.05)
+    for count in counts:
+        scenarios = [gene_dup_runner.make_scenario(compositions[k % len(compositions)], benchmark_switch, benchmark_grid(q).tolist()) for k in range(count)]
+        #survival curves come from the shared cache after the first repeat, so this times the warm path
+        seconds = best_time(lambda: gene_dup_runner.run_scenarios(scenarios, workers))
+        results.append({'stage': 'scenarios', 'q': q, 'scenarios': count, 'workers': workers, 'seconds': seconds})
+    return results
+
+def benchmark_exports(sizes, directory):
+    results = []
+    for q in sizes:
+        surface = gene_dup_pratio.calculate_scenario_surface(benchmark_grid(q), benchmark_composition, benchmark_switch)
+        for output_format in ('csv', 'npy'):
+            if output_format == 'csv' and q not in csv_export_sizes:
+                continue
+            file_name = os.path.join(directory, 'export_' + str(q))
+            seconds = best_time(lambda: gene_dup_io.write_pratio_surface(surface, file_name, output_format), repeats=1)
+            results.append({'stage': 'export', 'q': q, 'format': output_format, 'seconds': seconds})
+    return results
+
+def benchmark_figures(sizes, directory):
+    gene_dup_plots.use_headless_backend()
+    results = []
+    for q in sizes:
+        if q not in figure_sizes:
+            continue
+        surface = gene_dup_pratio.calculate_scenario_surface(benchmark_grid(q), benchmark_composition, benchmark_switch)
+        for kind in figure_kinds:
+            seconds = best_time(lambda: gene_dup_plots.render_scenario_figures(surface, os.path.join(directory, 'figure_' + str(q)), 'benchmark', [kind]), repeats=1)
+            results.append({'stage': 'figure', 'q': q, 'kind': kind, 'seconds': seconds})
+    return results
+
+def relative_difference(engine, reference, absolute=False):
+    #largest relative difference (absolute for log10 values, where that is the relative error over log(10)),
+    #cells where both are the same non-finite value count as equal
+    engine = np.asarray(engine, dtype=float)
+    reference = np.asarray(reference, dtype=float)
+    same = (engine == reference) | (np.isnan(engine) & np.isnan(reference))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        difference = np.abs(engine - reference) if absolute else np.abs(engine - reference) / np.maximum(np.abs(reference), np.finfo(float).tiny)
+    difference = np.where(same, 0.0, difference)
+    return float(np.max(np.where(np.isnan(difference), np.inf, difference))) if difference.size else 0.0
+
+def legacy_check(name, engine, reference, tolerance, absolute=False):
+    difference = relative_difference(engine, reference, absolute)
+    return {'check': name, 'max_relative_difference': difference, 'passed': difference <= tolerance}
+
+def check_oct_2023(tolerance=legacy_tolerance):
+    #survival and calculate_pratio_2d of the Oct 2023 script, one cell at a time, against the engine surfaces
+    import gene_dup_oct_2023_submission as script
+    checks = []
+    parameters = script.survival_parameters
+    composition = legacy_compositions[0]
+    time_range = script.make_time_range(*composition, 0.0)
+    reference = {name: [script.calculate_probability_of_survival_of_duplicate_gene_copy_by_time(*parameters[name], t) for t in time_range] for name in gene_dup_survival.category_names}
+    engine = gene_dup_survival.calculate_category_survival_curves(time_range, parameters, script.n_max)
+    for name in gene_dup_survival.category_names:
+        checks.append(legacy_check('oct_2023 survival ' + name, engine[name], reference[name], tolerance))
+    for composition in legacy_compositions:
+        for switch in legacy_switches:
+            surface = gene_dup_pratio.calculate_scenario_surface(time_range, composition, switch, parameters=parameters, n_max=script.n_max)
+            st = [reference[name] for name in gene_dup_survival.category_names]
+            expected = np.array([[script.calculate_pratio_2d(st[0][i], st[1][i], st[2][i], st[0][j], st[1][j], st[2][j], *composition, switch)
+                                  for j in range(len(time_range))] for i in range(len(time_range))])
+            checks.append(legacy_check('oct_2023 pratio ' + str(composition) + ' switch ' + str(switch), surface.pratio, expected, tolerance))
+    return checks
+
+def check_dec_2022(scale='pratio', tolerance=legacy_tolerance):
+    #survival, calculate_pratio and calculate_pratio_2d of the Dec 2022 script (which read the composition, q and scale
+    #from module globals, set here) against the engine surfaces, with s(0) adjusted as in the script's original main
+    #with scale 'log of pratio' (the logscale script) they return log10(pratio)
+    import gene_duplicability_surface_figures_dec_2022_submission as script
+    checks = []
+    log_scale = gene_dup_pratio.normalize_scale(scale) != 'pratio'
+    label = 'logscale_dec_2022' if log_scale else 'dec_2022'
+    script.scale = scale
+    parameters = script.survival_parameters
+    time_range = [i/100 for i in range(0, script.q)]
+    survival = {}
+    for name in gene_dup_survival.category_names:
+        values = script.calculate_probability_of_survival_of_duplicate_gene_copy_by_time(*parameters[name], time_range)
+        survival[name] = [script.survival_immediately_post_wgd] + list(values[1:])
+    for composition in legacy_compositions:
+        script.alt_func_percent, script.dos_percent, script.non_percent = composition
+        surface = gene_dup_pratio.calculate_scenario_surface(time_range, composition, 0.0, parameters=parameters, n_max=script.n_max)
+        st = [survival[name] for name in gene_dup_survival.category_names]
+        if composition == legacy_compositions[0]:
+            for name in gene_dup_survival.category_names:
+                checks.append(legacy_check(label + ' survival ' + name, surface.st1[name], survival[name], tolerance))
+            expected_2d = script.calculate_pratio_2d(time_range, time_range, *st, *st)
+            checks.append(legacy_check(label + ' pratio_2d ' + str(composition), script.unpack_calculations(surface)[-1], expected_2d, tolerance, log_scale))
+        engine = surface.log10_pratio if log_scale else surface.pratio
+        checks.append(legacy_check(label + ' pratio ' + str(composition), engine, script.calculate_pratio(*st, *st), tolerance, log_scale))
+    return checks
+
+def check_legacy_equivalence(tolerance=legacy_tolerance):
+    gene_dup_plots.use_headless_backend()
+    checks = check_oct_2023(tolerance)
+    for scale in ('pratio', 'log of pratio'):
+        checks += check_dec_2022(scale, tolerance)
+    return checks
+
+def benchmark_key(result):
+    #what identifies a timing across runs: every field except the time itself
+    return json.dumps({name: value for name, value in result.items() if name != 'seconds'}, sort_keys=True)
+
+def read_history(path):
+    records = []
+    if os.path.exists(path):
+        with open(path) as file:
+            for line in file:
+                if line.strip():
+                    records.append(json.loads(line))
+    return records
+
+def append_history(path, record):
+    with open(path, 'a') as file:
+        file.write(json.dumps(record, sort_keys=True) + '\n')
+
+def find_slowdowns(timings, history, max_slowdown):
+    #timings slower than max_slowdown times the fastest earlier time of the same benchmark
+    best = {}
+    for record in history:
+        for result in record.get('timings', []):
+            key = benchmark_key(result)
+            best[key] = min(best.get(key, np.inf), result['seconds'])
+    slowdowns = []
+    for result in timings:
+        previous = best.get(benchmark_key(result))
+        if previous is not None and previous > 0 and result['seconds'] > max_slowdown * previous:
+            slowdowns.append(dict(result, best_seconds=previous, slowdown=result['seconds'] / previous))
+    return slowdowns
+
+def current_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_benchmarks(sizes=benchmark_sizes, workers=1):
+    #one benchmark record: environment, every timing and every legacy check
+    with tempfile.TemporaryDirectory() as directory:
+        timings = (benchmark_survival_kernel(sizes) + benchmark_pratio_surface(sizes) + benchmark_scenarios(workers=workers)
+                   + benchmark_exports(sizes, directory) + benchmark_figures(sizes, directory))
+    return {
+        'time': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'commit': current_commit(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'timings': timings,
+        'legacy': check_legacy_equivalence(),
+        }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Time the gene duplicability engines and check them against the scalar reference functions.')
+    parser.add_argument('--quick', action='store_true', help='only q = ' + ', '.join(str(q) for q in quick_sizes))
+    parser.add_argument('--sizes', type=int, nargs='+', help='grid sizes q to time (default ' + ' '.join(str(q) for q in benchmark_sizes) + ')')
+    parser.add_argument('--workers', type=int, default=1, help='worker processes for the scenario batches')
+    parser.add_argument('--history', default=history_file, help='JSON lines file the run is appended to')
+    parser.add_argument('--no-history', action='store_true', help='do not read or append the history')
+    parser.add_argument('--max-slowdown', type=float, help='fail if a stage is slower than this factor times its best earlier time')
+    args = parser.parse_args(argv)
+    sizes = args.sizes or (quick_sizes if args.quick else benchmark_sizes)
+    record = run_benchmarks(sizes, args.workers)
+    for result in record['timings']:
+        print('%-16s %-60s %10.4f s' % (result['stage'], json.dumps({k: v for k, v in result.items() if k not in ('stage', 'seconds')}), result['seconds']))
+    failed = [check for check in record['legacy'] if not check['passed']]
+    for check in record['legacy']:
+        print('%-4s %-60s max relative difference %.3g' % ('ok' if check['passed'] else 'FAIL', check['check'], check['max_relative_difference']))
+    slowdowns = []
+    if not args.no_history:
+        history = read_history(args.history)
+        if args.max_slowdown is not None:
+            slowdowns = find_slowdowns(record['timings'], history, args.max_slowdown)
+            for result in slowdowns:
+                print('SLOWER %s: %.4f s, best earlier %.4f s (x%.2f)' % (benchmark_key(result), result['seconds'], result['best_seconds'], result['slowdown']))
+        append_history(args.history, record)
+    return 1 if failed or slowdowns else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""
+Memoized survival curves shared across t1/t2 axes, composition scenarios and runs.
+
+Purpose:
+    1) Keep every survival curve evaluated in this process in an LRU keyed by (b, c, d, f, n_max, time grid),
+       so the t1 and t2 axes, all composition combos and all switch values reuse the same three curves.
+    2) Optionally persist curves to an on-disk store (one .npy file per key) with size-based eviction,
+       so later runs with the same parameters and grid do not recompute them. Temporary files left by killed runs
+       are removed when the store is opened.
+
+"""
+import collections
+import hashlib
+import os
+import tempfile
+import time
+
+import numpy as np
+
+import gene_dup_profile
+import gene_dup_survival
+
+###########################################################################
+#initialize parameters
+max_entries_in_memory = 256
+max_bytes_on_disk = 512 * 1024 * 1024
+#a curve is written in milliseconds, so a temporary file older than this is left over from a killed run (younger ones
+#may belong to another process sharing the directory)
+stale_temporary_seconds = 3600
+
+
+###########################################################################
+#Functions
+
+def survival_curve_key(b, c, d, f, time_range, n_max=gene_dup_survival.n_max, tolerance=None):
+    #hex digest identifying one survival curve: the model parameters, the series length or tolerance and the exact time grid
+    time_range = np.ascontiguousarray(time_range, dtype=float)
+    digest = hashlib.sha256()
+    digest.update(repr((float(b), float(c), float(d), float(f), None if n_max is None else int(n_max), tolerance, time_range.shape)).encode())
+    digest.update(time_range.tobytes())
+    return digest.hexdigest()
+
+class SurvivalCurveCache:
+    #in-process LRU of survival curves with an optional on-disk store underneath
+    def __init__(self, max_entries=max_entries_in_memory, directory=None, max_bytes=max_bytes_on_disk):
+        self.max_entries = max_entries
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+            self.clean_temporary_files()
+
+    def get_survival_curve(self, b, c, d, f, time_range, n_max=gene_dup_survival.n_max, tolerance=None):
+        #survival curve for one parameter set, computed at most once per key
+        #with a tolerance the series is truncated adaptively, at up to max_series_terms terms whatever n_max
+        #(n_max=None still evaluates the untruncated series, which needs no tolerance)
+        if n_max is None:
+            tolerance = None
+        elif tolerance is not None:
+            n_max = gene_dup_survival.max_series_terms
+        key = survival_curve_key(b, c, d, f, time_range, n_max, tolerance)
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            gene_dup_profile.count('survival_cache_hits')
+            return self.entries[key]
+        curve = self.read_from_disk(key)
+        if curve is not None:
+            self.disk_hits += 1
+            gene_dup_profile.count('survival_cache_disk_hits')
+        else:
+            self.misses += 1
+            gene_dup_profile.count('survival_cache_misses')
+            if tolerance is None:
+                curve = gene_dup_survival.calculate_survival_curves(b, c, d, f, time_range, n_max)
+            else:
+                with gene_dup_profile.stage('survival_kernel'):
+                    curve = gene_dup_survival.calculate_survival_curves_adaptive(b, c, d, f, time_range, tolerance, n_max)[0]
+            self.write_to_disk(key, curve)
+        curve.setflags(write=False)
+        self.remember(key, curve)
+        return curve
+
+    def get_category_survival_curves(self, time_range, parameters=None, n_max=gene_dup_survival.n_max, tolerance=None):
+        #Alt_func, Dos and Non survival curves as a dict keyed by category name
+        if parameters is None:
+            parameters = gene_dup_survival.default_survival_parameters
+        return {name: self.get_survival_curve(*parameters[name], time_range, n_max=n_max, tolerance=tolerance) for name in gene_dup_survival.category_names}
+
+    def remember(self, key, curve):
+        self.entries[key] = curve
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        #forget the in-memory entries (the on-disk store is kept)
+        self.entries.clear()
+
+    def statistics(self):
+        return {'hits': self.hits, 'disk_hits': self.disk_hits, 'misses': self.misses, 'entries': len(self.entries)}
+
+    def disk_path(self, key):
+        return os.path.join(self.directory, key + '.npy')
+
+    def read_from_disk(self, key):
+        if self.directory is None:
+            return None
+        path = self.disk_path(key)
+        try:
+            curve = np.load(path)
+        except (OSError, ValueError):
+            return None
+        #touch the file so eviction treats it as recently used
+        os.utime(path)
+        return curve
+
+    def write_to_disk(self, key, curve):
+        if self.directory is None:
+            return
+        #write to a temporary file and rename, so a killed run never leaves a half-written curve behind
+        handle, temporary_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(handle, 'wb') as file:
+                np.save(file, curve)
+            os.replace(temporary_path, self.disk_path(key))
+        except BaseException:
+            os.remove(temporary_path)
+            raise
+        self.evict_from_disk()
+
+    def clean_temporary_files(self, max_age=stale_temporary_seconds):
+        #remove the temporary files of write_to_disk that are older than max_age seconds
+        now = time.time()
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.tmp'):
+                try:
+                    if now - entry.stat().st_mtime > max_age:
+                        os.remove(entry.path)
+                except FileNotFoundError:
+                    pass
+
+    def evict_from_disk(self):
+        #remove least recently used files until the store fits in max_bytes
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.npy'):
+                stat = entry.stat()
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        total_bytes = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total_bytes -= size
+
+default_survival_cache = SurvivalCurveCache()
+
+def calculate_cached_category_survival_curves(time_range, parameters=None, n_max=gene_dup_survival.n_max, cache=None, tolerance=None):
+    #Alt_func, Dos and Non survival curves served from the shared process-wide cache
+    if cache is None:
+        cache = default_survival_cache
+    return cache.get_category_survival_curves(time_range, parameters, n_max, tolerance)
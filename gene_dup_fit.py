@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""
+Fit the survival parameters b, c, d, f of each category to observed duplicate retention by age.
+
+Purpose:
+    1) Fit the survival curve of one category to observed data: for every age t, the fraction of duplicates still
+       retained (or retained counts out of totals, which weights each age by its total).
+    2) Use the analytic derivatives of survival with respect to b, c, d and f (calculate_survival_jacobian), evaluated
+       for all ages at once, instead of finite differences over the scalar kernel.
+    3) Respect the sign constraints of each category (from the submission scripts):
+           Alt_func: b > 0, c > 0, d > 0, f > 0
+           Dos:      b < 0, 0 < c < 1, d = -f
+           Non:      b = 0, c = 1, d > 10, f = anything
+       Fixed parameters are not fitted (for Non only d + f is identifiable, so f stays where it starts), tied
+       parameters (d = -f) are fitted as one, and the rest are kept inside their bounds by a projected
+       Levenberg-Marquardt iteration that holds parameters on a bound while the gradient points outwards.
+
+The fitted parameters are returned in the (b, c, d, f) form of default_survival_parameters, so they can be passed
+straight to the pratio engine, the runner and the manifests.
+
+"""
+import numpy as np
+
+import gene_dup_survival
+
+###########################################################################
+#initialize parameters
+#strict inequalities are kept this far inside the bound
+bound_margin = 1e-12
+
+#per category: bounds on the fitted parameters, parameters held fixed (None holds it at its starting value), and
+#parameters tied to another one (d = -f is written 'd': ('f', -1.0), i.e. d is -1.0 times f)
+#with b = 0 Non survival is exp(-(d + f)*t), so only d + f can be fitted and f is held where it starts
+category_constraints = {
+    'alt_func': {'bounds': {'b': (bound_margin, np.inf), 'c': (bound_margin, np.inf), 'd': (bound_margin, np.inf), 'f': (bound_margin, np.inf)},
+                 'fixed': {}, 'tied': {}},
+    'dos': {'bounds': {'b': (-np.inf, -bound_margin), 'c': (bound_margin, 1 - bound_margin), 'f': (-np.inf, np.inf)},
+            'fixed': {}, 'tied': {'d': ('f', -1.0)}},
+    'non': {'bounds': {'d': (10 + bound_margin, np.inf)},
+            'fixed': {'b': 0.0, 'c': 1.0, 'f': None}, 'tied': {}},
+    }
+
+parameter_names = ('b', 'c', 'd', 'f')
+
+#optimizer settings
+max_iterations = 200
+cost_tolerance = 1e-12
+step_tolerance = 1e-10
+initial_damping = 1e-3
+#no parameter moves by more than this fraction of its magnitude (or of its starting magnitude, near 0) in one step
+max_relative_step = 0.5
+
+
+###########################################################################
+#Functions
+
+def free_parameter_names(category):
+    #parameters the optimizer moves for a category, in (b, c, d, f) order
+    constraints = category_constraints[category]
+    return [name for name in parameter_names if name not in constraints['fixed'] and name not in constraints['tied']]
+
+def full_parameters(category, free_values, initial_parameters):
+    #(b, c, d, f) from the free parameter values, adding the fixed and tied ones
+    constraints = category_constraints[category]
+    values = dict(zip(free_parameter_names(category), free_values))
+    for name, value in constraints['fixed'].items():
+        values[name] = initial_parameters[parameter_names.index(name)] if value is None else value
+    for name, (source, factor) in constraints['tied'].items():
+        values[name] = factor * values[source]
+    return tuple(float(values[name]) for name in parameter_names)
+
+def free_parameter_jacobian(category, jacobian):
+    #derivatives with respect to the free parameters from those with respect to (b, c, d, f), shape (..., free)
+    #a tied parameter adds its derivative, times its factor, to the parameter it is tied to
+    constraints = category_constraints[category]
+    columns = {name: jacobian[..., k] for k, name in enumerate(parameter_names)}
+    for name, (source, factor) in constraints['tied'].items():
+        columns[source] = columns[source] + factor * columns[name]
+    return np.stack([columns[name] for name in free_parameter_names(category)], axis=-1)
+
+def free_parameter_bounds(category):
+    #(lower, upper) arrays for the free parameters
+    bounds = category_constraints[category]['bounds']
+    names = free_parameter_names(category)
+    return np.array([bounds[name][0] for name in names]), np.array([bounds[name][1] for name in names])
+
+def project_to_bounds(category, free_values):
+    lower, upper = free_parameter_bounds(category)
+    return np.clip(free_values, lower, upper)
+
+def initial_free_values(category, initial_parameters):
+    #starting point: the free parameters of the given (b, c, d, f), moved inside their bounds
+    values = dict(zip(parameter_names, initial_parameters))
+    return project_to_bounds(category, np.array([values[name] for name in free_parameter_names(category)], dtype=float))
+
+def survival_residuals(category, free_values, initial_parameters, ages, observed, weights, n_max):
+    #weighted residuals sqrt(w)*(s(t) - observed) and their Jacobian with respect to the free parameters
+    survival, jacobian = gene_dup_survival.calculate_survival_jacobian(*full_parameters(category, free_values, initial_parameters), ages, n_max)
+    root_weights = np.sqrt(weights)
+    residuals = root_weights * (survival - observed)
+    return residuals, root_weights[:, np.newaxis] * free_parameter_jacobian(category, jacobian)
+
+def aggregate_by_age(ages, observed, weights):
+    #one weighted observation per distinct age: sum_i w_i*(s(t) - y_i)**2 = W*(s(t) - y_w)**2 + sum_i w_i*y_i**2 - W*y_w**2,
+    #so the fit is unchanged; returns (ages, observed, weights, constant) with constant the dropped part of the cost
+    distinct_ages, inverse = np.unique(ages, return_inverse=True)
+    total_weights = np.bincount(inverse, weights)
+    weighted_sums = np.bincount(inverse, weights * observed)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        weighted_means = np.where(total_weights > 0, weighted_sums / total_weights, 0.0)
+    constant = max(0.0, float(np.dot(weights, observed**2) - np.dot(total_weights, weighted_means**2)))
+    return distinct_ages, weighted_means, total_weights, constant
+
+def fit_survival_parameters(category, ages, retained, totals=None, initial_parameters=None, n_max=gene_dup_survival.n_max, max_iterations=max_iterations):
+    #least squares fit of one category's survival curve to observed retention by age
+    #retained is the retained fraction at each age, or with totals the retained count out of totals (weights = totals);
+    #observations are pooled by distinct age first, so per-gene data costs no more than the number of distinct ages
+    #returns a dict: 'parameters' (b, c, d, f), 'cost' (half the weighted sum of squared residuals), 'iterations', 'converged'
+    if initial_parameters is None:
+        initial_parameters = gene_dup_survival.default_survival_parameters[category]
+    ages = np.asarray(ages, dtype=float).ravel()
+    retained = np.asarray(retained, dtype=float).ravel()
+    if totals is None:
+        observed, weights = retained, np.ones(ages.shape)
+    else:
+        weights = np.asarray(totals, dtype=float).ravel()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            observed = np.where(weights > 0, retained / weights, 0.0)
+    ages, observed, weights, constant = aggregate_by_age(ages, observed, weights)
+    lower, upper = free_parameter_bounds(category)
+    free_values = initial_free_values(category, initial_parameters)
+    typical_magnitude = np.where(free_values != 0, np.abs(free_values), 1.0)
+    residuals, jacobian = survival_residuals(category, free_values, initial_parameters, ages, observed, weights, n_max)
+    cost = 0.5 * np.dot(residuals, residuals)
+    damping = initial_damping
+    converged = False
+    iteration = 0
+    for iteration in range(1, max_iterations + 1):
+        gradient = jacobian.T @ residuals
+        #parameters on a bound that the gradient pushes outwards stay there; the step is solved for the others
+        active = ((free_values <= lower) & (gradient > 0)) | ((free_values >= upper) & (gradient < 0))
+        moving = ~active
+        step = np.zeros(free_values.shape)
+        if not np.any(moving):
+            converged = True
+            break
+        normal = jacobian[:, moving].T @ jacobian[:, moving]
+        scale = np.maximum(np.diag(normal), np.finfo(float).tiny)
+        try:
+            step[moving] = np.linalg.solve(normal + damping * np.diag(scale), -gradient[moving])
+        except np.linalg.LinAlgError:
+            damping *= 10
+            continue
+        largest_step = max_relative_step * np.maximum(np.abs(free_values), typical_magnitude)
+        step = np.clip(step, -largest_step, largest_step)
+        candidate = np.clip(free_values + step, lower, upper)
+        candidate_residuals, candidate_jacobian = survival_residuals(category, candidate, initial_parameters, ages, observed, weights, n_max)
+        candidate_cost = 0.5 * np.dot(candidate_residuals, candidate_residuals)
+        if np.isfinite(candidate_cost) and candidate_cost <= cost:
+            small_step = np.all(np.abs(candidate - free_values) <= step_tolerance * (np.abs(free_values) + step_tolerance))
+            small_decrease = cost - candidate_cost <= cost_tolerance * max(cost + 0.5 * constant, np.finfo(float).tiny)
+            free_values, residuals, jacobian, cost = candidate, candidate_residuals, candidate_jacobian, candidate_cost
+            damping = max(damping / 3, 1e-12)
+            if small_step or small_decrease:
+                converged = True
+                break
+        else:
+            damping *= 4
+            if damping > 1e12:
+                converged = True
+                break
+    return {'parameters': full_parameters(category, free_values, initial_parameters), 'cost': float(cost + 0.5 * constant), 'iterations': iteration, 'converged': converged}
+
+def fit_category_survival_parameters(observations, initial_parameters=None, n_max=gene_dup_survival.n_max):
+    #fit every category present in observations, a dict of category name -> (ages, retained) or (ages, retained, totals)
+    #returns (parameters, fits): parameters in the form of default_survival_parameters (categories without observations
+    #keep their initial or default values) and the fit dict of each fitted category
+    if initial_parameters is None:
+        initial_parameters = gene_dup_survival.default_survival_parameters
+    parameters = {name: tuple(initial_parameters[name]) for name in gene_dup_survival.category_names}
+    fits = {}
+    for name, observation in observations.items():
+        ages, retained = observation[0], observation[1]
+        totals = observation[2] if len(observation) > 2 else None
+        fits[name] = fit_survival_parameters(name, ages, retained, totals, parameters[name], n_max)
+        parameters[name] = fits[name]['parameters']
+    return parameters, fits
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""
+Time grids for t1 and t2.
+
+Purpose:
+    1) Uniform grids computed exactly: every point is start + i*step in rational arithmetic, rounded to float once,
+       so 0.07 is the float 0.07 (repeatedly adding 0.01 drifts, e.g. to 0.060000000000000005).
+    2) Log-spaced grids, which put most of the points near t = 0 where Non collapses and most of the pratio
+       structure is, and explicit grids given as a list of times.
+    3) Adaptive refinement: start from a coarse grid and add midpoints only in the intervals where the pratio
+       surface (on the log10 scale) still changes faster than a tolerance, so near-uniform regions stay coarse.
+       Survival is pointwise in t, so each refinement round only evaluates the survival kernel at the new points.
+
+Grid specs (as used by manifests and the submission scripts):
+    [0.01, 0.02, 0.05]                                               explicit times
+    {"start": 0.01, "step": 0.01, "count": 51}                       uniform (kind "uniform" may be omitted)
+    {"kind": "log", "start": 0.001, "stop": 0.5, "count": 51}        log-spaced, "zero": true also adds t = 0
+    {"kind": "adaptive", "initial": <spec>, "tolerance": 0.01, "max_points": 201}
+
+"""
+import decimal
+import fractions
+
+import numpy as np
+
+import gene_dup_pratio
+import gene_dup_profile
+import gene_dup_survival
+
+###########################################################################
+#initialize parameters
+#adaptive refinement: largest accepted change of log10 pratio across a midpoint, beyond linear interpolation
+refinement_tolerance = 0.01
+max_refinement_points = 201
+max_refinement_rounds = 12
+
+
+###########################################################################
+#Functions
+
+def exact_number(value):
+    #Fraction equal to the decimal a number is written as (0.01 -> 1/100, not the binary float nearest to it)
+    if isinstance(value, fractions.Fraction):
+        return value
+    if isinstance(value, (float, np.floating)):
+        return fractions.Fraction(repr(float(value)))
+    if isinstance(value, decimal.Decimal):
+        return fractions.Fraction(value)
+    return fractions.Fraction(str(value))
+
+def uniform_grid(start, step, count):
+    #start + i*step for i in range(count), each point exact and then rounded to the nearest float
+    start = exact_number(start)
+    step = exact_number(step)
+    return np.array([float(start + i*step) for i in range(int(count))])
+
+def log_grid(start, stop, count, zero=False):
+    #count points spaced evenly in log(t) from start to stop (both > 0), with t = 0 in front when zero is set
+    if start <= 0 or stop <= start:
+        raise ValueError('log grid needs 0 < start < stop, got ' + str(start) + ' and ' + str(stop))
+    grid = np.geomspace(start, stop, int(count))
+    return np.concatenate(([0.0], grid)) if zero else grid
+
+def explicit_grid(times):
+    #times as a float array, which must be finite, non-negative and strictly increasing
+    grid = np.array([float(exact_number(t)) for t in times])
+    if grid.ndim != 1 or grid.size == 0:
+        raise ValueError('a time grid needs at least one time')
+    if not np.all(np.isfinite(grid)) or grid[0] < 0 or np.any(np.diff(grid) <= 0):
+        raise ValueError('times must be finite, non-negative and strictly increasing')
+    return grid
+
+def time_grid_from_spec(spec):
+    #float array for a non-adaptive grid spec (see the module docstring)
+    if not isinstance(spec, dict):
+        return explicit_grid(spec)
+    kind = spec.get('kind', 'uniform')
+    if kind == 'uniform':
+        return uniform_grid(spec['start'], spec['step'], spec['count'])
+    if kind == 'log':
+        return log_grid(spec['start'], spec['stop'], spec['count'], spec.get('zero', False))
+    if kind == 'explicit':
+        return explicit_grid(spec['times'])
+    if kind == 'adaptive':
+        raise ValueError('an adaptive grid depends on the scenario, use resolve_time_grid')
+    raise ValueError('unknown time grid kind ' + repr(kind))
+
+def grid_spec_size(spec):
+    #number of points a spec gives (at most, for adaptive specs), known without building the grid
+    if not isinstance(spec, dict):
+        return len(spec)
+    kind = spec.get('kind', 'uniform')
+    if kind == 'uniform':
+        return int(spec['count'])
+    if kind == 'log':
+        return int(spec['count']) + (1 if spec.get('zero', False) else 0)
+    if kind == 'explicit':
+        return len(spec['times'])
+    if kind == 'adaptive':
+        return max(grid_spec_size(spec['initial']), int(spec.get('max_points', max_refinement_points)))
+    raise ValueError('unknown time grid kind ' + repr(kind))
+
+def is_adaptive(spec):
+    return isinstance(spec, dict) and spec.get('kind') == 'adaptive'
+
+def patched_category_survival(time_range, parameters, n_max):
+    #survival vectors with s(0) replaced by survival_immediately_post_wgd, as in calculate_scenario_surface
+    curves = gene_dup_survival.calculate_category_survival_curves(time_range, parameters, n_max)
+    return {name: gene_dup_survival.patch_survival_immediately_post_wgd(curve, time_range) for name, curve in curves.items()}
+
+def midpoint_deviation(values, axis):
+    #|value at each midpoint - mean of its two neighbours| along axis, where odd indices are the midpoints; max over the other axis
+    values = np.moveaxis(values, axis, 0)
+    with np.errstate(invalid='ignore'):
+        deviation = np.abs(values[1::2] - (values[0:-1:2] + values[2::2]) / 2)
+    deviation = np.where(np.isfinite(deviation), deviation, 0.0)
+    return deviation.max(axis=1)
+
+def refine_time_grid(initial_grid, composition, switch=0.0, parameters=None, n_max=gene_dup_survival.n_max,
+                     tolerance=refinement_tolerance, max_points=max_refinement_points, max_rounds=max_refinement_rounds):
+    #shared t1/t2 grid refined where log10 pratio deviates from linear interpolation by more than tolerance
+    #each round evaluates the surface on the grid plus every interval midpoint and keeps the midpoints whose deviation
+    #(along t1 or t2, whichever is larger) exceeds tolerance, largest first, until max_points is reached
+    if parameters is None:
+        parameters = gene_dup_survival.default_survival_parameters
+    grid = np.asarray(initial_grid, dtype=float)
+    survival = patched_category_survival(grid, parameters, n_max)
+    alt_func_percent, dos_percent, non_percent = composition
+    for _ in range(max_rounds):
+        if grid.size < 2 or grid.size >= max_points:
+            break
+        midpoints = (grid[:-1] + grid[1:]) / 2
+        midpoint_survival = patched_category_survival(midpoints, parameters, n_max)
+        combined = np.empty(2*grid.size - 1)
+        combined[0::2] = grid
+        combined[1::2] = midpoints
+        combined_survival = {}
+        for name in gene_dup_survival.category_names:
+            combined_survival[name] = np.empty(combined.size)
+            combined_survival[name][0::2] = survival[name]
+            combined_survival[name][1::2] = midpoint_survival[name]
+        with np.errstate(divide='ignore'):
+            surface = np.log10(gene_dup_pratio.calculate_pratio_surface(combined_survival, combined_survival, alt_func_percent, dos_percent, non_percent, switch))
+        deviation = np.maximum(midpoint_deviation(surface, 0), midpoint_deviation(surface, 1))
+        candidates = np.flatnonzero(deviation > tolerance)
+        if candidates.size == 0:
+            break
+        accepted = candidates[np.argsort(deviation[candidates])[::-1][:max_points - grid.size]]
+        keep = np.zeros(combined.size, dtype=bool)
+        keep[0::2] = True
+        keep[2*accepted + 1] = True
+        grid = combined[keep]
+        survival = {name: curve[keep] for name, curve in combined_survival.items()}
+    return grid
+
+def resolve_time_grid(spec, composition, switch=0.0, parameters=None, n_max=gene_dup_survival.n_max):
+    #float array for any grid spec; adaptive specs are refined for the given scenario
+    if not is_adaptive(spec):
+        return time_grid_from_spec(spec)
+    with gene_dup_profile.stage('grid_refinement'):
+        return refine_time_grid(time_grid_from_spec(spec['initial']), composition, switch, parameters, n_max,
+                                spec.get('tolerance', refinement_tolerance), spec.get('max_points', max_refinement_points), spec.get('max_rounds', max_refinement_rounds))
@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+"""
+Infer the category fractions (Alpha_Alt_func, Alpha_Dos, Alpha_Non) and the switch from observed pratio surfaces.
+
+Purpose:
+    1) Precompute, once per t1/t2 grid and survival parameters, the basis terms the pratio is built from, so a
+       candidate composition and switch costs a few small matrix products instead of a forward rerun.
+    2) Fit the composition on the simplex, plus the switch in [0, 1] (or with the switch held at 0 for the
+       duplicability model), to many observed surfaces at once.
+
+With r_k = 2*s1_k and l_k = 1 - s1_k on the t1 grid and s2_k on the t2 grid (k = alt_func, dos, non):
+    N = sum_k Alpha_k*r_k*s2_k + Alpha_Alt_func*switch*r_alt*(s2_non - s2_alt)      (retained in t1, survived t2)
+    D = sum_k Alpha_k*l_k*s2_k                                                        (lost in t1, survived t2)
+    L = sum_k Alpha_k*l_k,  R = sum_k Alpha_k*r_k                                      (t1 only)
+    pratio = (N/D)*(L/R)
+N is linear in (Alpha_Alt_func, Alpha_Alt_func*switch, Alpha_Dos, Alpha_Non) and D, L and R are linear in the
+fractions, so the basis is a handful of (q1 x q2) and q1 arrays and the derivatives of log pratio are exact.
+
+Fitting (least squares on log10 pratio, optionally weighted per cell, e.g. by counts):
+    1) every dataset is scored against a grid of compositions x switches in one matrix product, which gives the
+       starting point;
+    2) a batched Gauss-Newton iteration refines all datasets together, projecting the fractions back onto the
+       simplex and the switch into [0, 1] after every step.
+
+"""
+import numpy as np
+
+import gene_dup_cache
+import gene_dup_pratio
+import gene_dup_survival
+
+###########################################################################
+#initialize parameters
+#starting grid: compositions on multiples of grid_step, crossed with the switch values
+grid_step = 0.05
+grid_switches = np.linspace(0.0, 1.0, 11)
+
+#Gauss-Newton refinement
+refinement_iterations = 50
+initial_damping = 1e-3
+#a dataset stops once a step lowers its cost by less than this fraction
+cost_tolerance = 1e-10
+
+
+###########################################################################
+#Functions
+
+def project_to_simplex(values):
+    #Euclidean projection of each row of values (..., 3) onto {x >= 0, sum x = 1}
+    values = np.asarray(values, dtype=float)
+    ordered = -np.sort(-values, axis=-1)
+    cumulative = np.cumsum(ordered, axis=-1) - 1
+    index = np.arange(1, values.shape[-1] + 1)
+    support = ordered - cumulative / index > 0
+    count = support.sum(axis=-1, keepdims=True)
+    threshold = np.take_along_axis(cumulative, count - 1, axis=-1) / count
+    return np.maximum(values - threshold, 0.0)
+
+class PratioBasis:
+    #basis terms of the pratio surface on one t1 x t2 grid for one set of survival parameters
+    def __init__(self, t1_range, t2_range=None, parameters=None, n_max=gene_dup_survival.n_max, cache=None):
+        if t2_range is None:
+            t2_range = t1_range
+        self.t1_range = np.asarray(t1_range, dtype=float)
+        self.t2_range = np.asarray(t2_range, dtype=float)
+        st1 = gene_dup_cache.calculate_cached_category_survival_curves(self.t1_range, parameters, n_max, cache)
+        st2 = gene_dup_cache.calculate_cached_category_survival_curves(self.t2_range, parameters, n_max, cache)
+        s1 = np.stack([gene_dup_survival.patch_survival_immediately_post_wgd(curve, self.t1_range) for curve in gene_dup_pratio.survival_vectors(st1)], axis=-1)
+        s2 = np.stack([gene_dup_survival.patch_survival_immediately_post_wgd(curve, self.t2_range) for curve in gene_dup_pratio.survival_vectors(st2)], axis=0)
+        #(q1, 3) t1 weights, (3, q2) t2 survival, and the (q1, q2) change of N per unit of Alpha_Alt_func*switch
+        self.retained_t1 = 2 * s1
+        self.lost_t1 = 1 - s1
+        self.survival_t2 = s2
+        self.switch_term = self.retained_t1[:, 0, np.newaxis] * (s2[2] - s2[0])[np.newaxis, :]
+        #(3, q1, q2) contributions of each fraction to N and D
+        self.retained_terms = self.retained_t1.T[:, :, np.newaxis] * s2[:, np.newaxis, :]
+        self.lost_terms = self.lost_t1.T[:, :, np.newaxis] * s2[:, np.newaxis, :]
+        self._candidates = {}
+
+    @property
+    def shape(self):
+        return (self.t1_range.size, self.t2_range.size)
+
+    def components(self, compositions, switches):
+        #N, D (shape (P, q1, q2)) and L, R (shape (P, q1)) for P compositions (P, 3) and switches (P,)
+        compositions = np.asarray(compositions, dtype=float).reshape(-1, 3)
+        switches = np.asarray(switches, dtype=float).reshape(-1)
+        q1, q2 = self.shape
+        numerator = (compositions @ self.retained_terms.reshape(3, -1)).reshape(-1, q1, q2)
+        numerator += (compositions[:, 0] * switches)[:, np.newaxis, np.newaxis] * self.switch_term
+        denominator = (compositions @ self.lost_terms.reshape(3, -1)).reshape(-1, q1, q2)
+        lost = compositions @ self.lost_t1.T
+        retained = compositions @ self.retained_t1.T
+        return numerator, denominator, lost, retained
+
+    def log10_pratio(self, compositions, switches):
+        #log10 pratio surfaces, shape (P, q1, q2), for P compositions and switches
+        numerator, denominator, lost, retained = self.components(compositions, switches)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return (np.log(numerator) - np.log(denominator) + (np.log(lost) - np.log(retained))[:, :, np.newaxis]) / np.log(10)
+
+    def log10_pratio_jacobian(self, compositions, switches):
+        #log10 pratio (P, q1, q2) and its derivatives with respect to (Alpha_Alt_func, Alpha_Dos, Alpha_Non, switch),
+        #shape (P, q1, q2, 4), all exact since every component is linear in the fractions
+        compositions = np.asarray(compositions, dtype=float).reshape(-1, 3)
+        switches = np.asarray(switches, dtype=float).reshape(-1)
+        numerator, denominator, lost, retained = self.components(compositions, switches)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            log_surface = (np.log(numerator) - np.log(denominator) + (np.log(lost) - np.log(retained))[:, :, np.newaxis]) / np.log(10)
+            d_numerator = np.broadcast_to(self.retained_terms, (compositions.shape[0],) + self.retained_terms.shape).copy()
+            d_numerator[:, 0] += switches[:, np.newaxis, np.newaxis] * self.switch_term
+            jacobian = np.empty(log_surface.shape + (4,))
+            for k in range(3):
+                jacobian[..., k] = (d_numerator[:, k] / numerator - self.lost_terms[k] / denominator
+                                    + (self.lost_t1[:, k] / lost - self.retained_t1[:, k] / retained)[:, :, np.newaxis])
+            jacobian[..., 3] = compositions[:, 0, np.newaxis, np.newaxis] * self.switch_term / numerator
+        return log_surface, jacobian / np.log(10)
+
+    def candidate_predictions(self, fit_switch=True, step=grid_step, switches=grid_switches):
+        #starting grid (compositions, switches) with its log10 pratio p, shape (P, q1*q2), p**2 and a 0/1 mask of the
+        #cells where p is not finite (where p and p**2 are set to 0); computed on first use and then kept, so repeated
+        #fits on the same grid skip it
+        key = (bool(fit_switch), float(step), tuple(np.asarray(switches, dtype=float).tolist()))
+        if key not in self._candidates:
+            compositions, candidate_switches = candidate_grid(fit_switch, step, switches)
+            predicted = self.log10_pratio(compositions, candidate_switches).reshape(compositions.shape[0], -1)
+            finite = np.isfinite(predicted)
+            predicted = np.where(finite, predicted, 0.0)
+            self._candidates[key] = (compositions, candidate_switches, predicted, predicted**2, (~finite).astype(float))
+        return self._candidates[key]
+
+def observed_log10_pratio(observed, weights=None):
+    #(B, cells) log10 observations and weights from (q1, q2) or (B, q1, q2) pratio surfaces; cells whose pratio is not a
+    #positive finite number get weight 0
+    observed = np.asarray(observed, dtype=float)
+    observed = observed.reshape((-1,) + observed.shape[-2:])
+    weights = np.ones(observed.shape) if weights is None else np.broadcast_to(np.asarray(weights, dtype=float), observed.shape)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        log_observed = np.log10(observed)
+    usable = np.isfinite(log_observed) & (weights > 0)
+    number = observed.shape[0]
+    return np.where(usable, log_observed, 0.0).reshape(number, -1), np.where(usable, weights, 0.0).reshape(number, -1)
+
+def candidate_grid(fit_switch=True, step=grid_step, switches=grid_switches):
+    #(compositions (P, 3), switches (P,)) of the starting grid
+    compositions = gene_dup_pratio.composition_simplex_grid(step)
+    switches = np.asarray(switches, dtype=float) if fit_switch else np.zeros(1)
+    return np.repeat(compositions, switches.size, axis=0), np.tile(switches, compositions.shape[0])
+
+def fit_composition_and_switch(observed, basis, weights=None, fit_switch=True, iterations=refinement_iterations, step=grid_step, switches=grid_switches):
+    #least squares fit of log10 pratio for one observed surface (q1, q2) or a batch (B, q1, q2) on the grid of basis
+    #weights (same shape, or broadcastable) weight each cell, e.g. by the number of gene pairs behind it
+    #returns a dict of arrays over the batch: 'composition' (B, 3), 'switch' (B,), 'cost' (B,), half the weighted sum of
+    #squared log10 residuals
+    log_observed, weights = observed_log10_pratio(observed, weights)
+    number = log_observed.shape[0]
+
+    #starting point: best grid candidate for each dataset, sum w*(y - p)**2 = sum w*y**2 - 2*(w*y).p + w.p**2
+    candidate_compositions, candidate_switches, predicted, predicted_squared, not_finite = basis.candidate_predictions(fit_switch, step, switches)
+    scores = (weights * log_observed**2).sum(axis=1)[:, np.newaxis] - 2 * (weights * log_observed) @ predicted.T + weights @ predicted_squared.T
+    scores = np.where(weights @ not_finite.T > 0, np.inf, scores)
+    best = np.argmin(scores, axis=1)
+    compositions = candidate_compositions[best].copy()
+    switch_values = candidate_switches[best].copy()
+
+    #Gauss-Newton refinement of (Alpha_Alt_func, Alpha_Dos, switch) with Alpha_Non = 1 - Alpha_Alt_func - Alpha_Dos;
+    #each dataset leaves the batch once a step no longer lowers its cost noticeably
+    free = 3 if fit_switch else 2
+
+    def evaluate(compositions, switch_values, selected):
+        log_surface, jacobian = basis.log10_pratio_jacobian(compositions, switch_values)
+        cell_weights = weights[selected]
+        residuals = log_surface.reshape(selected.size, -1) - log_observed[selected]
+        jacobian = jacobian.reshape(selected.size, -1, 4)
+        #on the simplex, moving Alpha_Alt_func or Alpha_Dos moves Alpha_Non the opposite way
+        reduced = np.stack([jacobian[..., 0] - jacobian[..., 2], jacobian[..., 1] - jacobian[..., 2], jacobian[..., 3]], axis=-1)[..., :free]
+        residuals = np.where(cell_weights > 0, residuals, 0.0)
+        reduced = np.where(cell_weights[..., np.newaxis] > 0, reduced, 0.0)
+        cost = 0.5 * (cell_weights * residuals**2).sum(axis=1)
+        return residuals, reduced, cost
+
+    everything = np.arange(number)
+    residuals, reduced, cost = evaluate(compositions, switch_values, everything)
+    damping = np.full(number, initial_damping)
+    active = everything
+    for _ in range(iterations):
+        if active.size == 0:
+            break
+        weighted = reduced * weights[active][..., np.newaxis]
+        normal = np.einsum('bcj,bck->bjk', weighted, reduced)
+        gradient = np.einsum('bcj,bc->bj', weighted, residuals)
+        diagonal = np.einsum('bjj->bj', normal)
+        #a parameter the data do not constrain (the switch when Alpha_Alt_func = 0) keeps a small positive diagonal
+        diagonal = np.maximum(diagonal, 1e-12 * diagonal.max(axis=1, keepdims=True) + 1e-300)
+        system = normal + damping[active][:, np.newaxis, np.newaxis] * (diagonal[:, :, np.newaxis] * np.eye(free))
+        step_values = -np.linalg.solve(system, gradient[..., np.newaxis])[..., 0]
+        candidate = compositions[active] + np.stack([step_values[:, 0], step_values[:, 1], -step_values[:, 0] - step_values[:, 1]], axis=-1)
+        candidate = project_to_simplex(candidate)
+        candidate_switches = np.clip(switch_values[active] + step_values[:, 2], 0.0, 1.0) if fit_switch else switch_values[active]
+        candidate_residuals, candidate_reduced, candidate_cost = evaluate(candidate, candidate_switches, active)
+        better = np.isfinite(candidate_cost) & (candidate_cost <= cost[active])
+        finished = (better & (cost[active] - candidate_cost <= cost_tolerance * cost[active])) | (~better & (damping[active] > 1e12))
+        accepted = active[better]
+        compositions[accepted] = candidate[better]
+        switch_values[accepted] = candidate_switches[better]
+        cost[accepted] = candidate_cost[better]
+        damping[active] = np.where(better, np.maximum(damping[active] / 3, 1e-12), damping[active] * 4)
+        residuals = np.where(better[:, np.newaxis], candidate_residuals, residuals)[~finished]
+        reduced = np.where(better[:, np.newaxis, np.newaxis], candidate_reduced, reduced)[~finished]
+        active = active[~finished]
+    return {'composition': compositions, 'switch': switch_values, 'cost': cost}
@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+"""
+Output backends for pratio surfaces.
+
+Purpose:
+    1) Write a PratioSurface as the long format csv of the Oct 2023 script (one row per (t1, t2) cell) or as the
+       t1 x t2 matrix csv of the Dec 2022 scripts.
+    2) Write a PratioSurface in a columnar binary format: a directory holding one .npy file per array
+       (pratio surface, t1 and t2 grids, survival vectors) and a small metadata.json header with the model
+       parameters, composition, switch, grid size and n_max.
+    3) Read the binary format back with memory-mapped arrays, so nothing is parsed and only the parts that are
+       used are paged in from disk.
+    4) Out-of-core computation of very large surfaces: write_tiled_pratio_surface computes the t1 x t2 surface in
+       bands of t1 rows no larger than max_block_cells cells, streams each band into the memory-mapped .npy file
+       (and optionally the long format csv) and keeps peak memory bounded whatever q is.
+
+"""
+import csv
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+import gene_dup_pratio
+import gene_dup_profile
+import gene_dup_survival
+
+###########################################################################
+#initialize parameters
+binary_format_version = 1
+binary_suffix = '.gdsurf'
+metadata_file_name = 'metadata.json'
+
+#cells (t1 x t2) computed at once by write_tiled_pratio_surface, about 100 MB of float64 intermediates
+max_block_cells = 2**21
+
+
+###########################################################################
+#Functions
+
+def write_pratio_surface_csv(surface, file_name_full, columns=gene_dup_pratio.long_format_column_names):
+    #long format csv with a header row, rows in t1-major order
+    values = surface.long_format_columns(columns)
+    write_columns_csv(file_name_full, columns, list(values.values()))
+
+def write_columns_csv(file_name_full, columns, values):
+    #csv with a header row and one row per element of the equally shaped value arrays (flattened in C order)
+    return write_rows_csv(file_name_full, [list(columns)] + np.column_stack([np.ravel(value) for value in values]).tolist())
+
+def write_surface_matrix_csv(surface, file_name_full, scale='pratio'):
+    #the t1 x t2 surface as a matrix csv without a header: one row per t1 value, one column per t2 value
+    return write_rows_csv(file_name_full, surface.surface(scale).tolist())
+
+def write_rows_csv(file_name_full, rows):
+    #csv of the given rows, written to a temporary file and renamed, so an interrupted run never leaves a truncated csv behind
+    handle, temporary_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(file_name_full)), suffix='.tmp')
+    try:
+        with os.fdopen(handle, 'w', newline='') as file:
+            writer = csv.writer(file, delimiter=',')
+            writer.writerows(rows)
+        os.replace(temporary_path, file_name_full)
+    except BaseException:
+        os.remove(temporary_path)
+        raise
+    return file_name_full
+
+def surface_metadata(surface):
+    #json-serializable description of a PratioSurface (everything except the arrays)
+    return {
+        'format_version': binary_format_version,
+        'alt_func_percent': float(surface.alt_func_percent),
+        'dos_percent': float(surface.dos_percent),
+        'non_percent': float(surface.non_percent),
+        'alt_switch_percent': float(surface.alt_switch_percent),
+        'parameters': {name: [float(x) for x in values] for name, values in surface.parameters.items()},
+        'n_max': None if surface.n_max is None else int(surface.n_max),
+        'shape': [int(x) for x in surface.shape],
+        't1_range': [float(surface.t1_range[0]), float(surface.t1_range[-1])],
+        't2_range': [float(surface.t2_range[0]), float(surface.t2_range[-1])],
+        }
+
+def surface_arrays(surface):
+    #arrays of a PratioSurface keyed by the .npy file name they are stored under
+    arrays = {'pratio': surface.pratio, 't1_range': surface.t1_range, 't2_range': surface.t2_range}
+    for name in gene_dup_survival.category_names:
+        arrays['st1_' + name] = surface.st1[name]
+        arrays['st2_' + name] = surface.st2[name]
+    return arrays
+
+def save_pratio_surface(surface, path, extra_metadata=None):
+    #binary columnar format: a directory of .npy files plus metadata.json
+    #written to a temporary directory next to path and renamed into place, so readers never see a partial result
+    parent = os.path.dirname(os.path.abspath(path))
+    os.makedirs(parent, exist_ok=True)
+    temporary_path = tempfile.mkdtemp(dir=parent, prefix='.tmp_')
+    try:
+        for name, array in surface_arrays(surface).items():
+            np.save(os.path.join(temporary_path, name + '.npy'), np.ascontiguousarray(array))
+        metadata = surface_metadata(surface)
+        if extra_metadata:
+            metadata.update(extra_metadata)
+        with open(os.path.join(temporary_path, metadata_file_name), 'w') as file:
+            json.dump(metadata, file, indent=1)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        os.replace(temporary_path, path)
+    except BaseException:
+        shutil.rmtree(temporary_path, ignore_errors=True)
+        raise
+
+def link_or_copy(source, destination):
+    #hard link (the .npy files of an entry are never rewritten in place), or a copy where links are not possible
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copy2(source, destination)
+
+def copy_pratio_surface(source_path, path, extra_metadata=None):
+    #binary format surface at source_path copied (hard-linked where possible) to path, atomically like save_pratio_surface
+    parent = os.path.dirname(os.path.abspath(path))
+    os.makedirs(parent, exist_ok=True)
+    temporary_path = tempfile.mkdtemp(dir=parent, prefix='.tmp_')
+    try:
+        for entry in os.listdir(source_path):
+            if entry.endswith('.npy'):
+                link_or_copy(os.path.join(source_path, entry), os.path.join(temporary_path, entry))
+        metadata = read_metadata(source_path)
+        if extra_metadata:
+            metadata.update(extra_metadata)
+        with open(os.path.join(temporary_path, metadata_file_name), 'w') as file:
+            json.dump(metadata, file, indent=1)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        os.replace(temporary_path, path)
+    except BaseException:
+        shutil.rmtree(temporary_path, ignore_errors=True)
+        raise
+
+def read_metadata(path):
+    with open(os.path.join(path, metadata_file_name)) as file:
+        return json.load(file)
+
+def load_pratio_surface(path, mmap_mode='r'):
+    #PratioSurface whose arrays are memory-mapped from the .npy files (mmap_mode=None reads them into memory)
+    with gene_dup_profile.stage('binary_read'):
+        metadata = read_metadata(path)
+    if metadata.get('format_version') != binary_format_version:
+        raise ValueError('unsupported pratio surface format version ' + repr(metadata.get('format_version')) + ' in ' + path)
+    arrays = {}
+    with gene_dup_profile.stage('binary_read'):
+        for entry in os.listdir(path):
+            if entry.endswith('.npy'):
+                arrays[entry[:-4]] = np.load(os.path.join(path, entry), mmap_mode=mmap_mode)
+    st1 = {name: arrays['st1_' + name] for name in gene_dup_survival.category_names}
+    st2 = {name: arrays['st2_' + name] for name in gene_dup_survival.category_names}
+    return gene_dup_pratio.PratioSurface(arrays['t1_range'], arrays['t2_range'], st1, st2, arrays['pratio'],
+                                         metadata['alt_func_percent'], metadata['dos_percent'], metadata['non_percent'], metadata['alt_switch_percent'],
+                                         metadata['parameters'], metadata['n_max'])
+
+def write_pratio_surface(surface, file_name, output_format='csv'):
+    #write file_name + '.csv' or file_name + binary_suffix and return the path written
+    if output_format == 'csv':
+        path = file_name + '.csv'
+        with gene_dup_profile.stage('csv_write'):
+            write_pratio_surface_csv(surface, path)
+    elif output_format == 'npy':
+        path = file_name + binary_suffix
+        with gene_dup_profile.stage('binary_write'):
+            save_pratio_surface(surface, path)
+    else:
+        raise ValueError('unknown output format ' + repr(output_format))
+    return path
+
+def band_surface(surface, start, stop):
+    #PratioSurface of the t1 rows start:stop of surface (views, so a memory-mapped surface is only paged in band by band)
+    return gene_dup_pratio.PratioSurface(surface.t1_range[start:stop], surface.t2_range, {name: curve[start:stop] for name, curve in surface.st1.items()}, surface.st2,
+                                         surface.pratio[start:stop], surface.alt_func_percent, surface.dos_percent, surface.non_percent,
+                                         surface.alt_switch_percent, surface.parameters, surface.n_max)
+
+def write_csv_band(csv_writer, surface, columns):
+    #long format rows of a (band of a) surface, formatted like write_columns_csv
+    values = surface.long_format_columns(columns)
+    with gene_dup_profile.stage('csv_write'):
+        csv_writer.writerows(np.column_stack(list(values.values())).tolist())
+
+def write_pratio_surface_csv_in_bands(surface, file_name_full, columns=gene_dup_pratio.long_format_column_names, max_block_cells=max_block_cells):
+    #write_pratio_surface_csv for surfaces too large to expand at once (a memory-mapped result of the tiled writer)
+    rows_per_block = max(1, max_block_cells // surface.t2_range.size)
+    handle, temporary_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(file_name_full)), suffix='.tmp')
+    try:
+        with os.fdopen(handle, 'w', newline='') as file:
+            csv_writer = csv.writer(file, delimiter=',')
+            csv_writer.writerow(list(columns))
+            for start in range(0, surface.t1_range.size, rows_per_block):
+                write_csv_band(csv_writer, band_surface(surface, start, start + rows_per_block), columns)
+        os.replace(temporary_path, file_name_full)
+    except BaseException:
+        os.remove(temporary_path)
+        raise
+    return file_name_full
+
+def write_tiled_pratio_surface(path, t1_range, composition, switch=0.0, t2_range=None, parameters=None, n_max=gene_dup_survival.n_max,
+                               max_block_cells=max_block_cells, csv_path=None, csv_columns=('t1', 't2', 'pratio'), series_tolerance=None):
+    #binary format surface at path computed in bands of t1 rows, returned as a memory-mapped PratioSurface
+    #each band (at most max_block_cells cells, and at least one t1 row) is appended to pratio.npy with plain sequential
+    #writes (not through a writable memory map, whose dirty pages would count against memory) before the next is computed;
+    #with csv_path the same bands are also appended to a long format csv (t1-major, like write_pratio_surface_csv)
+    if t2_range is None:
+        t2_range = t1_range
+    if parameters is None:
+        parameters = gene_dup_survival.default_survival_parameters
+    t1_range = np.asarray(t1_range, dtype=float)
+    t2_range = np.asarray(t2_range, dtype=float)
+    st1 = gene_dup_survival.calculate_category_survival_curves_in_blocks(t1_range, parameters, n_max, tolerance=series_tolerance)
+    st2 = gene_dup_survival.calculate_category_survival_curves_in_blocks(t2_range, parameters, n_max, tolerance=series_tolerance)
+    st1 = {name: gene_dup_survival.patch_survival_immediately_post_wgd(curve, t1_range) for name, curve in st1.items()}
+    st2 = {name: gene_dup_survival.patch_survival_immediately_post_wgd(curve, t2_range) for name, curve in st2.items()}
+    alt_func_percent, dos_percent, non_percent = composition
+    q1, q2 = t1_range.size, t2_range.size
+    rows_per_block = max(1, max_block_cells // q2)
+
+    parent = os.path.dirname(os.path.abspath(path))
+    os.makedirs(parent, exist_ok=True)
+    temporary_path = tempfile.mkdtemp(dir=parent, prefix='.tmp_')
+    csv_file = None
+    csv_writer = None
+    pratio_file = None
+    try:
+        pratio_file = open(os.path.join(temporary_path, 'pratio.npy'), 'wb')
+        np.lib.format.write_array_header_2_0(pratio_file, {'descr': np.lib.format.dtype_to_descr(np.dtype(float)), 'fortran_order': False, 'shape': (q1, q2)})
+        if csv_path is not None:
+            temporary_csv_path = os.path.join(temporary_path, 'long_format.csv')
+            csv_file = open(temporary_csv_path, 'w', newline='')
+            #same csv dialect and float formatting as write_columns_csv, so the bytes do not depend on the band size
+            csv_writer = csv.writer(csv_file, delimiter=',')
+            csv_writer.writerow(list(csv_columns))
+        for start in range(0, q1, rows_per_block):
+            stop = min(q1, start + rows_per_block)
+            band_st1 = {name: curve[start:stop] for name, curve in st1.items()}
+            with gene_dup_profile.stage('pratio_surface'):
+                band = gene_dup_pratio.calculate_pratio_surface(band_st1, st2, alt_func_percent, dos_percent, non_percent, switch)
+            with gene_dup_profile.stage('binary_write'):
+                np.ascontiguousarray(band, dtype=float).tofile(pratio_file)
+            if csv_file is not None:
+                write_csv_band(csv_writer, gene_dup_pratio.PratioSurface(t1_range[start:stop], t2_range, band_st1, st2, band, alt_func_percent, dos_percent, non_percent, switch, parameters, n_max), csv_columns)
+        pratio_file.close()
+        pratio_file = None
+        if csv_file is not None:
+            csv_file.close()
+            csv_file = None
+            os.replace(temporary_csv_path, csv_path)
+
+        #the small arrays and the metadata complete the entry, which is then renamed into place
+        #(pratio is None: the surface is already on disk and is never held in memory)
+        surface = gene_dup_pratio.PratioSurface(t1_range, t2_range, st1, st2, None, alt_func_percent, dos_percent, non_percent, switch, parameters, n_max)
+        for name, array in surface_arrays(surface).items():
+            if name != 'pratio':
+                np.save(os.path.join(temporary_path, name + '.npy'), np.ascontiguousarray(array))
+        with open(os.path.join(temporary_path, metadata_file_name), 'w') as file:
+            json.dump(surface_metadata(surface), file, indent=1)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        os.replace(temporary_path, path)
+    except BaseException:
+        for file in (pratio_file, csv_file):
+            if file is not None:
+                file.close()
+        shutil.rmtree(temporary_path, ignore_errors=True)
+        raise
+    return load_pratio_surface(path)
@@ -25,26 +25,50 @@ switch : percent of gene duplicates retained through ALt_func that switch to Non
 
 """
 import math
-import csv
 import matplotlib.pyplot as plt
-from matplotlib import cm
-import pandas as pd
+
+import gene_dup_grids
+import gene_dup_plots
+import gene_dup_profile
+import gene_dup_runner
 
 ###########################################################################
 #initialize parameters
 #n_max = 170
 n_max = 100
+#n_max = None #untruncated series (exact hazard integral), stable for t ranges of 10 and beyond
 
 #number of time points in t1 and t2 
 time_points = 51
 #time_points = 51
 #time_points = 81 #may be more clear
 
+#t1 and t2 grid: 0.01, 0.02, ... computed exactly (no drift from repeated addition) OR any other grid spec of gene_dup_grids
+time_grid = {'start': 0.01, 'step': 0.01, 'count': time_points}
+#time_grid = {'kind': 'log', 'start': 0.001, 'stop': 0.51, 'count': time_points} #most points near t = 0
+#time_grid = [0.01, 0.02, 0.05, 0.1, 0.2, 0.5] #explicit times
+#time_grid = {'kind': 'adaptive', 'initial': {'start': 0.01, 'step': 0.05, 'count': 11}, 'tolerance': 0.01, 'max_points': time_points} #points only where pratio changes rapidly
+
 file_name_start = 'mutational_opportunity_vers8_' 
 
+#write results as csv text OR as the binary .gdsurf format (memory-mapped when read back)
+output_format = 'csv'
+#output_format = 'npy'
+#set to False to only draw the figures
+write_output_files = True
+
+#worker processes for the combos (None uses every core, 1 runs them in this process)
+number_of_workers = None
+
 #make graph using the pratio OR the log 10 of pratio
 p_ratio = 'pratio'
 #p_ratio = 'log of pratio'
+
+#draw figures on screen OR (headless = True) write them to image files without needing a display
+headless = False
+
+#None OR a directory to write a per-stage profile report (profile.json) and one cProfile dump per combo to
+profile_directory = None
 ###############################################################################
 #CHOOSE ONE OF THE FOLLOWING
 """
@@ -147,6 +171,12 @@ c_non = 1
 d_non = 20
 f_non = 5
 
+survival_parameters = {
+    'alt_func': (b_alt_func, c_alt_func, d_alt_func, f_alt_func),
+    'dos': (b_dos, c_dos, d_dos, f_dos),
+    'non': (b_non, c_non, d_non, f_non),
+    }
+
 
 ###########################################################################
 #Functions
@@ -179,88 +209,71 @@ def calculate_pratio_2d(st1_alt_func, st1_dos, st1_non, st2_alt_func, st2_dos, s
     pratio = ((alt_ret_ret_noswitch + alt_ret_ret_switch + dos_ret_ret + non_ret_ret)/(alt_noret_ret + dos_noret_ret + non_noret_ret)) * ((alt_noret + dos_noret + non_noret)/(alt_ret + dos_ret + non_ret))                                 
     return pratio  
 
-def read_csv_file(file_name):
-    file_name_full = (file_name_start + file_name +'.csv')
-    df = pd.read_csv(file_name_full,
-            header=0,
-            usecols=["t1", "t2", "pratio","alt_surv_t1", "dos_surv_t1", "non_surv_t1", "alt_surv_t2", "dos_surv_t2", "non_surv_t2", "log of pratio"])    
-    #print(df.head())    
-    return df
-    
-def print_3d_graph(percents, file_name, p_ratio):
-    df = read_csv_file(file_name)
-    minimum_pratio = df['pratio'].min()
+def print_3d_graph(percents, surface, p_ratio):
+    minimum_pratio = surface.pratio.min()
     print("Minimum Pratio: " + str(minimum_pratio))  
     #plot 3D scatter
-    fig2 = plt.figure()
-    ax2 = plt.axes(projection='3d')
-    surf2 = ax2.scatter3D(df['t1'], df['t2'], df[p_ratio], c = df[p_ratio], cmap=cm.cividis)
-    fig2.colorbar(surf2)
-    ax2.set_title('Pratio for t1 and t2: ' + percents, fontsize=14)
-    ax2.set_xlabel('$t1$', fontsize=12)
-    ax2.set_ylabel('$t2$', fontsize=12)
-    ax2.set_zlabel(r'probability ratio', fontsize=11)
-    ax2.view_init(15, 45)
-    plt.draw()
-    plt.pause(.001)
+    with gene_dup_profile.stage('figure_scatter'):
+        gene_dup_plots.plot_pratio_scatter_3d(surface, percents, p_ratio)
+        plt.draw()
+        plt.pause(.001)
     
-def plot_survival_curves(file_name):
-    df = read_csv_file(file_name)
+def plot_survival_curves(surface):
     #Plot survival curves
-    fig, t1_plot = plt.subplots()
-    t1_plot.plot(df['t1'], df['alt_surv_t1'], color = 'red', label = 'Alt_func')
-    t1_plot.plot(df['t1'], df['dos_surv_t1'], color = 'blue', label = 'Dos')
-    t1_plot.plot(df['t1'], df['non_surv_t1'], color = 'yellow', label = 'Non')
-    t1_plot.legend(loc = 'upper right', shadow = True, fontsize = '12')
-    t1_plot.set_title('Survival over Time (t1)', fontsize=14)
-    t1_plot.set_xlabel('Time Since Duplication Event', fontsize=12)
-    t1_plot.set_ylabel('Proportion Gene Duplicate Copies Surviving', fontsize=12)
+    gene_dup_plots.plot_survival_curves(surface)
     plt.show()   
     
-def calculate_and_make_csv(file_name, alt_func_percent, dos_percent, non_percent, alt_switch_percent):
-    file = open(file_name_start+ file_name +'.csv', 'w', newline='')
-    writer = csv.writer(file, delimiter=',')
-    write_header_row = ["t1", "t2", "pratio", "alt_surv_t1", "dos_surv_t1", "non_surv_t1", "alt_surv_t2", "dos_surv_t2", "non_surv_t2", "log of pratio"]
-    writer.writerow(write_header_row)
-    each_t1 = 0.01
-    for i in range(0, time_points):  
-        alt_func_survival_t1 = calculate_probability_of_survival_of_duplicate_gene_copy_by_time(b_alt_func, c_alt_func, d_alt_func, f_alt_func, each_t1)
-        dos_survival_t1 = calculate_probability_of_survival_of_duplicate_gene_copy_by_time(b_dos, c_dos, d_dos, f_dos, each_t1)
-        non_survival_t1 = calculate_probability_of_survival_of_duplicate_gene_copy_by_time(b_non, c_non, d_non, f_non, each_t1)
-        each_t2 = 0.01
-        for j in range(0, time_points):
-            #print("t1: " + str(each_t1))
-            #print("t2: " + str(each_t2))        
-            alt_func_survival_t2 = calculate_probability_of_survival_of_duplicate_gene_copy_by_time(b_alt_func, c_alt_func, d_alt_func, f_alt_func, each_t2)
-            dos_survival_t2 = calculate_probability_of_survival_of_duplicate_gene_copy_by_time(b_dos, c_dos, d_dos, f_dos, each_t2)
-            non_survival_t2 = calculate_probability_of_survival_of_duplicate_gene_copy_by_time(b_non, c_non, d_non, f_non, each_t2)       
-            probability_ratio_2d = calculate_pratio_2d(alt_func_survival_t1, dos_survival_t1, non_survival_t1, alt_func_survival_t2, dos_survival_t2, non_survival_t2, alt_func_percent, dos_percent, non_percent, alt_switch_percent)
-            #print("Probability ratio: " + str(probability_ratio_2d))
-            log_pratio = math.log10(probability_ratio_2d)
-            row_to_write = [each_t1, each_t2, probability_ratio_2d, alt_func_survival_t1, dos_survival_t1, non_survival_t1, alt_func_survival_t2, dos_survival_t2, non_survival_t2, log_pratio]
-            writer.writerow(row_to_write)
-            each_t2 = each_t2+0.01
-        each_t1 = each_t1+0.01                     
-    file.close()
+def make_time_range(alt_func_percent, dos_percent, non_percent, alt_switch_percent):
+    #adaptive grids are refined for the scenario, every other kind of grid is the same for all scenarios
+    return gene_dup_grids.resolve_time_grid(time_grid, (alt_func_percent, dos_percent, non_percent), alt_switch_percent, survival_parameters, n_max)
+
+def make_scenario(file_name, alt_func_percent, dos_percent, non_percent, alt_switch_percent):
+    #everything the scenario needs is passed explicitly, so it can run in a worker process
+    output_formats = [output_format] if write_output_files else []
+    return gene_dup_runner.make_scenario((alt_func_percent, dos_percent, non_percent), alt_switch_percent, make_time_range(alt_func_percent, dos_percent, non_percent, alt_switch_percent), parameters=survival_parameters, n_max=n_max, file_name=file_name_start + file_name, output_formats=output_formats)
+
 #############################################################################
 
-def main(percent_alt_func, percent_dos, percent_non, percent_alt_switch):    
+def make_labels(percent_alt_func, percent_dos, percent_non):
     percentages = str(100*switch) +"% switch,  \n" +str(100*percent_alt_func) +"% Alt_func, "+str(100*percent_dos)+"% Dos, "+str(100*percent_non)+"% Non, \n (" + hypothesis + " Hypothesis)"
     percentages_file_name = str(100*percent_alt_func)+'_'+str(100*percent_dos)+'_'+str(100*percent_non)+file_name_end
-    print(percentages)
-    calculate_and_make_csv(percentages_file_name, percent_alt_func, percent_dos, percent_non, percent_alt_switch)
-    print_3d_graph(percentages, percentages_file_name, p_ratio)
-    
+    return percentages, percentages_file_name
 
 #############################################################################
 
-for i in range (0, number_of_combos):
-    alt = alts[i]
-    dos = doses[i]
-    non = nons[i]
-    main(alt, dos, non, switch)
+if __name__ == '__main__':
+    #every combo is independent: compute (and write) them in worker processes, then plot in combo order
+    if profile_directory is not None:
+        gene_dup_profile.enable(True, profile_directory)
+    scenarios = []
+    for i in range (0, number_of_combos):
+        alt = alts[i]
+        dos = doses[i]
+        non = nons[i]
+        percentages, percentages_file_name = make_labels(alt, dos, non)
+        scenarios.append(make_scenario(percentages_file_name, alt, dos, non, switch))
+    surfaces = gene_dup_runner.run_scenarios(scenarios, number_of_workers)
+
+    if headless:
+        #no display needed: figures are written to files (and closed) by worker processes separate from the numerical work
+        figure_jobs = []
+        for i in range (0, number_of_combos):
+            percentages, percentages_file_name = make_labels(alts[i], doses[i], nons[i])
+            print(percentages)
+            print("Minimum Pratio: " + str(surfaces[i].pratio.min()))
+            figure_jobs.append({'surface': surfaces[i], 'file_name': file_name_start + percentages_file_name, 'percents': percentages, 'kinds': ['scatter'], 'scale': p_ratio})
+        percentages, percentages_file_name = make_labels(alts[0], doses[0], nons[0])
+        figure_jobs.append({'surface': surfaces[0], 'file_name': file_name_start + percentages_file_name, 'percents': percentages, 'kinds': ['survival']})
+        gene_dup_plots.render_figures(figure_jobs, number_of_workers)
+    else:
+        for i in range (0, number_of_combos):
+            percentages, percentages_file_name = make_labels(alts[i], doses[i], nons[i])
+            print(percentages)
+            print_3d_graph(percentages, surfaces[i], p_ratio)
+
+        plot_survival_curves(surfaces[0])
 
-file_name_for_surv_curv = str(100*alts[0])+'_'+str(100*doses[0])+'_'+str(100*nons[0])+file_name_end
-plot_survival_curves(file_name_for_surv_curv)
+    if profile_directory is not None:
+        print('profile report: ' + gene_dup_profile.write_report(profile_directory))
 
 ########################################
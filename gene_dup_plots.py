@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""
+Figures for the gene duplicability models, drawn directly from PratioSurface results.
+
+Purpose:
+    1) 3D scatter and 3D surface plots of t1 vs t2 vs pratio (or log10 pratio).
+    2) Survival curves over time for each category Alt_func, Dos, and Non, taken from the q survival values of the
+       t1 grid instead of re-reading the q*q rows of the long format output.
+    3) Headless batch rendering: switch to the non-interactive Agg backend, write every figure to a file and close it
+       as soon as it is saved, optionally in worker processes separate from the numerical work.
+
+"""
+import concurrent.futures
+import functools
+import os
+
+import matplotlib.pyplot as plt
+from matplotlib import cm
+import numpy as np
+
+import gene_dup_pratio
+import gene_dup_profile
+
+###########################################################################
+#initialize parameters
+#title prefix and z axis label for each scale (other names of a scale go through gene_dup_pratio.normalize_scale)
+scale_labels = {
+    'pratio': ('Pratio for t1 and t2: ', r'probability ratio'),
+    'log of pratio': ('log10(Pratio) for t1 and t2: ', r'log10(probability ratio)'),
+    }
+
+#kinds of figure a scenario can be rendered as
+figure_kinds = ('scatter', 'surface', 'survival')
+image_format = 'png'
+dpi = 100
+
+
+###########################################################################
+#Functions
+
+def plot_pratio_scatter_3d(surface, percents, scale='pratio'):
+    #3D scatter of every (t1, t2) cell coloured by pratio
+    title, zlabel = scale_labels[gene_dup_pratio.normalize_scale(scale)]
+    values = surface.surface(scale).reshape(-1)
+    t1_grid, t2_grid = np.meshgrid(surface.t1_range, surface.t2_range, indexing='ij')
+    fig2 = plt.figure()
+    ax2 = plt.axes(projection='3d')
+    surf2 = ax2.scatter3D(t1_grid.reshape(-1), t2_grid.reshape(-1), values, c = values, cmap=cm.cividis)
+    fig2.colorbar(surf2)
+    ax2.set_title(title + percents, fontsize=14)
+    ax2.set_xlabel('$t1$', fontsize=12)
+    ax2.set_ylabel('$t2$', fontsize=12)
+    ax2.set_zlabel(zlabel, fontsize=11)
+    ax2.view_init(15, 45)
+    return fig2
+
+def plot_pratio_surface_3d(surface, percents, scale='pratio'):
+    #3D surface of pratio over the t1 x t2 grid
+    title, zlabel = scale_labels[gene_dup_pratio.normalize_scale(scale)]
+    fig = plt.figure()
+    ax = plt.axes(projection='3d')
+    x, y = np.meshgrid(surface.t1_range, surface.t2_range, indexing='ij')
+    surf = ax.plot_surface(x, y, surface.surface(scale), cmap=cm.cividis)
+    fig.colorbar(surf)
+    ax.set_title(title + percents, fontsize=14)
+    ax.set_xlabel('$t1$', fontsize=12)
+    ax.set_ylabel('$t2$', fontsize=12)
+    ax.set_zlabel(zlabel, fontsize=11)
+    ax.view_init(15, 45)
+    return fig
+
+def plot_survival_curves(surface, title='Survival over Time (t1)'):
+    #survival of a duplicate gene copy over the t1 grid for Alt_func, Dos and Non
+    fig, t1_plot = plt.subplots()
+    t1_plot.plot(surface.t1_range, surface.st1['alt_func'], color = 'red', label = 'Alt_func')
+    t1_plot.plot(surface.t1_range, surface.st1['dos'], color = 'blue', label = 'Dos')
+    t1_plot.plot(surface.t1_range, surface.st1['non'], color = 'yellow', label = 'Non')
+    t1_plot.legend(loc = 'upper right', shadow = True, fontsize = '12')
+    t1_plot.set_title(title, fontsize=14)
+    t1_plot.set_xlabel('Time Since Duplication Event', fontsize=12)
+    t1_plot.set_ylabel('Proportion Gene Duplicate Copies Surviving', fontsize=12)
+    return fig
+
+def plot_survival_bands(time_range, bands, title='Survival over Time (t1)'):
+    #plot_survival_curves with an uncertainty band per category: bands is {category: {'center', 'lower', 'upper'}}
+    fig, t1_plot = plt.subplots()
+    for name, color, label in (('alt_func', 'red', 'Alt_func'), ('dos', 'blue', 'Dos'), ('non', 'yellow', 'Non')):
+        t1_plot.fill_between(time_range, bands[name]['lower'], bands[name]['upper'], color = color, alpha = 0.25, linewidth = 0)
+        t1_plot.plot(time_range, bands[name]['center'], color = color, label = label)
+    t1_plot.legend(loc = 'upper right', shadow = True, fontsize = '12')
+    t1_plot.set_title(title, fontsize=14)
+    t1_plot.set_xlabel('Time Since Duplication Event', fontsize=12)
+    t1_plot.set_ylabel('Proportion Gene Duplicate Copies Surviving', fontsize=12)
+    return fig
+
+def plot_figure(surface, kind, percents, scale='pratio'):
+    #one kind of figure (see figure_kinds) of a scenario
+    if kind == 'scatter':
+        return plot_pratio_scatter_3d(surface, percents, scale)
+    if kind == 'surface':
+        return plot_pratio_surface_3d(surface, percents, scale)
+    if kind == 'survival':
+        return plot_survival_curves(surface)
+    raise ValueError('unknown figure kind ' + repr(kind) + ', expected one of ' + str(figure_kinds))
+
+def use_headless_backend():
+    #non-interactive backend: no display needed, figures are only ever written to files
+    plt.switch_backend('Agg')
+
+def save_figure(fig, path, dpi=dpi):
+    #write the figure and close it straight away so batch runs do not pile up open figures
+    fig.savefig(path, dpi=dpi)
+    plt.close(fig)
+    return path
+
+def render_scenario_figures(surface, file_name, percents, kinds=('scatter',), scale='pratio', image_format=image_format, dpi=dpi):
+    #write each requested kind of figure to file_name + '_' + kind + '.' + image_format and return the paths
+    paths = []
+    for kind in kinds:
+        with gene_dup_profile.stage('figure_' + str(kind)):
+            fig = plot_figure(surface, kind, percents, scale)
+            paths.append(save_figure(fig, file_name + '_' + kind + '.' + image_format, dpi))
+    return paths
+
+def render_figure_job(job):
+    #one rendering job: a dict of render_scenario_figures keyword arguments
+    return render_scenario_figures(**job)
+
+def render_profiled_figure_job(job, cprofile_directory=None):
+    #render_figure_job with profiling switched on, returning (paths, profile record) so a worker's figure timings
+    #reach the report written by the parent
+    gene_dup_profile.enable(True, cprofile_directory)
+    with gene_dup_profile.scenario('figures_' + os.path.basename(job['file_name'])) as record:
+        paths = render_figure_job(job)
+    return paths, record
+
+def render_figures(jobs, workers=None, on_rendered=None):
+    #render every job headlessly, in worker processes when workers > 1, and return the written paths in job order
+    #on_rendered(job) is called in this process as each job completes (in completion order)
+    jobs = list(jobs)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = min(max(1, int(workers)), max(1, len(jobs)))
+    function = render_figure_job
+    if gene_dup_profile.enabled:
+        function = functools.partial(render_profiled_figure_job, cprofile_directory=gene_dup_profile.cprofile_directory)
+    results = [None] * len(jobs)
+    if workers == 1:
+        use_headless_backend()
+        for index, job in enumerate(jobs):
+            results[index] = function(job)
+            if on_rendered is not None:
+                on_rendered(job)
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=use_headless_backend) as executor:
+            futures = {executor.submit(function, job): index for index, job in enumerate(jobs)}
+            for future in concurrent.futures.as_completed(futures):
+                results[futures[future]] = future.result()
+                if on_rendered is not None:
+                    on_rendered(jobs[futures[future]])
+    if not gene_dup_profile.enabled:
+        return results
+    for _, record in results:
+        gene_dup_profile.record_scenario(record)
+    return [paths for paths, _ in results]
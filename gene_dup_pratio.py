@@ -0,0 +1,281 @@
+# -*- coding: utf-8 -*-
+"""
+Broadcast pratio surface engine for the gene duplicability models.
+
+Purpose:
+    1) Compute the full t1 x t2 probability ratio surface from the three t1 survival vectors and the three t2
+       survival vectors in one vectorized computation, instead of one (t1, t2) cell at a time.
+    2) Include the alt->non switch term of the mutational opportunity model (switch = 0 gives the duplicability
+       model of the Dec 2022 scripts).
+
+pratio = P(survival in t2 | retained in t1) / P(survival in t2 | lost in t1)
+       = ((alt_ret_ret_noswitch + alt_ret_ret_switch + dos_ret_ret + non_ret_ret)/(alt_noret_ret + dos_noret_ret + non_noret_ret))
+         * ((alt_noret + dos_noret + non_noret)/(alt_ret + dos_ret + non_ret))
+
+Both sums over the categories are matrix products of a (q1 x 3) matrix of t1 weights with a (3 x q2) matrix of t2
+survival, so the surface is two small matrix multiplications and an outer scaling.
+
+Sweeps:
+    calculate_pratio_sweep evaluates a list of (Alpha_Alt_func, Alpha_Dos, Alpha_Non) compositions crossed with a
+    vector of switch values in one pass, giving a (composition x switch x t1 x t2) array built from the same
+    survival vectors. composition_simplex_grid gives every composition on a regular grid of the simplex.
+
+Pairs:
+    calculate_pratio_pairs gives the ratio of paired (t1, t2) values (one per gene family, say) element by element,
+    which is the diagonal of the surface of the two age vectors without the q1 x q2 cost.
+
+More than two events:
+    calculate_retention_ratio_tensor extends the ratio to k successive duplication events at t1, ..., tk. The
+    expected copies of each category are carried through the events (a retained duplicate gives two copies,
+    retained Alt_func copies switching to Non with probability switch; a lost one leaves one copy), and the ratio is
+    P(survival in tk | retained in tk-1) / P(survival in tk | lost in tk-1), with the earlier events averaged over.
+    The copies are a (q1 x ... x qj x 3) array after event j, updated by broadcasting against the survival vectors
+    of that event's grid and contracted with the tk survival vectors in one matrix product; k = 2 is exactly
+    calculate_pratio_surface.
+
+Results:
+    calculate_scenario_surface returns a PratioSurface, which computes the surface once and exposes the linear
+    pratio, its log10 and the long format (t1, t2, pratio, survival, log of pratio) columns as views over the same
+    buffers, so the linear and log scale outputs and the 3D and 2D layouts no longer need separate runs.
+
+"""
+import numpy as np
+
+import gene_dup_cache
+import gene_dup_profile
+import gene_dup_survival
+
+###########################################################################
+#composition combos used by the submission scripts (Alpha_Alt_func, Alpha_Dos, Alpha_Non)
+oct_2023_compositions = [
+    (0.75, 0.00, 0.25), (0.60, 0.15, 0.25), (0.45, 0.30, 0.25), (0.30, 0.45, 0.25), (0.15, 0.60, 0.25), (0.00, 0.75, 0.25),
+    (0.50, 0.00, 0.50), (0.40, 0.10, 0.50), (0.30, 0.20, 0.50), (0.20, 0.30, 0.50), (0.10, 0.40, 0.50), (0.00, 0.50, 0.50),
+    (0.25, 0.00, 0.75), (0.10, 0.15, 0.75), (0.00, 0.25, 0.75),
+    ]
+dec_2022_compositions = [(1.0, 0.0, 0.0)] + oct_2023_compositions
+
+#switch values explored for the mutational opportunity model
+mutational_opportunity_switches = [0.05, 0.1, 0.2, 0.25, 0.5, 0.75]
+
+#the two scales of a surface, linear and log10, under every name accepted for them
+scale_aliases = {'pratio': 'pratio', 'log of pratio': 'log of pratio', 'log10': 'log of pratio'}
+
+#values per array held at once by the batched calculations over a leading sample or replicate axis
+#(gene_dup_sensitivity, gene_dup_uncertainty, gene_dup_simulation), about 32 MB per float64 or int64 array
+max_batch_cells = 2**22
+
+###########################################################################
+#Functions
+
+def normalize_scale(scale):
+    #'pratio' or 'log of pratio' for any name of scale_aliases, ValueError otherwise
+    if not isinstance(scale, str) or scale not in scale_aliases:
+        raise ValueError('unknown scale ' + repr(scale) + ', expected one of ' + str(list(scale_aliases)))
+    return scale_aliases[scale]
+
+def survival_vectors(survival):
+    #(alt_func, dos, non) arrays from either a dict keyed by category name or a 3-sequence
+    if isinstance(survival, dict):
+        survival = [survival[name] for name in gene_dup_survival.category_names]
+    return [np.asarray(x, dtype=float) for x in survival]
+
+def calculate_pratio_surface(st1, st2, alt_func_percent, dos_percent, non_percent, alt_switch_percent=0.0):
+    #probability of (survival in t2 given survived in t1)/(survival in t2 given lost in t1) for every (t1, t2) cell
+    #st1, st2: (alt_func, dos, non) survival vectors over the t1 grid (length q1) and t2 grid (length q2)
+    #the percents and switch may be scalars or arrays that broadcast together; output shape is broadcast shape + (q1, q2)
+    st1_alt_func, st1_dos, st1_non = survival_vectors(st1)
+    st2_alt_func, st2_dos, st2_non = survival_vectors(st2)
+    alt_func_percent, dos_percent, non_percent, alt_switch_percent = [np.asarray(x, dtype=float)[..., np.newaxis] for x in (alt_func_percent, dos_percent, non_percent, alt_switch_percent)]
+
+    #t1 weights, shape (..., q1, 3): retained in t1 (two copies enter t2) and lost in t1 (one copy enters t2)
+    retained_t1 = np.stack(np.broadcast_arrays(2*alt_func_percent*st1_alt_func, 2*dos_percent*st1_dos, 2*non_percent*st1_non), axis=-1)
+    lost_t1 = np.stack(np.broadcast_arrays((1-st1_alt_func)*alt_func_percent, (1-st1_dos)*dos_percent, (1-st1_non)*non_percent), axis=-1)
+
+    #t2 survival, shape (..., 3, q2): retained Alt_func copies switch to Non with probability alt_switch_percent
+    alt_after_switch = alt_switch_percent*st2_non + (1-alt_switch_percent)*st2_alt_func
+    survival_t2_given_retained = np.stack(np.broadcast_arrays(alt_after_switch, st2_dos, st2_non), axis=-2)
+    survival_t2_given_lost = np.stack([st2_alt_func, st2_dos, st2_non], axis=-2)
+
+    #einsum rather than matmul: BLAS picks its kernel (and so its rounding) by shape, einsum sums the three categories
+    #in the same order for every cell, so a band of t1 rows is bit for bit the same rows of the full surface
+    retained_retained = np.einsum('...ij,...jk->...ik', retained_t1, survival_t2_given_retained)
+    lost_retained = np.einsum('...ij,...jk->...ik', lost_t1, survival_t2_given_lost)
+    normalization = lost_t1.sum(axis=-1) / retained_t1.sum(axis=-1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pratio = (retained_retained / lost_retained) * normalization[..., np.newaxis]
+    return pratio
+
+def calculate_pratio_pairs(st1, st2, alt_func_percent, dos_percent, non_percent, alt_switch_percent=0.0):
+    #pratio of paired (t1, t2) values, element by element: the diagonal of calculate_pratio_surface without forming the surface
+    #st1, st2: (alt_func, dos, non) survival arrays at the t1 and at the t2 of each pair, all of one shape
+    st1_alt_func, st1_dos, st1_non = survival_vectors(st1)
+    st2_alt_func, st2_dos, st2_non = survival_vectors(st2)
+    alt_after_switch = alt_switch_percent*st2_non + (1-alt_switch_percent)*st2_alt_func
+    retained_retained = 2*(alt_func_percent*st1_alt_func*alt_after_switch + dos_percent*st1_dos*st2_dos + non_percent*st1_non*st2_non)
+    lost_retained = (1-st1_alt_func)*alt_func_percent*st2_alt_func + (1-st1_dos)*dos_percent*st2_dos + (1-st1_non)*non_percent*st2_non
+    retained_t1 = 2*(alt_func_percent*st1_alt_func + dos_percent*st1_dos + non_percent*st1_non)
+    lost_t1 = (1-st1_alt_func)*alt_func_percent + (1-st1_dos)*dos_percent + (1-st1_non)*non_percent
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (retained_retained / lost_retained) * (lost_t1 / retained_t1)
+
+def composition_simplex_grid(step):
+    #every (Alpha_Alt_func, Alpha_Dos, Alpha_Non) with entries on multiples of step that sum to 1, shape (number of compositions, 3)
+    #ordered by Alpha_Non, then by decreasing Alpha_Alt_func, like the combos in the submission scripts
+    divisions = int(round(1 / step))
+    if not np.isclose(divisions * step, 1):
+        raise ValueError('step must divide 1 evenly, got ' + str(step))
+    compositions = []
+    for non in range(0, divisions + 1):
+        for dos in range(0, divisions - non + 1):
+            compositions.append((divisions - non - dos, dos, non))
+    return np.array(compositions, dtype=float) / divisions
+
+def calculate_pratio_sweep(st1, st2, compositions, switches=(0.0,)):
+    #pratio surfaces for every composition crossed with every switch value, shape (compositions, switches, q1, q2)
+    #compositions: sequence of (Alpha_Alt_func, Alpha_Dos, Alpha_Non); switches: sequence of switch fractions
+    compositions = np.asarray(compositions, dtype=float).reshape(-1, 3)
+    switches = np.asarray(switches, dtype=float).reshape(-1)
+    alt_func_percent, dos_percent, non_percent = [compositions[:, k, np.newaxis] for k in range(3)]
+    return calculate_pratio_surface(st1, st2, alt_func_percent, dos_percent, non_percent, switches[np.newaxis, :])
+
+def calculate_scenario_sweep(t1_range, compositions, switches=(0.0,), t2_range=None, parameters=None, n_max=gene_dup_survival.n_max, cache=None):
+    #survival vectors on the t1 and t2 grids (computed once, via the survival cache) and the full sweep built from them
+    #returns (st1, st2, pratio_sweep), with st1 and st2 dicts keyed by category name
+    #s(0) is replaced by survival_immediately_post_wgd on grids that start at t = 0, as in calculate_scenario_surface
+    if t2_range is None:
+        t2_range = t1_range
+    st1 = gene_dup_cache.calculate_cached_category_survival_curves(t1_range, parameters, n_max, cache)
+    st2 = gene_dup_cache.calculate_cached_category_survival_curves(t2_range, parameters, n_max, cache)
+    st1 = {name: gene_dup_survival.patch_survival_immediately_post_wgd(curve, t1_range) for name, curve in st1.items()}
+    st2 = {name: gene_dup_survival.patch_survival_immediately_post_wgd(curve, t2_range) for name, curve in st2.items()}
+    return st1, st2, calculate_pratio_sweep(st1, st2, compositions, switches)
+
+def retained_copies(copies, survival, alt_switch_percent=0.0):
+    #(..., 3) copies per category whose new duplicate is retained, as the (..., q, 3) copies they become (two each,
+    #retained Alt_func copies moving to Non with probability alt_switch_percent)
+    retained = 2 * copies[..., np.newaxis, :] * survival
+    switched = alt_switch_percent * retained[..., 0]
+    return np.stack([retained[..., 0] - switched, retained[..., 1], retained[..., 2] + switched], axis=-1)
+
+def lost_copies(copies, survival):
+    #(..., 3) copies per category whose new duplicate is lost, as the (..., q, 3) copies left (one each)
+    return copies[..., np.newaxis, :] * (1 - survival)
+
+def calculate_retention_ratio_tensor(survivals, alt_func_percent, dos_percent, non_percent, alt_switch_percent=0.0):
+    #P(survival in tk | retained in tk-1) / P(survival in tk | lost in tk-1) for k = len(survivals) >= 2 events
+    #survivals: one (alt_func, dos, non) set of survival vectors per event, over that event's grid (length q_i)
+    #output shape (q1, ..., qk); with two events this is calculate_pratio_surface
+    if len(survivals) < 2:
+        raise ValueError('a retention ratio needs at least two duplication events, got ' + str(len(survivals)))
+    survivals = [np.stack(survival_vectors(survival), axis=-1) for survival in survivals]
+    copies = np.array([alt_func_percent, dos_percent, non_percent], dtype=float)
+    #events before tk-1: both outcomes carried forward
+    for survival in survivals[:-2]:
+        copies = retained_copies(copies, survival, alt_switch_percent) + lost_copies(copies, survival)
+    retained = retained_copies(copies, survivals[-2], alt_switch_percent)
+    lost = lost_copies(copies, survivals[-2])
+    last = survivals[-1].T
+    with np.errstate(divide='ignore', invalid='ignore'):
+        survival_given_retained = np.matmul(retained, last) / retained.sum(axis=-1)[..., np.newaxis]
+        survival_given_lost = np.matmul(lost, last) / lost.sum(axis=-1)[..., np.newaxis]
+        return survival_given_retained / survival_given_lost
+
+#columns of the long format, as written by the Oct 2023 script
+long_format_column_names = ["t1", "t2", "pratio", "alt_surv_t1", "dos_surv_t1", "non_surv_t1", "alt_surv_t2", "dos_surv_t2", "non_surv_t2", "log of pratio"]
+
+class PratioSurface:
+    #one scenario: the t1 and t2 grids, the survival vectors on them, the composition, the switch and the pratio surface
+    def __init__(self, t1_range, t2_range, st1, st2, pratio, alt_func_percent, dos_percent, non_percent, alt_switch_percent=0.0, parameters=None, n_max=gene_dup_survival.n_max):
+        self.t1_range = np.asarray(t1_range, dtype=float)
+        self.t2_range = np.asarray(t2_range, dtype=float)
+        self.st1 = dict(zip(gene_dup_survival.category_names, survival_vectors(st1)))
+        self.st2 = dict(zip(gene_dup_survival.category_names, survival_vectors(st2)))
+        self.pratio = pratio
+        self.alt_func_percent = alt_func_percent
+        self.dos_percent = dos_percent
+        self.non_percent = non_percent
+        self.alt_switch_percent = alt_switch_percent
+        if parameters is None:
+            parameters = gene_dup_survival.default_survival_parameters
+        self.parameters = {name: tuple(parameters[name]) for name in gene_dup_survival.category_names}
+        self.n_max = n_max
+        self._log10_pratio = None
+
+    @property
+    def shape(self):
+        #from the grids, so it is known even without the pratio array (None while a tiled surface is being written)
+        return (self.t1_range.size, self.t2_range.size)
+
+    @property
+    def composition(self):
+        return (self.alt_func_percent, self.dos_percent, self.non_percent)
+
+    @property
+    def log10_pratio(self):
+        #log10 of the surface, computed on first use and then kept
+        if self._log10_pratio is None:
+            self._log10_pratio = np.log10(self.pratio)
+        return self._log10_pratio
+
+    def surface(self, scale='pratio'):
+        #the t1 x t2 surface on the linear ('pratio') or log10 ('log of pratio') scale, see scale_aliases
+        return self.pratio if normalize_scale(scale) == 'pratio' else self.log10_pratio
+
+    def long_format_columns(self, columns=None):
+        #long format columns in t1-major order (one row per (t1, t2) cell), keyed by long_format_column_names
+        #the pratio and log of pratio columns are reshaped views of the surface buffers, not copies
+        if columns is None:
+            columns = long_format_column_names
+        q1, q2 = self.shape
+        values = {}
+        for column in columns:
+            if column == 't1':
+                values[column] = np.repeat(self.t1_range, q2)
+            elif column == 't2':
+                values[column] = np.tile(self.t2_range, q1)
+            elif column == 'pratio':
+                values[column] = self.pratio.reshape(-1)
+            elif column == 'log of pratio':
+                values[column] = self.log10_pratio.reshape(-1)
+            elif column.endswith('_surv_t1'):
+                values[column] = np.repeat(self.st1[category_of_column(column)], q2)
+            elif column.endswith('_surv_t2'):
+                values[column] = np.tile(self.st2[category_of_column(column)], q1)
+            else:
+                raise ValueError('unknown long format column ' + repr(column))
+        return values
+
+    def long_format(self, scale='pratio'):
+        #(q1*q2, 3) array of (t1, t2, pratio) rows, or (t1, t2, log10 pratio) with scale='log of pratio'
+        values = self.long_format_columns(['t1', 't2', normalize_scale(scale)])
+        return np.column_stack(list(values.values()))
+
+def category_of_column(column):
+    #category name of a long format survival column ('alt_surv_t1' -> 'alt_func')
+    prefix = column.split('_surv_')[0]
+    return 'alt_func' if prefix == 'alt' else prefix
+
+def calculate_scenario_surface(t1_range, composition, switch=0.0, t2_range=None, parameters=None, n_max=gene_dup_survival.n_max, cache=None, series_tolerance=None):
+    #PratioSurface for one composition (Alpha_Alt_func, Alpha_Dos, Alpha_Non) and switch value
+    #s(0) is replaced by survival_immediately_post_wgd on grids that start at t = 0
+    #with series_tolerance the survival series is truncated adaptively instead of at n_max terms
+    if t2_range is None:
+        t2_range = t1_range
+    st1 = gene_dup_cache.calculate_cached_category_survival_curves(t1_range, parameters, n_max, cache, series_tolerance)
+    st2 = gene_dup_cache.calculate_cached_category_survival_curves(t2_range, parameters, n_max, cache, series_tolerance)
+    st1 = {name: gene_dup_survival.patch_survival_immediately_post_wgd(curve, t1_range) for name, curve in st1.items()}
+    st2 = {name: gene_dup_survival.patch_survival_immediately_post_wgd(curve, t2_range) for name, curve in st2.items()}
+    alt_func_percent, dos_percent, non_percent = composition
+    with gene_dup_profile.stage('pratio_surface'):
+        pratio = calculate_pratio_surface(st1, st2, alt_func_percent, dos_percent, non_percent, switch)
+    return PratioSurface(t1_range, t2_range, st1, st2, pratio, alt_func_percent, dos_percent, non_percent, switch, parameters, n_max)
+
+def calculate_scenario_tensor(time_ranges, composition, switch=0.0, parameters=None, n_max=gene_dup_survival.n_max, cache=None):
+    #retention ratio tensor for duplication events on the given grids (one per event, t1 first), shape (q1, ..., qk)
+    #each grid's survival vectors come from the survival cache, so events sharing a grid share one computation
+    survivals = []
+    for time_range in time_ranges:
+        curves = gene_dup_cache.calculate_cached_category_survival_curves(time_range, parameters, n_max, cache)
+        survivals.append([gene_dup_survival.patch_survival_immediately_post_wgd(curve, time_range) for curve in survival_vectors(curves)])
+    alt_func_percent, dos_percent, non_percent = composition
+    return calculate_retention_ratio_tensor(survivals, alt_func_percent, dos_percent, non_percent, switch)
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""
+Stage-level instrumentation: which stage of a run (survival kernel, pratio surface, csv or binary output, csv reload,
+figure rendering, results store) the time goes to, per scenario and in total.
+
+Purpose:
+    1) Record wall time and call count of every stage, and counters such as survival-kernel evaluations (kernel calls,
+       curves and points evaluated) and survival cache hits, disk hits and misses.
+    2) Attribute them to the scenario being run, including scenarios run in worker processes (each worker returns its
+       scenario record to the parent, see gene_dup_runner.run_profiled_scenario).
+    3) Write everything as one JSON report and, optionally, one cProfile dump per scenario.
+
+Everything sits behind a single switch: enable() (or --profile DIRECTORY on gene_dup_runner, or profile_directory in
+the Oct 2023 script), given a directory for the cProfile dumps if they are wanted. While it is off, stage() hands
+back a shared do-nothing context and count() returns at once.
+
+Stage times are inclusive wall times: a stage that runs inside another (the survival kernel inside grid refinement)
+is counted in both.
+
+"""
+import contextlib
+import cProfile
+import datetime
+import json
+import os
+import platform
+import time
+
+###########################################################################
+#initialize parameters
+enabled = False
+#one cProfile dump per scenario is written here when set
+cprofile_directory = None
+
+report_file_name = 'profile.json'
+cprofile_suffix = '.prof'
+
+#totals over the whole run, and the finished scenario records
+stage_totals = {}
+counter_totals = {}
+scenario_records = []
+#record of the scenario running in this process, None outside scenarios
+current_scenario = None
+
+null_stage = contextlib.nullcontext()
+
+
+###########################################################################
+#Functions
+
+def enable(flag=True, dump_directory=None):
+    #switch the instrumentation on (or off), with cProfile dumps written to dump_directory when given
+    global enabled, cprofile_directory
+    enabled = bool(flag)
+    cprofile_directory = dump_directory
+    if dump_directory is not None:
+        os.makedirs(dump_directory, exist_ok=True)
+
+def reset():
+    #forget everything recorded so far (the switch is left as it is)
+    global current_scenario
+    stage_totals.clear()
+    counter_totals.clear()
+    scenario_records.clear()
+    current_scenario = None
+
+def add_stage_time(stages, name, seconds, calls=1):
+    entry = stages.setdefault(name, {'seconds': 0.0, 'calls': 0})
+    entry['seconds'] += seconds
+    entry['calls'] += calls
+
+def add_count(counters, name, amount):
+    counters[name] = counters.get(name, 0) + amount
+
+class Stage:
+    #times one pass through a stage into the current scenario, or into the totals outside scenarios
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exception):
+        seconds = time.perf_counter() - self.start
+        add_stage_time(stage_totals if current_scenario is None else current_scenario['stages'], self.name, seconds)
+        return False
+
+def stage(name):
+    #context manager timing a stage: with gene_dup_profile.stage('csv_write'): ...
+    if not enabled:
+        return null_stage
+    return Stage(name)
+
+def count(name, amount=1):
+    #add amount to a counter of the current scenario (or of the totals outside scenarios)
+    if enabled:
+        add_count(counter_totals if current_scenario is None else current_scenario['counters'], name, amount)
+
+@contextlib.contextmanager
+def scenario(label):
+    #record of one scenario: {'scenario', 'seconds', 'stages', 'counters', 'process'} plus 'cprofile' when dumped
+    #the record is yielded and filled in on exit; pass it to record_scenario in the process that writes the report
+    global current_scenario
+    record = {'scenario': label, 'seconds': 0.0, 'stages': {}, 'counters': {}, 'process': os.getpid()}
+    if not enabled:
+        yield record
+        return
+    previous = current_scenario
+    current_scenario = record
+    #cProfile cannot nest, so only the outermost scenario is dumped
+    dump_path = cprofile_path(cprofile_directory, label) if previous is None else None
+    profiler = cProfile.Profile() if dump_path is not None else None
+    start = time.perf_counter()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield record
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(dump_path)
+            record['cprofile'] = dump_path
+        record['seconds'] = time.perf_counter() - start
+        current_scenario = previous
+
+def record_scenario(record):
+    #add a finished scenario record (from this process or a worker) to the report and the totals
+    if not enabled or record is None:
+        return
+    scenario_records.append(record)
+    for name, entry in record['stages'].items():
+        add_stage_time(stage_totals, name, entry['seconds'], entry['calls'])
+    for name, amount in record['counters'].items():
+        add_count(counter_totals, name, amount)
+
+def cprofile_path(directory, label):
+    #dump file of one scenario, named after its label with path separators removed
+    if directory is None:
+        return None
+    safe_label = ''.join(character if character.isalnum() or character in '-_.' else '_' for character in str(label))
+    return os.path.join(directory, safe_label + cprofile_suffix)
+
+def report():
+    #everything recorded so far as a JSON-ready dict, stages sorted by total time
+    stages = dict(sorted(stage_totals.items(), key=lambda item: -item[1]['seconds']))
+    return {
+        'time': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'stages': stages,
+        'counters': dict(sorted(counter_totals.items())),
+        'scenarios': list(scenario_records),
+        }
+
+def write_report(directory):
+    #write directory/profile.json and return its path
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, report_file_name)
+    with open(path, 'w') as file:
+        json.dump(report(), file, indent=1)
+    return path
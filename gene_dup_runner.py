@@ -0,0 +1,348 @@
+# -*- coding: utf-8 -*-
+"""
+Runner for batches of gene duplicability scenarios.
+
+Purpose:
+    1) Describe each scenario explicitly (composition, switch, grids, model parameters, n_max and outputs) as a plain
+       dict, so nothing depends on module-level globals such as alt_func_percent or switch.
+    2) Spread independent scenarios across a configurable number of worker processes and gather the results in the
+       order the scenarios were given, writing exactly the same files as a serial run.
+    3) Command-line entry point that runs every scenario listed in a JSON or TOML manifest, skipping scenarios whose
+       outputs already exist and whose inputs hash identically to the run that wrote them.
+    4) Optionally take results from, and checkpoint every finished scenario into, a content-addressed results store
+       (gene_dup_store), so an interrupted sweep resumes where it stopped.
+    5) Optionally profile the run (gene_dup_profile): time and counters per stage and per scenario, including those run
+       in worker processes, written to DIRECTORY/profile.json, plus one cProfile dump per scenario with --cprofile.
+
+Usage:
+    python gene_dup_runner.py manifests/oct_2023_submission.json [--workers N] [--force] [--dry-run] [--store DIRECTORY]
+                                                                 [--profile DIRECTORY [--cprofile]]
+
+Manifest layout (JSON shown, TOML uses the same keys):
+    {"output_directory": "results", "store": "results_store",
+     "defaults": {"n_max": 100, "time_grid": {"start": 0.01, "step": 0.01, "count": 51}, "switch": 0,
+                  "parameters": {"alt_func": [10.0, 2.37, 0.00054, 5.84], ...},
+                  "output_formats": ["csv"], "figures": ["scatter"], "scale": "pratio"},
+     "scenarios": [{"name": "duplicability_{alt}_{dos}_{non}", "compositions": [[0.3, 0.45, 0.25], ...]},
+                   {"name": "mut_op_{alt}_{dos}_{non}_{switch}", "composition": [0.3, 0.45, 0.25], "switches": [0.25, 0.75]}]}
+    Every scenario entry overrides the defaults. "compositions" and "switches" expand one entry into one scenario per
+    combination, with {alt}, {dos}, {non} and {switch} in the name replaced by percentages. "t1_range"/"t2_range"
+    may be given instead of "time_grid", each as any grid spec of gene_dup_grids (explicit list, uniform, log, or
+    adaptive, which is refined per scenario and shared by t1 and t2). "max_block_cells" computes very large surfaces
+    out of core. "n_max": null (JSON) evaluates the survival series untruncated, which stays accurate for t of 10 and beyond.
+    "series_tolerance": 1e-12 truncates the series adaptively instead of at n_max terms (gene_dup_survival): every
+    survival value within the tolerance, including where the n_max series breaks down, at some cost on short grids.
+
+"""
+import argparse
+import concurrent.futures
+import copy
+import functools
+import hashlib
+import itertools
+import json
+import os
+import tempfile
+import tomllib
+
+import gene_dup_grids
+import gene_dup_io
+import gene_dup_plots
+import gene_dup_pratio
+import gene_dup_profile
+import gene_dup_store
+import gene_dup_survival
+
+###########################################################################
+#initialize parameters
+#None uses every core
+number_of_workers = None
+
+#bumped whenever a change to the engine alters results, so older outputs are no longer treated as up to date
+engine_version = 1
+inputs_suffix = '.inputs.json'
+
+
+###########################################################################
+#Functions
+
+def make_scenario(composition, switch=0.0, t1_range=None, t2_range=None, parameters=None, n_max=gene_dup_survival.n_max, file_name=None, output_formats=(), figures=(), scale='pratio', max_block_cells=None, series_tolerance=None):
+    #scenario dict: composition is (Alpha_Alt_func, Alpha_Dos, Alpha_Non); file_name is written once per entry of output_formats
+    #figures lists the figure kinds (see gene_dup_plots.figure_kinds) rendered for the scenario by run_manifest
+    #with max_block_cells the surface is computed out of core, in bands of at most that many cells streamed to the outputs
+    #with series_tolerance the survival series is truncated adaptively instead of at n_max terms
+    if t1_range is None:
+        t1_range = gene_dup_grids.uniform_grid(0.01, 0.01, 51).tolist()
+    if parameters is None:
+        parameters = gene_dup_survival.default_survival_parameters
+    return {
+        'composition': [float(x) for x in composition],
+        'switch': float(switch),
+        't1_range': [float(x) for x in t1_range],
+        't2_range': None if t2_range is None else [float(x) for x in t2_range],
+        'parameters': {name: [float(x) for x in parameters[name]] for name in gene_dup_survival.category_names},
+        'n_max': None if n_max is None else int(n_max),
+        'file_name': file_name,
+        'output_formats': list(output_formats),
+        'figures': list(figures),
+        'scale': scale,
+        'max_block_cells': max_block_cells,
+        'series_tolerance': None if series_tolerance is None else float(series_tolerance),
+        }
+
+def run_scenario(scenario, store_directory=None):
+    #compute one scenario (or take it from the results store), write its outputs and return its PratioSurface
+    #with a store, the result is checkpointed into it as soon as it is computed
+    if scenario.get('max_block_cells'):
+        return run_tiled_scenario(scenario, store_directory)
+    store = None if store_directory is None else gene_dup_store.ResultsStore(store_directory)
+    key = None if store is None else gene_dup_store.result_key(scenario)
+    if store is not None and store.has(key):
+        with gene_dup_profile.stage('store_read'):
+            surface = store.get(key)
+        gene_dup_profile.count('store_hits')
+    else:
+        surface = gene_dup_pratio.calculate_scenario_surface(scenario['t1_range'], scenario['composition'], scenario['switch'],
+                                                             t2_range=scenario['t2_range'], parameters=scenario['parameters'], n_max=scenario['n_max'],
+                                                             series_tolerance=scenario.get('series_tolerance'))
+        if store is not None:
+            with gene_dup_profile.stage('store_write'):
+                store.put(key, surface)
+    for output_format in scenario['output_formats']:
+        gene_dup_io.write_pratio_surface(surface, scenario['file_name'], output_format)
+    return surface
+
+def run_tiled_scenario(scenario, store_directory=None):
+    #out-of-core scenario: the binary output is always written (it is the result), the csv is streamed alongside if requested
+    #with a store, a stored result is linked out (and its csv written band by band) instead of being recomputed, and a
+    #computed result is linked into the store, so nothing of the size of the surface is ever held in memory
+    unknown_formats = set(scenario['output_formats']) - {'csv', 'npy'}
+    if unknown_formats:
+        raise ValueError('unknown output formats ' + repr(sorted(unknown_formats)))
+    path = scenario['file_name'] + gene_dup_io.binary_suffix
+    csv_path = scenario['file_name'] + '.csv' if 'csv' in scenario['output_formats'] else None
+    store = None if store_directory is None else gene_dup_store.ResultsStore(store_directory)
+    key = None if store is None else gene_dup_store.result_key(scenario)
+    if store is not None and store.has(key):
+        with gene_dup_profile.stage('store_read'):
+            gene_dup_io.copy_pratio_surface(store.path_for(key), path)
+        gene_dup_profile.count('store_hits')
+        surface = gene_dup_io.load_pratio_surface(path)
+        if csv_path is not None:
+            gene_dup_io.write_pratio_surface_csv_in_bands(surface, csv_path, gene_dup_pratio.long_format_column_names, scenario['max_block_cells'])
+        return surface
+    surface = gene_dup_io.write_tiled_pratio_surface(path, scenario['t1_range'], scenario['composition'], scenario['switch'], scenario['t2_range'],
+                                                     scenario['parameters'], scenario['n_max'], scenario['max_block_cells'], csv_path, gene_dup_pratio.long_format_column_names,
+                                                     scenario.get('series_tolerance'))
+    if store is not None:
+        with gene_dup_profile.stage('store_write'):
+            store.put_path(key, path)
+    return surface
+
+def run_scenario_without_result(scenario, store_directory=None):
+    #run_scenario for workers whose results are only needed on disk (nothing is sent back to the parent)
+    run_scenario(scenario, store_directory)
+
+def profile_label(scenario):
+    #name of a scenario in the profile report: its output name, or its composition and switch
+    if scenario.get('file_name'):
+        return os.path.basename(scenario['file_name'])
+    return 'scenario_' + '_'.join(format_percent(value) for value in list(scenario['composition']) + [scenario['switch']])
+
+def run_profiled_scenario(scenario, store_directory=None, return_surfaces=True, cprofile_directory=None):
+    #run_scenario with profiling switched on (in this process or a worker), returning (surface or None, profile record)
+    gene_dup_profile.enable(True, cprofile_directory)
+    with gene_dup_profile.scenario(profile_label(scenario)) as record:
+        surface = run_scenario(scenario, store_directory)
+    return (surface if return_surfaces else None), record
+
+def resolve_number_of_workers(workers):
+    if workers is None:
+        workers = number_of_workers
+    if workers is None:
+        workers = os.cpu_count() or 1
+    return max(1, int(workers))
+
+def run_scenarios(scenarios, workers=None, return_surfaces=True, store_directory=None, on_finished=None):
+    #run every scenario, in worker processes when workers > 1, and return the results in scenario order
+    #while profiling, every scenario (wherever it runs) sends its profile record back with its result
+    #on_finished(scenario) is called in this process as each scenario completes (in completion order)
+    scenarios = list(scenarios)
+    workers = min(resolve_number_of_workers(workers), max(1, len(scenarios)))
+    if gene_dup_profile.enabled:
+        function = functools.partial(run_profiled_scenario, store_directory=store_directory, return_surfaces=return_surfaces,
+                                     cprofile_directory=gene_dup_profile.cprofile_directory)
+    else:
+        function = functools.partial(run_scenario if return_surfaces else run_scenario_without_result, store_directory=store_directory)
+    results = [None] * len(scenarios)
+    if workers == 1:
+        for index, scenario in enumerate(scenarios):
+            results[index] = function(scenario)
+            if on_finished is not None:
+                on_finished(scenario)
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(function, scenario): index for index, scenario in enumerate(scenarios)}
+            for future in concurrent.futures.as_completed(futures):
+                results[futures[future]] = future.result()
+                if on_finished is not None:
+                    on_finished(scenarios[futures[future]])
+    if not gene_dup_profile.enabled:
+        return results
+    for _, record in results:
+        gene_dup_profile.record_scenario(record)
+    return [surface for surface, _ in results]
+
+def scenario_input_hash(scenario):
+    #sha256 of every input of the scenario (and the engine version), independent of key order
+    canonical = json.dumps({'engine_version': engine_version, 'scenario': scenario}, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+def scenario_output_paths(scenario):
+    #every file or directory a scenario writes
+    paths = []
+    for output_format in scenario['output_formats']:
+        paths.append(scenario['file_name'] + ('.csv' if output_format == 'csv' else gene_dup_io.binary_suffix))
+    for kind in scenario.get('figures', []):
+        paths.append(scenario['file_name'] + '_' + kind + '.' + gene_dup_plots.image_format)
+    return paths
+
+def scenario_is_up_to_date(scenario):
+    #outputs exist and were written from inputs that hash identically
+    try:
+        with open(scenario['file_name'] + inputs_suffix) as file:
+            recorded = json.load(file)
+    except (OSError, ValueError):
+        return False
+    if recorded.get('hash') != scenario_input_hash(scenario):
+        return False
+    return all(os.path.exists(path) for path in scenario_output_paths(scenario))
+
+def record_scenario_inputs(scenario):
+    #written last and atomically, so an interrupted scenario is never mistaken for a finished one
+    path = scenario['file_name'] + inputs_suffix
+    handle, temporary_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix='.tmp')
+    with os.fdopen(handle, 'w') as file:
+        json.dump({'hash': scenario_input_hash(scenario), 'scenario': scenario}, file, indent=1)
+    os.replace(temporary_path, path)
+
+def scenario_label(scenario):
+    #figure title for a scenario, in the style of the Oct 2023 script
+    alt_func_percent, dos_percent, non_percent = scenario['composition']
+    return str(100*scenario['switch']) + "% switch,  \n" + str(100*alt_func_percent) + "% Alt_func, " + str(100*dos_percent) + "% Dos, " + str(100*non_percent) + "% Non"
+
+###########################################################################
+#Manifests
+
+def load_manifest(path):
+    #manifest dict from a .json or .toml file
+    if path.endswith('.toml'):
+        with open(path, 'rb') as file:
+            return tomllib.load(file)
+    with open(path) as file:
+        return json.load(file)
+
+def time_range_from_spec(spec, composition=None, switch=0.0, parameters=None, n_max=gene_dup_survival.n_max):
+    #list of times for any gene_dup_grids spec (explicit list, uniform, log or, for a given scenario, adaptive)
+    return gene_dup_grids.resolve_time_grid(spec, composition, switch, parameters, n_max).tolist()
+
+def format_percent(value):
+    return str(100*float(value))
+
+def scenarios_from_manifest(manifest, base_directory='.'):
+    #scenario dicts for every entry of the manifest, each entry expanded over its compositions and switches
+    defaults = manifest.get('defaults', {})
+    output_directory = os.path.join(base_directory, manifest.get('output_directory', '.'))
+    scenarios = []
+    for entry in manifest['scenarios']:
+        settings = copy.deepcopy(defaults)
+        settings.update(entry)
+        compositions = settings.get('compositions', [settings.get('composition')])
+        switches = settings.get('switches', [settings.get('switch', 0.0)])
+        parameters = dict(gene_dup_survival.default_survival_parameters)
+        parameters.update(settings.get('parameters', {}))
+        n_max = settings.get('n_max', gene_dup_survival.n_max)
+        t1_spec = settings.get('t1_range', settings.get('time_grid', {'start': 0.01, 'step': 0.01, 'count': 51}))
+        t2_spec = settings.get('t2_range')
+        #scale and figure kinds are checked here, so a bad entry fails before anything is computed or written
+        try:
+            scale = gene_dup_pratio.normalize_scale(settings.get('scale', 'pratio'))
+        except ValueError as error:
+            raise ValueError('scenario ' + repr(settings.get('name')) + ': ' + str(error))
+        unknown_kinds = [kind for kind in settings.get('figures', []) if kind not in gene_dup_plots.figure_kinds]
+        if unknown_kinds:
+            raise ValueError('scenario ' + repr(settings.get('name')) + ': unknown figure kinds ' + str(unknown_kinds) + ', expected some of ' + str(gene_dup_plots.figure_kinds))
+        if gene_dup_grids.is_adaptive(t2_spec):
+            raise ValueError('scenario ' + repr(settings.get('name')) + ': an adaptive grid is shared by t1 and t2, give it as "time_grid" or "t1_range" only')
+        t2_range = None if t2_spec is None else time_range_from_spec(t2_spec)
+        fixed_t1_range = None if gene_dup_grids.is_adaptive(t1_spec) else time_range_from_spec(t1_spec)
+        for composition, switch in itertools.product(compositions, switches):
+            if composition is None:
+                raise ValueError('scenario ' + repr(settings.get('name')) + ' has no composition')
+            t1_range = fixed_t1_range
+            if t1_range is None:
+                t1_range = time_range_from_spec(t1_spec, composition, switch, parameters, n_max)
+            name = settings['name'].format(alt=format_percent(composition[0]), dos=format_percent(composition[1]), non=format_percent(composition[2]), switch=format_percent(switch))
+            scenarios.append(make_scenario(composition, switch, t1_range, t2_range, parameters, n_max,
+                                           os.path.join(output_directory, name), settings.get('output_formats', ['csv']), settings.get('figures', []), scale,
+                                           settings.get('max_block_cells'), settings.get('series_tolerance')))
+    names = [scenario['file_name'] for scenario in scenarios]
+    duplicates = sorted(set(name for name in names if names.count(name) > 1))
+    if duplicates:
+        raise ValueError('manifest produces the same output name more than once: ' + ', '.join(duplicates))
+    return scenarios
+
+def run_manifest(path, workers=None, force=False, dry_run=False, store_directory=None):
+    #run every scenario of the manifest that is not up to date; returns (scenarios run, scenarios skipped)
+    #results come from / are checkpointed into store_directory, or the manifest's "store", when one is given
+    manifest = load_manifest(path)
+    base_directory = os.path.dirname(os.path.abspath(path))
+    scenarios = scenarios_from_manifest(manifest, base_directory)
+    if store_directory is None and 'store' in manifest:
+        store_directory = os.path.join(base_directory, manifest['store'])
+    up_to_date = [not force and scenario_is_up_to_date(scenario) for scenario in scenarios]
+    pending = [scenario for scenario, skip in zip(scenarios, up_to_date) if not skip]
+    skipped = [scenario for scenario, skip in zip(scenarios, up_to_date) if skip]
+    for scenario in skipped:
+        print('up to date: ' + scenario['file_name'])
+    for scenario in pending:
+        print(('would run: ' if dry_run else 'running: ') + scenario['file_name'])
+    if dry_run or not pending:
+        return pending, skipped
+    for scenario in pending:
+        os.makedirs(os.path.dirname(os.path.abspath(scenario['file_name'])), exist_ok=True)
+    #each scenario is marked up to date as soon as all of its outputs are written (after its figures, if it has any),
+    #so a campaign killed partway through only reruns what had not finished
+    def record_if_finished(scenario):
+        if not scenario['figures']:
+            record_scenario_inputs(scenario)
+    needs_figures = any(scenario['figures'] for scenario in pending)
+    surfaces = run_scenarios(pending, workers, return_surfaces=needs_figures, store_directory=store_directory, on_finished=record_if_finished)
+    if needs_figures:
+        figure_jobs = [{'surface': surface, 'file_name': scenario['file_name'], 'percents': scenario_label(scenario), 'kinds': scenario['figures'], 'scale': scenario['scale']}
+                       for scenario, surface in zip(pending, surfaces) if scenario['figures']]
+        scenarios_by_file_name = {scenario['file_name']: scenario for scenario in pending}
+        gene_dup_plots.render_figures(figure_jobs, resolve_number_of_workers(workers),
+                                      on_rendered=lambda job: record_scenario_inputs(scenarios_by_file_name[job['file_name']]))
+    return pending, skipped
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run the gene duplicability scenarios listed in a JSON or TOML manifest.')
+    parser.add_argument('manifest', help='path to the .json or .toml manifest')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes (default: every core)')
+    parser.add_argument('--force', action='store_true', help='recompute scenarios even if they are up to date')
+    parser.add_argument('--dry-run', action='store_true', help='only list which scenarios would run')
+    parser.add_argument('--store', default=None, help='content-addressed results store to resume from and checkpoint into')
+    parser.add_argument('--profile', default=None, metavar='DIRECTORY', help='write a per-stage, per-scenario profile report to DIRECTORY/profile.json')
+    parser.add_argument('--cprofile', action='store_true', help='with --profile, also write one cProfile dump per scenario to DIRECTORY')
+    arguments = parser.parse_args(argv)
+    if arguments.profile is not None:
+        gene_dup_profile.enable(True, arguments.profile if arguments.cprofile else None)
+    pending, skipped = run_manifest(arguments.manifest, arguments.workers, arguments.force, arguments.dry_run, arguments.store)
+    print(str(len(pending)) + (' to run, ' if arguments.dry_run else ' run, ') + str(len(skipped)) + ' up to date')
+    if arguments.profile is not None:
+        print('profile report: ' + gene_dup_profile.write_report(arguments.profile))
+    return 0
+
+if __name__ == '__main__':
+    raise SystemExit(main())
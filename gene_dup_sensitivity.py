@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+"""
+Global sensitivity of the pratio surfaces to the survival parameters b, c, d, f of each category.
+
+Purpose:
+    1) Sample the survival parameters over ranges around their values (default_survival_parameters, +-20%) by a full
+       factorial grid, a Latin hypercube or a Sobol sequence.
+    2) Evaluate the survival curves and pratio surfaces of all samples as one batch along a leading parameter axis
+       (calculate_survival_curves takes arrays of b, c, d, f; calculate_pratio_surface broadcasts over leading axes),
+       in chunks of at most gene_dup_pratio.max_batch_cells values, so thousands of draws take seconds. Survival is computed
+       once per category and grid (t2 reuses t1 when the grids are the same), and in the Saltelli design only the
+       category whose parameter is swapped is recomputed.
+    3) Report variance-based indices for every (t1, t2) cell: the first-order index S_i (share of the variance of the
+       output explained by parameter i alone) and the total index ST_i (share involving parameter i, interactions
+       included).
+
+Parameters follow the category constraints of gene_dup_fit: Dos keeps d = -f (f is sampled, d follows), and for Non
+only d is sampled (b = 0 and c = 1 are fixed, and survival depends on d + f only). A factor is written
+(category, parameter, low, high), e.g. ('alt_func', 'c', 2.0, 2.7).
+
+Indices:
+    grid:        the samples are every combination of levels values per factor, and S_i and ST_i are computed exactly
+                 for that discrete distribution: S_i = Var(E[Y | X_i]) / Var(Y), ST_i = E[Var(Y | X_~i)] / Var(Y).
+    lhs, sobol:  Saltelli design. Two base matrices A and B of N samples (the two halves of a 2k-dimensional Latin
+                 hypercube or Sobol sample) and, per factor, A with column i taken from B; N*(k + 2) evaluations.
+                 S_i = mean(Y_B*(Y_ABi - Y_A)) / V (Saltelli 2010), ST_i = mean((Y_A - Y_ABi)**2) / (2V) (Jansen).
+
+"""
+import itertools
+
+import numpy as np
+
+import gene_dup_fit
+import gene_dup_io
+import gene_dup_pratio
+import gene_dup_survival
+
+###########################################################################
+#initialize parameters
+#default factor ranges: each sampled parameter from value*(1 - relative_range) to value*(1 + relative_range)
+relative_range = 0.2
+sampling_methods = ('grid', 'lhs', 'sobol')
+#base samples N for lhs and sobol (a power of 2 keeps the Sobol sample balanced), levels per factor for grid
+number_of_samples = 1024
+grid_levels = 3
+
+#Sobol direction numbers (Joe and Kuo, new-joe-kuo-6.21201) for dimensions 2 to 24: (degree s, coefficients a, m_1..m_s)
+#dimension 1 is the van der Corput sequence
+sobol_bits = 32
+sobol_direction_numbers = [
+    (1, 0, (1,)), (2, 1, (1, 3)), (3, 1, (1, 3, 1)), (3, 2, (1, 1, 1)), (4, 1, (1, 1, 3, 3)), (4, 4, (1, 3, 5, 13)),
+    (5, 2, (1, 1, 5, 5, 17)), (5, 4, (1, 1, 5, 5, 5)), (5, 7, (1, 1, 7, 11, 19)), (5, 11, (1, 1, 5, 1, 1)),
+    (5, 13, (1, 1, 1, 3, 11)), (5, 14, (1, 3, 5, 5, 31)), (6, 1, (1, 3, 3, 9, 7, 49)), (6, 13, (1, 1, 1, 15, 21, 21)),
+    (6, 16, (1, 3, 1, 13, 27, 49)), (6, 19, (1, 1, 1, 15, 7, 5)), (6, 22, (1, 3, 1, 15, 13, 25)),
+    (6, 25, (1, 1, 5, 5, 19, 61)), (7, 1, (1, 3, 7, 11, 23, 15, 103)), (7, 4, (1, 3, 7, 13, 13, 15, 69)),
+    (7, 7, (1, 1, 3, 13, 7, 35, 63)), (7, 8, (1, 3, 5, 9, 1, 25, 53)), (7, 14, (1, 3, 1, 13, 9, 35, 107)),
+    ]
+
+
+###########################################################################
+#Functions
+
+def default_factors(parameters=None, relative_range=relative_range):
+    #(category, parameter, low, high) for every parameter gene_dup_fit would fit, +-relative_range around its value
+    #and kept inside the category's bounds
+    if parameters is None:
+        parameters = gene_dup_survival.default_survival_parameters
+    factors = []
+    for category in gene_dup_survival.category_names:
+        bounds = gene_dup_fit.category_constraints[category]['bounds']
+        for name in gene_dup_fit.free_parameter_names(category):
+            value = parameters[category][gene_dup_fit.parameter_names.index(name)]
+            low, high = sorted((value * (1 - relative_range), value * (1 + relative_range)))
+            factors.append((category, name, max(low, bounds[name][0]), min(high, bounds[name][1])))
+    return factors
+
+def factor_names(factors):
+    return [category + ' ' + name for category, name, _, _ in factors]
+
+def sobol_sequence(count, dimensions):
+    #first count points of the (unscrambled) Sobol sequence in [0, 1)**dimensions, in Gray code order
+    if dimensions > len(sobol_direction_numbers) + 1:
+        raise ValueError('Sobol sequences are available up to ' + str(len(sobol_direction_numbers) + 1) + ' dimensions')
+    directions = np.zeros((dimensions, sobol_bits), dtype=np.uint64)
+    directions[0] = [1 << (sobol_bits - k) for k in range(1, sobol_bits + 1)]
+    for dimension in range(1, dimensions):
+        degree, coefficients, initial = sobol_direction_numbers[dimension - 1]
+        m = list(initial)
+        for k in range(degree, sobol_bits):
+            value = m[k - degree] ^ (m[k - degree] << degree)
+            for j in range(1, degree):
+                if (coefficients >> (degree - 1 - j)) & 1:
+                    value ^= m[k - j] << j
+            m.append(value)
+        directions[dimension] = [m[k] << (sobol_bits - k - 1) for k in range(sobol_bits)]
+    index = np.arange(count, dtype=np.uint64)
+    gray = index ^ (index >> np.uint64(1))
+    points = np.zeros((count, dimensions), dtype=np.uint64)
+    for k in range(sobol_bits):
+        bit = ((gray >> np.uint64(k)) & np.uint64(1)).astype(bool)
+        points[bit] ^= directions[:, k]
+    return points.astype(float) / 2.0**sobol_bits
+
+def latin_hypercube(count, dimensions, rng):
+    #count points in [0, 1)**dimensions with exactly one point in each of the count strata of every dimension
+    strata = np.argsort(rng.random((dimensions, count)), axis=1).T
+    return (strata + rng.random((count, dimensions))) / count
+
+def unit_samples(method, count, dimensions, seed=0):
+    #(count, dimensions) points in the unit cube for 'lhs' or 'sobol'
+    if method == 'sobol':
+        return sobol_sequence(count, dimensions)
+    if method == 'lhs':
+        return latin_hypercube(count, dimensions, np.random.default_rng(seed))
+    raise ValueError('unknown sampling method ' + repr(method) + ', expected one of ' + str(sampling_methods))
+
+def scale_samples(unit, factors):
+    #unit cube points to parameter values, column i uniform on [low_i, high_i]
+    low = np.array([factor[2] for factor in factors])
+    high = np.array([factor[3] for factor in factors])
+    return low + unit * (high - low)
+
+def parameter_arrays(factors, values, parameters=None):
+    #{category: (b, c, d, f)} with each entry an array over the samples: the factors' sampled values, the category's
+    #other parameters at their values in parameters, and tied parameters (Dos d = -f) recomputed from the sampled ones
+    if parameters is None:
+        parameters = gene_dup_survival.default_survival_parameters
+    values = np.atleast_2d(values)
+    arrays = {category: [np.full(values.shape[0], float(x)) for x in parameters[category]] for category in gene_dup_survival.category_names}
+    for column, (category, name, _, _) in enumerate(factors):
+        arrays[category][gene_dup_fit.parameter_names.index(name)] = values[:, column]
+    for category in gene_dup_survival.category_names:
+        for name, (source, factor) in gene_dup_fit.category_constraints[category]['tied'].items():
+            arrays[category][gene_dup_fit.parameter_names.index(name)] = factor * arrays[category][gene_dup_fit.parameter_names.index(source)]
+    return {category: tuple(value) for category, value in arrays.items()}
+
+def batched_survival(time_range, b, c, d, f, n_max):
+    #(samples, q) survival for arrays of parameters, with s(0) replaced by survival_immediately_post_wgd
+    #in chunks of samples whose series terms hold at most gene_dup_pratio.max_batch_cells values
+    time_range = np.asarray(time_range, dtype=float)
+    survival = np.empty((b.size, time_range.size))
+    #the truncated series holds n_max terms per point, the untruncated evaluator a few values per point
+    chunk = max(1, gene_dup_pratio.max_batch_cells // (time_range.size * (1 if n_max is None else n_max)))
+    for start in range(0, b.size, chunk):
+        part = slice(start, start + chunk)
+        survival[part] = gene_dup_survival.calculate_survival_curves(b[part], c[part], d[part], f[part], time_range, n_max)
+    return gene_dup_survival.patch_survival_immediately_post_wgd(survival, time_range)
+
+def sample_survival(values, factors, t1_range, t2_range=None, parameters=None, n_max=gene_dup_survival.n_max, reference=None):
+    #survival of every sample: {'arrays': parameter_arrays, 'st1': {category: (samples, q1)}, 'st2': {category: (samples, q2)}}
+    #categories whose parameters are the same as in reference (an earlier result for the same number of samples)
+    #are taken from it; st2 is st1 when the grids are the same
+    t1_range = np.asarray(t1_range, dtype=float)
+    t2_range = t1_range if t2_range is None else np.asarray(t2_range, dtype=float)
+    same_grid = np.array_equal(t1_range, t2_range)
+    arrays = parameter_arrays(factors, values, parameters)
+    survival = {'arrays': arrays, 'st1': {}, 'st2': {}}
+    for category in gene_dup_survival.category_names:
+        if reference is not None and all(np.array_equal(x, y) for x, y in zip(arrays[category], reference['arrays'][category])):
+            survival['st1'][category] = reference['st1'][category]
+            survival['st2'][category] = reference['st2'][category]
+            continue
+        survival['st1'][category] = batched_survival(t1_range, *arrays[category], n_max)
+        survival['st2'][category] = survival['st1'][category] if same_grid else batched_survival(t2_range, *arrays[category], n_max)
+    return survival
+
+def sample_surfaces(survival, composition, switch=0.0, scale='log of pratio'):
+    #pratio (scale 'pratio') or log10 pratio (scale 'log of pratio') of every sample of sample_survival, shape (samples, q1, q2)
+    #computed in chunks of samples whose surfaces hold at most gene_dup_pratio.max_batch_cells values
+    scale = gene_dup_pratio.normalize_scale(scale)
+    st1, st2 = survival['st1'], survival['st2']
+    samples, q1 = st1['alt_func'].shape
+    q2 = st2['alt_func'].shape[1]
+    alt_func_percent, dos_percent, non_percent = composition
+    outputs = np.empty((samples, q1, q2))
+    chunk = max(1, gene_dup_pratio.max_batch_cells // (q1 * q2))
+    for start in range(0, samples, chunk):
+        part = slice(start, start + chunk)
+        pratio = gene_dup_pratio.calculate_pratio_surface({name: curve[part] for name, curve in st1.items()}, {name: curve[part] for name, curve in st2.items()},
+                                                          alt_func_percent, dos_percent, non_percent, switch)
+        if scale == 'pratio':
+            outputs[part] = pratio
+        else:
+            with np.errstate(divide='ignore', invalid='ignore'):
+                outputs[part] = np.log10(pratio)
+    return outputs
+
+def evaluate_parameter_samples(values, factors, t1_range, composition, switch=0.0, t2_range=None, parameters=None,
+                               n_max=gene_dup_survival.n_max, scale='log of pratio'):
+    #pratio or log10 pratio surface for every row of sampled factor values, shape (samples, q1, q2)
+    return sample_surfaces(sample_survival(values, factors, t1_range, t2_range, parameters, n_max), composition, switch, scale)
+
+def grid_indices(outputs, levels, number_of_factors):
+    #exact first-order and total indices of a full factorial sample, outputs in itertools.product order
+    cells = outputs.shape[1:]
+    grid = outputs.reshape((levels,) * number_of_factors + cells)
+    factor_axes = tuple(range(number_of_factors))
+    mean = grid.mean(axis=factor_axes)
+    variance = grid.var(axis=factor_axes)
+    first_order = []
+    total_order = []
+    for axis in factor_axes:
+        others = tuple(a for a in factor_axes if a != axis)
+        first_order.append(grid.mean(axis=others).var(axis=0))
+        total_order.append(grid.var(axis=axis).mean(axis=tuple(range(number_of_factors - 1))))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return mean, variance, np.array(first_order) / variance, np.array(total_order) / variance
+
+def calculate_sensitivity_indices(t1_range, composition, switch=0.0, t2_range=None, factors=None, method='sobol',
+                                  samples=None, parameters=None, n_max=gene_dup_survival.n_max, scale='log of pratio', seed=0):
+    #variance-based sensitivity of every (t1, t2) cell of the pratio (or log10 pratio) surface to the factors
+    #samples is N for 'lhs' and 'sobol' (N*(k + 2) evaluations) and the levels per factor for 'grid' (levels**k)
+    #returns a dict: 'names' (one per factor), 'factors', 'first_order' and 'total_order' (k, q1, q2), 'mean' and
+    #'variance' (q1, q2) of the output, 'method', 'evaluations', 't1_range', 't2_range'
+    if t2_range is None:
+        t2_range = t1_range
+    if factors is None:
+        factors = default_factors(parameters)
+    k = len(factors)
+    survival = lambda values, reference=None: sample_survival(values, factors, t1_range, t2_range, parameters, n_max, reference)
+    if method == 'grid':
+        levels = grid_levels if samples is None else int(samples)
+        #the midpoints of levels equal slices of each range
+        unit = np.array(list(itertools.product((np.arange(levels) + 0.5) / levels, repeat=k)))
+        mean, variance, first_order, total_order = grid_indices(sample_surfaces(survival(scale_samples(unit, factors)), composition, switch, scale), levels, k)
+        evaluations = unit.shape[0]
+    else:
+        count = number_of_samples if samples is None else int(samples)
+        unit = unit_samples(method, count, 2 * k, seed)
+        a, b = scale_samples(unit[:, :k], factors), scale_samples(unit[:, k:], factors)
+        survival_a = survival(a)
+        output_a, output_b = sample_surfaces(survival_a, composition, switch, scale), sample_surfaces(survival(b), composition, switch, scale)
+        mean = (output_a.mean(axis=0) + output_b.mean(axis=0)) / 2
+        variance = np.concatenate((output_a, output_b)).var(axis=0)
+        first_order = np.empty((k,) + mean.shape)
+        total_order = np.empty((k,) + mean.shape)
+        #one factor's A_B matrix at a time, so only three sets of surfaces are held; only the category of the
+        #swapped factor needs new survival curves
+        for i in range(k):
+            mixed = a.copy()
+            mixed[:, i] = b[:, i]
+            output_mixed = sample_surfaces(survival(mixed, survival_a), composition, switch, scale)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                first_order[i] = np.mean(output_b * (output_mixed - output_a), axis=0) / variance
+                total_order[i] = np.mean((output_a - output_mixed)**2, axis=0) / (2 * variance)
+        evaluations = count * (k + 2)
+    return {'names': factor_names(factors), 'factors': list(factors), 'first_order': first_order, 'total_order': total_order,
+            'mean': mean, 'variance': variance, 'method': method, 'evaluations': evaluations,
+            't1_range': np.asarray(t1_range, dtype=float), 't2_range': np.asarray(t2_range, dtype=float)}
+
+def write_sensitivity_csv(result, file_name_full):
+    #long format csv, one row per (t1, t2) cell in t1-major order: t1, t2, mean, variance, then S1 and ST per factor
+    columns = ['t1', 't2', 'mean', 'variance'] + ['S1 ' + name for name in result['names']] + ['ST ' + name for name in result['names']]
+    t1, t2 = np.meshgrid(result['t1_range'], result['t2_range'], indexing='ij')
+    values = [t1, t2, result['mean'], result['variance']] + list(result['first_order']) + list(result['total_order'])
+    return gene_dup_io.write_columns_csv(file_name_full, columns, values)
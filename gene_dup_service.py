@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+"""
+Local HTTP/JSON query service for survival curves, pratio surfaces and single pratio values.
+
+Purpose:
+    1) Answer queries for any composition, switch, parameter set, grid and n_max without editing module globals or
+       re-running a script, and without opening any matplotlib window, so a dashboard can sit on top of it.
+    2) Serve from warm caches: survival vectors come from the shared SurvivalCurveCache (optionally backed by an
+       on-disk store), which is filled for the default parameters and the submission grids at start-up, so a
+       repeated query only costs the pratio broadcast and the JSON encoding (milliseconds for q = 51).
+    3) Standard library only (http.server), bound to localhost by default.
+
+Usage:
+    python gene_dup_service.py [--host 127.0.0.1] [--port 8050] [--cache-directory DIRECTORY]
+
+Endpoints (GET with query parameters, or POST with the same fields as a JSON object):
+    /health     status and survival cache statistics
+    /survival   survival curves: {"t": [...], "survival": {"alt_func": [...], "dos": [...], "non": [...]}}
+    /surface    pratio surface: {"t1": [...], "t2": [...], "pratio": [[...], ...]} (or "log10_pratio" with
+                "scale": "log of pratio")
+    /value      one cell: {"t1": t1, "t2": t2, "pratio": value, "log10_pratio": value}
+
+Fields (as in manifests; every one is optional except t1 and t2 for /value):
+    "composition": [0.3, 0.45, 0.25]       (GET: composition=0.3,0.45,0.25)
+    "switch": 0.25
+    "time_grid", "t1_range", "t2_range":   any grid spec of gene_dup_grids (GET: JSON text)
+    "parameters": {"dos": [-17.0, 0.2573, -2.8e-05, 2.8e-05]}   categories not given keep their default values
+    "n_max": 100 (null evaluates the series untruncated)
+    "scale": "pratio" or "log of pratio" (or "log10")
+Non-finite values are returned as null. Errors come back as {"error": message} with status 400 (bad request), 404
+(unknown endpoint) or 500 (anything else going wrong while answering).
+
+"""
+import argparse
+import http.server
+import json
+import threading
+import time
+import urllib.parse
+
+import numpy as np
+
+import gene_dup_cache
+import gene_dup_grids
+import gene_dup_pratio
+import gene_dup_survival
+
+###########################################################################
+#initialize parameters
+host = '127.0.0.1'
+port = 8050
+
+default_composition = (0.3, 0.45, 0.25)
+default_time_grid = {'start': 0.01, 'step': 0.01, 'count': 51}
+#grids whose survival vectors are computed at start-up: the Oct 2023 and the Dec 2022 grids
+warm_time_grids = [{'start': 0.01, 'step': 0.01, 'count': 51}, {'start': 0, 'step': 0.01, 'count': 51}]
+
+#largest surface (t1 x t2 cells) and longest grid (time points, for survival curves or either axis of a surface)
+#computed for one request, checked from the grid specs before anything is evaluated
+max_response_cells = 2**20
+max_response_points = 2**16
+
+#the survival cache is not thread safe, so requests compute one at a time (and are read and answered concurrently)
+computation_lock = threading.Lock()
+
+
+###########################################################################
+#Functions
+
+def parse_query(query):
+    #request fields from a query string: JSON values where they parse, comma-separated numbers as lists, else text
+    fields = {}
+    for name, value in urllib.parse.parse_qsl(query, keep_blank_values=True):
+        try:
+            fields[name] = json.loads(value)
+        except ValueError:
+            try:
+                fields[name] = [float(x) for x in value.split(',')]
+            except ValueError:
+                fields[name] = value
+    return fields
+
+def request_parameters(fields):
+    #default_survival_parameters with the categories given in the request replaced
+    parameters = dict(gene_dup_survival.default_survival_parameters)
+    replaced = fields.get('parameters', {})
+    if not isinstance(replaced, dict):
+        raise ValueError('parameters must be an object of category -> [b, c, d, f]')
+    for name, values in replaced.items():
+        if name not in gene_dup_survival.category_names:
+            raise ValueError('unknown category ' + repr(name) + ', expected one of ' + str(gene_dup_survival.category_names))
+        if len(values) != 4:
+            raise ValueError('parameters of ' + name + ' must be (b, c, d, f)')
+        parameters[name] = tuple(float(x) for x in values)
+    return parameters
+
+def request_n_max(fields):
+    #series length of a request: null (untruncated) or 1 to max_series_terms terms
+    n_max = fields.get('n_max', gene_dup_survival.n_max)
+    if n_max is None:
+        return None
+    n_max = int(n_max)
+    if not 1 <= n_max <= gene_dup_survival.max_series_terms:
+        raise ValueError('n_max must be null or between 1 and ' + str(gene_dup_survival.max_series_terms) + ', got ' + str(n_max))
+    return n_max
+
+def check_grid_size(spec, name):
+    #number of points of a grid spec, rejected above max_response_points before the grid is built
+    size = gene_dup_grids.grid_spec_size(spec)
+    if size > max_response_points:
+        raise ValueError(name + ' of ' + str(size) + ' points is longer than ' + str(max_response_points))
+    return size
+
+def request_scenario(fields):
+    #(composition, switch, t1_range, t2_range, parameters, n_max) of a request
+    composition = tuple(float(x) for x in fields.get('composition', default_composition))
+    if len(composition) != 3:
+        raise ValueError('composition must be (Alpha_Alt_func, Alpha_Dos, Alpha_Non)')
+    switch = float(fields.get('switch', 0.0))
+    parameters = request_parameters(fields)
+    n_max = request_n_max(fields)
+    t1_spec = fields.get('t1_range', fields.get('time_grid', default_time_grid))
+    t1_size = check_grid_size(t1_spec, 't1_range')
+    t2_size = t1_size if 't2_range' not in fields else check_grid_size(fields['t2_range'], 't2_range')
+    if t1_size * t2_size > max_response_cells:
+        raise ValueError('surface of ' + str(t1_size) + ' x ' + str(t2_size) + ' cells is larger than ' + str(max_response_cells))
+    t1_range = gene_dup_grids.resolve_time_grid(t1_spec, composition, switch, parameters, n_max)
+    t2_range = t1_range if 't2_range' not in fields else gene_dup_grids.time_grid_from_spec(fields['t2_range'])
+    return composition, switch, t1_range, t2_range, parameters, n_max
+
+def json_values(values):
+    #nested lists of floats with every non-finite value as None (JSON has no NaN or Infinity)
+    values = np.asarray(values, dtype=float)
+    return np.where(np.isfinite(values), values, None).tolist()
+
+def health_response(fields, cache):
+    return {'status': 'ok', 'cache': cache.statistics()}
+
+def survival_response(fields, cache):
+    parameters = request_parameters(fields)
+    n_max = request_n_max(fields)
+    spec = fields.get('t_range', fields.get('time_grid', default_time_grid))
+    check_grid_size(spec, 't_range')
+    time_range = gene_dup_grids.time_grid_from_spec(spec)
+    survival = gene_dup_cache.calculate_cached_category_survival_curves(time_range, parameters, n_max, cache)
+    return {'t': time_range.tolist(), 'survival': {name: json_values(curve) for name, curve in survival.items()}}
+
+def surface_response(fields, cache):
+    composition, switch, t1_range, t2_range, parameters, n_max = request_scenario(fields)
+    surface = gene_dup_pratio.calculate_scenario_surface(t1_range, composition, switch, t2_range, parameters, n_max, cache)
+    scale = gene_dup_pratio.normalize_scale(fields.get('scale', 'pratio'))
+    key = 'pratio' if scale == 'pratio' else 'log10_pratio'
+    return {'t1': t1_range.tolist(), 't2': t2_range.tolist(), key: json_values(surface.surface(scale))}
+
+def value_response(fields, cache):
+    if 't1' not in fields or 't2' not in fields:
+        raise ValueError('a value query needs t1 and t2')
+    fields = dict(fields, t1_range=[fields['t1']], t2_range=[fields['t2']])
+    composition, switch, t1_range, t2_range, parameters, n_max = request_scenario(fields)
+    surface = gene_dup_pratio.calculate_scenario_surface(t1_range, composition, switch, t2_range, parameters, n_max, cache)
+    return {'t1': float(t1_range[0]), 't2': float(t2_range[0]), 'pratio': json_values(surface.pratio[0, 0]), 'log10_pratio': json_values(surface.log10_pratio[0, 0])}
+
+endpoints = {
+    '/health': health_response,
+    '/survival': survival_response,
+    '/surface': surface_response,
+    '/value': value_response,
+    }
+
+def answer(path, fields, cache):
+    #(status, response dict) for one request
+    if path not in endpoints:
+        return 404, {'error': 'unknown endpoint ' + path + ', expected one of ' + ', '.join(endpoints)}
+    start = time.perf_counter()
+    try:
+        with computation_lock:
+            response = endpoints[path](fields, cache)
+    except KeyError as error:
+        return 400, {'error': 'missing field ' + str(error)}
+    except (ValueError, TypeError) as error:
+        return 400, {'error': str(error)}
+    except Exception as error:
+        #the client gets an answer (and the handler thread survives) whatever went wrong
+        return 500, {'error': 'internal error: ' + type(error).__name__ + ': ' + str(error)}
+    response['milliseconds'] = 1000 * (time.perf_counter() - start)
+    return 200, response
+
+class ServiceHandler(http.server.BaseHTTPRequestHandler):
+    #JSON requests and responses; the survival cache is set on the server
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        self.send_json(*answer(url.path, parse_query(url.query), self.server.survival_cache))
+
+    def do_POST(self):
+        url = urllib.parse.urlsplit(self.path)
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            fields = json.loads(self.rfile.read(length) or b'{}')
+            if not isinstance(fields, dict):
+                raise ValueError('the request body must be a JSON object')
+        except ValueError as error:
+            self.send_json(400, {'error': 'bad JSON body: ' + str(error)})
+            return
+        fields.update(parse_query(url.query))
+        self.send_json(*answer(url.path, fields, self.server.survival_cache))
+
+    def send_json(self, status, response):
+        body = json.dumps(response, allow_nan=False).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        #requests are logged to stderr only with --verbose
+        if self.server.verbose:
+            http.server.BaseHTTPRequestHandler.log_message(self, format, *args)
+
+def warm_cache(cache, time_grids=warm_time_grids, parameters=None, n_max=gene_dup_survival.n_max):
+    #compute the survival vectors of the default parameters on the usual grids before the first request
+    for spec in time_grids:
+        gene_dup_cache.calculate_cached_category_survival_curves(gene_dup_grids.time_grid_from_spec(spec), parameters, n_max, cache)
+
+def make_server(host=host, port=port, cache=None, verbose=False):
+    #ThreadingHTTPServer answering the endpoints from cache (the shared default cache when None), already warmed
+    if cache is None:
+        cache = gene_dup_cache.default_survival_cache
+    warm_cache(cache)
+    server = http.server.ThreadingHTTPServer((host, port), ServiceHandler)
+    server.survival_cache = cache
+    server.verbose = verbose
+    return server
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve survival curves and pratio surfaces as JSON over HTTP.')
+    parser.add_argument('--host', default=host, help='address to listen on (default ' + host + ', this machine only)')
+    parser.add_argument('--port', type=int, default=port)
+    parser.add_argument('--cache-directory', default=None, help='on-disk survival cache shared across restarts')
+    parser.add_argument('--verbose', action='store_true', help='log every request')
+    arguments = parser.parse_args(argv)
+    cache = None if arguments.cache_directory is None else gene_dup_cache.SurvivalCurveCache(directory=arguments.cache_directory)
+    server = make_server(arguments.host, arguments.port, cache, arguments.verbose)
+    print('serving on http://' + arguments.host + ':' + str(server.server_address[1]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+if __name__ == '__main__':
+    raise SystemExit(main())
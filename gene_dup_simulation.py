@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+Monte Carlo genome simulator, to check the analytic pratio surfaces and to model finite-genome noise.
+
+Purpose:
+    1) Simulate a genome of N genes split into Alt_func, Dos and Non through two successive duplication events,
+       with the same survival model as the analytic surfaces: after t1 a duplicate is retained with probability
+       s1_k; after t2 every copy present (two for genes retained in t1, one for genes lost in t1) keeps its new
+       duplicate with probability s2_k, where retained Alt_func copies switch to Non with probability switch.
+    2) Give the empirical pratio = P(survived t2 | retained in t1) / P(survived t2 | lost in t1) of every (t1, t2)
+       cell with a confidence interval over replicates.
+    3) Run vectorized across replicates and grid cells, in worker processes, each band of t1 rows with its own
+       random stream spawned from one seed, so results depend on the seed and never on the number of workers.
+
+Genes of one category are exchangeable, so each step is drawn for all of a category's genes at once as a binomial
+count (retained genes, switched copies, surviving copies), which has exactly the distribution of simulating every
+gene and costs the same for 20k genes as for 20. The t1 draws of a replicate are shared by every t2 of that row.
+
+"""
+import concurrent.futures
+import functools
+import os
+
+import numpy as np
+
+import gene_dup_cache
+import gene_dup_pratio
+import gene_dup_survival
+
+###########################################################################
+#initialize parameters
+number_of_genes = 20000
+number_of_replicates = 1000
+confidence_level = 0.95
+
+
+###########################################################################
+#Functions
+
+def category_gene_counts(rng, number_of_genes, composition, replicates, fixed_composition=True):
+    #(replicates, 3) genes per category: N*Alpha rounded (largest remainders), or multinomial draws
+    composition = np.asarray(composition, dtype=float)
+    composition = composition / composition.sum()
+    if not fixed_composition:
+        return rng.multinomial(number_of_genes, composition, size=replicates)
+    exact = number_of_genes * composition
+    counts = np.floor(exact).astype(np.int64)
+    counts[np.argsort(counts - exact)[:number_of_genes - counts.sum()]] += 1
+    return np.broadcast_to(counts, (replicates, 3))
+
+def simulate_band(seed_sequence, st1, st2, composition, switch, number_of_genes, replicates, fixed_composition):
+    #empirical pratio of every replicate for a band of t1 rows, shape (replicates, rows, q2)
+    rng = np.random.default_rng(seed_sequence)
+    s1 = np.stack(gene_dup_pratio.survival_vectors(st1), axis=-1)
+    s2 = np.stack(gene_dup_pratio.survival_vectors(st2), axis=-1)
+    rows, q2 = s1.shape[0], s2.shape[0]
+    genes = category_gene_counts(rng, number_of_genes, composition, replicates, fixed_composition)[:, np.newaxis, :]
+    retained = rng.binomial(genes, s1[np.newaxis])
+    lost = genes - retained
+    #copies entering t2: two per retained gene, one per lost gene, shape (replicates, rows, 1, 3) against s2 (q2, 3)
+    retained_copies = np.broadcast_to((2 * retained)[:, :, np.newaxis, :], (replicates, rows, q2, 3))
+    lost_copies = np.broadcast_to(lost[:, :, np.newaxis, :], (replicates, rows, q2, 3))
+    switched = rng.binomial(retained_copies[..., 0], switch)
+    survived_retained = (rng.binomial(switched, s2[:, 2])
+                         + rng.binomial(retained_copies[..., 0] - switched, s2[:, 0])
+                         + rng.binomial(retained_copies[..., 1:], s2[:, 1:]).sum(axis=-1))
+    survived_lost = rng.binomial(lost_copies, s2).sum(axis=-1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pratio = (survived_retained / retained_copies.sum(axis=-1)) / (survived_lost / lost_copies.sum(axis=-1))
+    counts = np.stack([survived_retained, retained_copies.sum(axis=-1), survived_lost, lost_copies.sum(axis=-1)], axis=-1)
+    return pratio, counts.sum(axis=0)
+
+def summarize_band(seed_sequence, st1, st2, composition, switch, number_of_genes, replicates, fixed_composition, confidence):
+    #(pooled pratio, mean, lower, upper) over the replicates of one band, each shape (rows, q2)
+    pratio, counts = simulate_band(seed_sequence, st1, st2, composition, switch, number_of_genes, replicates, fixed_composition)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pooled = (counts[..., 0] / counts[..., 1]) / (counts[..., 2] / counts[..., 3])
+    finite = np.where(np.isfinite(pratio), pratio, np.nan)
+    tail = (1 - confidence) / 2
+    with np.errstate(invalid='ignore'):
+        lower, upper = np.nanquantile(finite, [tail, 1 - tail], axis=0)
+        mean = np.nanmean(finite, axis=0)
+    return pooled, mean, lower, upper
+
+def simulate_pratio(t1_range, composition, switch=0.0, t2_range=None, parameters=None, n_max=gene_dup_survival.n_max,
+                    number_of_genes=number_of_genes, replicates=number_of_replicates, seed=0, workers=1, fixed_composition=True,
+                    confidence=confidence_level, cache=None):
+    #empirical pratio over the t1 x t2 grid for one composition (Alpha_Alt_func, Alpha_Dos, Alpha_Non) and switch
+    #with fixed_composition the genome has N*Alpha genes of each category, otherwise the split is drawn per replicate
+    #returns a dict of (q1, q2) arrays: 'pratio' (pooled over replicates, converges to the analytic surface),
+    #'mean' (mean of the replicate pratios), 'lower' and 'upper' (confidence interval of one replicate's pratio,
+    #i.e. the spread of a genome of number_of_genes genes), plus 'replicates' and 'genes'
+    if t2_range is None:
+        t2_range = t1_range
+    t1_range = np.asarray(t1_range, dtype=float)
+    t2_range = np.asarray(t2_range, dtype=float)
+    st1 = gene_dup_cache.calculate_cached_category_survival_curves(t1_range, parameters, n_max, cache)
+    st2 = gene_dup_cache.calculate_cached_category_survival_curves(t2_range, parameters, n_max, cache)
+    st1 = [gene_dup_survival.patch_survival_immediately_post_wgd(curve, t1_range) for curve in gene_dup_pratio.survival_vectors(st1)]
+    st2 = [gene_dup_survival.patch_survival_immediately_post_wgd(curve, t2_range) for curve in gene_dup_pratio.survival_vectors(st2)]
+    q1, q2 = t1_range.size, t2_range.size
+    rows_per_band = max(1, gene_dup_pratio.max_batch_cells // (replicates * q2 * 3))
+    bands = [(start, min(q1, start + rows_per_band)) for start in range(0, q1, rows_per_band)]
+    #one independent stream per band, the same whatever the number of workers
+    seed_sequences = np.random.SeedSequence(seed).spawn(len(bands))
+    band_survival = [[curve[start:stop] for curve in st1] for start, stop in bands]
+    function = functools.partial(summarize_band, st2=st2, composition=composition, switch=switch, number_of_genes=number_of_genes,
+                                 replicates=replicates, fixed_composition=fixed_composition, confidence=confidence)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = min(max(1, int(workers)), len(bands))
+    if workers == 1:
+        results = [function(seed_sequence, band) for seed_sequence, band in zip(seed_sequences, band_survival)]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(function, seed_sequences, band_survival))
+    pooled, mean, lower, upper = [np.concatenate(parts, axis=0) for parts in zip(*results)]
+    return {'pratio': pooled, 'mean': mean, 'lower': lower, 'upper': upper, 'replicates': replicates, 'genes': number_of_genes}
+
+def interval_coverage(simulation, analytic_pratio):
+    #fraction of the cells (with a finite interval) whose [lower, upper] interval contains the analytic pratio
+    analytic_pratio = np.asarray(analytic_pratio, dtype=float)
+    usable = np.isfinite(simulation['lower']) & np.isfinite(simulation['upper']) & np.isfinite(analytic_pratio)
+    covered = (simulation['lower'] <= analytic_pratio) & (analytic_pratio <= simulation['upper'])
+    return float(covered[usable].mean()) if np.any(usable) else float('nan')
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""
+Content-addressed store of pratio surface results.
+
+Purpose:
+    1) Key every result by a hash of all of its inputs: b/c/d/f per category, composition, switch, t1 and t2 grids
+       and n_max, so a result is found again whatever file name or manifest asked for it.
+    2) Write each entry atomically (built in a temporary directory and renamed into place), so a killed run never
+       leaves a partial entry and never touches entries that were already complete.
+    3) Checkpoint per scenario: a long sweep that is interrupted and restarted only computes the scenarios whose
+       keys are not in the store yet.
+
+Layout: <root>/<first two hex digits of key>/<key>.gdsurf, each entry in the binary format of gene_dup_io.
+
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import gene_dup_io
+
+###########################################################################
+#initialize parameters
+#bumped whenever a change to the engine alters results, so entries from older engines are not reused
+result_version = 1
+
+
+###########################################################################
+#Functions
+
+def result_key(scenario):
+    #sha256 of the inputs that determine a scenario's surface (not its output names or formats)
+    #series_tolerance only enters when it is set, so entries of scenarios without one keep their keys
+    inputs = {name: scenario[name] for name in ('composition', 'switch', 't1_range', 't2_range', 'parameters', 'n_max')}
+    if scenario.get('series_tolerance') is not None:
+        inputs['series_tolerance'] = scenario['series_tolerance']
+    inputs['result_version'] = result_version
+    canonical = json.dumps(inputs, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+class ResultsStore:
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def path_for(self, key):
+        return os.path.join(self.root, key[:2], key + gene_dup_io.binary_suffix)
+
+    def has(self, key):
+        #complete entries only: the metadata file is part of the directory that is renamed into place last
+        return os.path.isfile(os.path.join(self.path_for(key), gene_dup_io.metadata_file_name))
+
+    def get(self, key, mmap_mode='r'):
+        return gene_dup_io.load_pratio_surface(self.path_for(key), mmap_mode)
+
+    def put(self, key, surface):
+        #atomically add an entry; if another process stored the same key first, its entry is kept
+        path = self.path_for(key)
+        if self.has(key):
+            return path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary_directory = tempfile.mkdtemp(dir=os.path.dirname(path), prefix='.tmp_')
+        try:
+            temporary_path = os.path.join(temporary_directory, 'entry')
+            gene_dup_io.save_pratio_surface(surface, temporary_path, extra_metadata={'key': key})
+            try:
+                os.rename(temporary_path, path)
+            except OSError:
+                if not self.has(key):
+                    raise
+        finally:
+            shutil.rmtree(temporary_directory, ignore_errors=True)
+        return path
+
+    def put_path(self, key, source_path):
+        #put for a result already on disk in the binary format (a tiled surface): its arrays are hard-linked, not re-read
+        path = self.path_for(key)
+        if self.has(key):
+            return path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary_directory = tempfile.mkdtemp(dir=os.path.dirname(path), prefix='.tmp_')
+        try:
+            temporary_path = os.path.join(temporary_directory, 'entry')
+            gene_dup_io.copy_pratio_surface(source_path, temporary_path, extra_metadata={'key': key})
+            try:
+                os.rename(temporary_path, path)
+            except OSError:
+                if not self.has(key):
+                    raise
+        finally:
+            shutil.rmtree(temporary_directory, ignore_errors=True)
+        return path
+
+    def keys(self):
+        for prefix in sorted(os.listdir(self.root)):
+            directory = os.path.join(self.root, prefix)
+            if len(prefix) != 2 or not os.path.isdir(directory):
+                continue
+            for entry in sorted(os.listdir(directory)):
+                if entry.endswith(gene_dup_io.binary_suffix):
+                    key = entry[:-len(gene_dup_io.binary_suffix)]
+                    if self.has(key):
+                        yield key
+
+    def clean_temporary_files(self):
+        #remove what killed runs left behind (temporary directories are never part of a complete entry)
+        for prefix in os.listdir(self.root):
+            directory = os.path.join(self.root, prefix)
+            if os.path.isdir(directory):
+                for entry in os.listdir(directory):
+                    if entry.startswith('.tmp_'):
+                        shutil.rmtree(os.path.join(directory, entry), ignore_errors=True)
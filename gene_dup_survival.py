@@ -0,0 +1,447 @@
+# -*- coding: utf-8 -*-
+"""
+Vectorized survival-curve kernel for the gene duplicability models.
+
+Purpose:
+    1) Evaluate the survival of a duplicate gene copy over whole time grids in one array operation
+       instead of the scalar double loop in calculate_probability_of_survival_of_duplicate_gene_copy_by_time.
+    2) Evaluate many (b, c, d, f) parameter sets at once, so the Alt_func, Dos and Non curves (or thousands
+       of sampled parameter sets) are a single broadcast computation.
+
+Survival model (same as the submission scripts):
+    s(t) = exp(-d*t - f * sum_{n=0}^{n_max-1} ((-b)**n * t**(c*n+1)) / (n! * (c*n+1)))
+
+The factorial and power terms depend only on (b, c, n), so they are precomputed once per parameter set as
+series coefficients; only t**(c*n+1) is evaluated per time point.
+
+Adaptive truncation:
+    calculate_survival_curves_adaptive stops the series separately for every parameter set once the remaining terms
+    are below a tolerance at every point of the grid. For n >= 1 the ratio |term(n+1)/term(n)| =
+    |b|*t**c*(c*n+1)/((n+1)*(c*n+c+1)) decreases with n, so once it drops below 1 the tail is bounded by
+    |next term|/(1 - ratio). Rounding is added to it: the recurrence and the sum of N terms are off by at most about
+    series_rounding_factor*N*eps*sum|term|, which is what an alternating series (b > 0, Alt_func beyond t of about
+    1.5) loses to cancellation. The bound is multiplied by |f| and reported per point as a bound on the relative
+    error of the survival probability, together with the term count. Points where it is above the tolerance (the
+    series cancels too much, or did not converge within n_max terms) or whose value is not finite are evaluated
+    untruncated instead (number_of_terms 0), with a bound of untruncated_rounding_factor*eps*(|f*I| + |d*t| + 1).
+    The terms are built by recurrence (one multiply-add per point and term, against one power per point and term
+    for the n_max series). The term count is chosen per parameter set, not per point: deliberately, from a majorant
+    of the whole grid (largest t and |b|*t**c), so the summation runs over whole rows with no per-point bookkeeping,
+    and every point of a curve gets the same number of terms (at least as many as it needs). Measured for the
+    default parameters and tolerance on uniform grids up to t = 0.5 (the Alt_func, Dos and Non curves need 19, 49
+    and 1 terms), against n_max = 100: slower on the scripts' q = 51 grids (about 1 ms against 0.2 to 0.5 ms), about
+    2 ms against 9 ms for q = 1001 and 0.1 s against 0.93 s for q = 100001. It is not a faster default: what it adds
+    at every size is the error bound, and the fallback where the n_max series is wrong. Runner scenarios use it with
+    "series_tolerance"; calculate_category_survival_curves and the survival cache take it as tolerance.
+
+Untruncated evaluation for long horizons (n_max=None):
+    The series is the hazard integral I(t) = integral_0^t exp(-b*u**c) du, which with v = |b|*u**c and a = 1/c is
+        b > 0:  I(t) = |b|**(-a)/c * lower_incomplete_gamma(a, b*t**c)
+        b < 0:  I(t) = |b|**(-a)/c * integral_0^x v**(a-1)*exp(v) dv,  x = |b|*t**c
+        b = 0:  I(t) = t
+    For b > 0 the incomplete gamma is a series of positive terms for small x and a continued fraction for large x;
+    for b < 0 the integral is a series of positive (Poisson weighted) terms for small x and its asymptotic
+    expansion for large x. Everything is carried as log I(t), so there is no alternating cancellation and no
+    overflow, and t ranges of 10 and beyond cost no more than t <= 0.5. calculate_survival_reference evaluates the
+    original series in high-precision decimal arithmetic to check it.
+
+"""
+import decimal
+import math
+
+import numpy as np
+
+import gene_dup_profile
+
+###########################################################################
+#initialize parameters
+#n_max = 170
+n_max = 100
+
+#adaptive truncation: bound on f * (remaining series terms), i.e. on the relative error of s(t)
+series_tolerance = 1e-12
+#upper limit on the number of terms for the adaptive series (no factorials are formed, so this is not capped at 170)
+max_series_terms = 1000
+#rounding allowances of the adaptive series (times N*eps*sum|term|) and of the untruncated evaluation that replaces
+#it where that is too large (times eps*(|f*I| + |d*t| + 1); measured against calculate_survival_reference at most 52
+#for the default parameters up to t = 10)
+series_rounding_factor = 4
+untruncated_rounding_factor = 256
+
+#untruncated evaluation: relative accuracy of the incomplete gamma sums and the x = |b|*t**c beyond which the b < 0
+#integral uses its asymptotic expansion
+hazard_integral_tolerance = 2 * np.finfo(float).eps
+asymptotic_threshold = 40.0
+#significant digits of calculate_survival_reference (digits lost to cancellation are added on top)
+reference_digits = 40
+
+survival_immediately_post_wgd = 0.9999999999999 #needs to not be 1 for calculation, and can make sense because perhaps can assume two wgd events can't happen at exactly the same time, so SOMETHING had to be lost
+
+category_names = ('alt_func', 'dos', 'non')
+
+#parameters for Neo-functionalization/Sub-functionalization
+b_alt_func = 10.0
+c_alt_func = 2.37
+d_alt_func = 0.00054
+f_alt_func = 5.84
+
+#parameters for Dosage
+b_dos = -17.0
+c_dos = 0.2573
+d_dos = -0.000028
+f_dos = 0.000028
+
+#parameters for Non-functionalization
+b_non = 0
+c_non = 1
+d_non = 20
+f_non = 5
+
+default_survival_parameters = {
+    'alt_func': (b_alt_func, c_alt_func, d_alt_func, f_alt_func),
+    'dos': (b_dos, c_dos, d_dos, f_dos),
+    'non': (b_non, c_non, d_non, f_non),
+    }
+
+
+###########################################################################
+#Functions
+
+def calculate_series_coefficients(b, c, n_max=n_max):
+    #coefficients (-b)**n / (n! * (c*n+1)) and exponents c*n+1 of the series, shape (..., n_max)
+    #(-b)**n / n! is built as a running product of (-b/k) so neither the power nor the factorial overflows
+    #n_max = 0 is the empty sum (no coefficients), so s(t) = exp(-d*t)
+    if n_max < 0:
+        raise ValueError('n_max must be at least 0 (or None for the untruncated series), got ' + str(n_max))
+    b = np.asarray(b, dtype=float)[..., np.newaxis]
+    c = np.asarray(c, dtype=float)[..., np.newaxis]
+    n = np.arange(n_max, dtype=float)
+    ratios = np.broadcast_to(-b / np.maximum(n, 1.0), np.broadcast_shapes(b.shape, n.shape)).copy()
+    if n_max > 0:
+        ratios[..., 0] = 1.0
+    power_over_factorial = np.cumprod(ratios, axis=-1)
+    exponents = c * n + 1.0
+    coefficients = power_over_factorial / exponents
+    return coefficients, exponents
+
+def calculate_series_sum(b, c, time_range, n_max=n_max):
+    #sum_{n} (-b)**n * t**(c*n+1) / (n! * (c*n+1)) for every parameter set and time point
+    #output shape is broadcast(b, c).shape + time_range.shape
+    time_range = np.asarray(time_range, dtype=float)
+    coefficients, exponents = calculate_series_coefficients(b, c, n_max)
+    parameter_shape = coefficients.shape[:-1]
+    coefficients = coefficients.reshape(parameter_shape + (1,) * time_range.ndim + (n_max,))
+    exponents = np.broadcast_to(exponents, parameter_shape + (n_max,)).reshape(parameter_shape + (1,) * time_range.ndim + (n_max,))
+    with np.errstate(over='ignore', invalid='ignore', under='ignore'):
+        terms = coefficients * np.power(time_range[..., np.newaxis], exponents)
+    #terms whose coefficient is exactly zero (e.g. Non, b = 0) contribute nothing even if the power overflows
+    terms = np.where(coefficients == 0.0, 0.0, terms)
+    return terms.sum(axis=-1)
+
+def calculate_survival_curves(b, c, d, f, time_range, n_max=n_max):
+    #probability of survival of a duplicate gene copy for every (b, c, d, f) set and every time point
+    #b, c, d, f may be scalars or arrays that broadcast together; time_range may be any array of times
+    #output shape is broadcast(b, c, d, f).shape + time_range.shape
+    #n_max=None evaluates the untruncated series (calculate_survival_curves_untruncated), stable for large t
+    with gene_dup_profile.stage('survival_kernel'):
+        if n_max is None:
+            survival_probability = calculate_survival_curves_untruncated(b, c, d, f, time_range)
+        else:
+            time_range = np.asarray(time_range, dtype=float)
+            b, c, d, f = np.broadcast_arrays(*[np.asarray(x, dtype=float) for x in (b, c, d, f)])
+            summation = calculate_series_sum(b, c, time_range, n_max)
+            expand = (Ellipsis,) + (np.newaxis,) * time_range.ndim
+            with np.errstate(over='ignore', invalid='ignore'):
+                survival_probability = np.exp(-d[expand] * time_range - f[expand] * summation)
+    count_survival_evaluations(survival_probability, time_range)
+    return survival_probability
+
+def count_survival_evaluations(survival_probability, time_range):
+    #profiling counters: survival curves (parameter sets) and points evaluated by the kernel
+    gene_dup_profile.count('survival_curves', survival_probability.size // max(1, np.size(time_range)))
+    gene_dup_profile.count('survival_points', survival_probability.size)
+
+def calculate_survival_jacobian(b, c, d, f, time_range, n_max=n_max):
+    #survival and its analytic derivatives with respect to (b, c, d, f), from the same n_max term series
+    #returns (survival, jacobian) with shapes broadcast(b, c, d, f).shape + time_range.shape and that + (4,)
+    #with I = sum_n q_n*t**e_n/e_n, q_n = (-b)**n/n!, e_n = c*n+1 and log s = -d*t - f*I:
+    #    dI/db = -sum_n q_n*t**(e_n+c)/(e_n+c)      (the n+1 term differentiated, so b = 0 needs no division)
+    #    dI/dc = sum_n q_n*t**e_n * n*(e_n*log(t) - 1)/e_n**2
+    #    ds/dtheta = s * dlog s/dtheta, with dlog s/dd = -t and dlog s/df = -I
+    time_range = np.asarray(time_range, dtype=float)
+    b, c, d, f = np.broadcast_arrays(*[np.asarray(x, dtype=float) for x in (b, c, d, f)])
+    coefficients, exponents = calculate_series_coefficients(b, c, n_max)
+    parameter_shape = coefficients.shape[:-1]
+    expand_terms = parameter_shape + (1,) * time_range.ndim + (n_max,)
+    power_over_factorial = (coefficients * exponents).reshape(expand_terms)
+    exponents = np.broadcast_to(exponents, parameter_shape + (n_max,)).reshape(expand_terms)
+    shifted_exponents = exponents + np.broadcast_to(c[..., np.newaxis], parameter_shape + (1,)).reshape(parameter_shape + (1,) * time_range.ndim + (1,))
+    n = np.arange(n_max, dtype=float)
+    t = time_range[..., np.newaxis]
+    with np.errstate(over='ignore', invalid='ignore', under='ignore', divide='ignore'):
+        powers = np.power(t, exponents)
+        log_t = np.where(t > 0, np.log(np.where(t > 0, t, 1.0)), 0.0)
+        terms = np.where(power_over_factorial == 0.0, 0.0, power_over_factorial * powers)
+        summation = (terms / exponents).sum(axis=-1)
+        d_summation_d_b = -np.where(power_over_factorial == 0.0, 0.0, power_over_factorial * np.power(t, shifted_exponents) / shifted_exponents)[..., :n_max - 1].sum(axis=-1)
+        d_summation_d_c = (terms * n * (exponents * log_t - 1) / exponents**2).sum(axis=-1)
+        expand = (Ellipsis,) + (np.newaxis,) * time_range.ndim
+        survival_probability = np.exp(-d[expand] * time_range - f[expand] * summation)
+        d_log_survival = np.stack(np.broadcast_arrays(-f[expand] * d_summation_d_b, -f[expand] * d_summation_d_c, -time_range, -summation), axis=-1)
+        jacobian = survival_probability[..., np.newaxis] * d_log_survival
+    return survival_probability, jacobian
+
+def calculate_category_survival_curves(time_range, parameters=None, n_max=n_max, tolerance=None):
+    #survival curves of the Alt_func, Dos and Non categories as a dict keyed by category name
+    #evaluated as one batched kernel call over the three parameter sets
+    #with a tolerance the series is truncated adaptively, at up to max_series_terms terms (n_max=None stays untruncated)
+    if parameters is None:
+        parameters = default_survival_parameters
+    b, c, d, f = np.array([parameters[name] for name in category_names], dtype=float).T
+    if tolerance is None or n_max is None:
+        curves = calculate_survival_curves(b, c, d, f, time_range, n_max)
+    else:
+        with gene_dup_profile.stage('survival_kernel'):
+            curves = calculate_survival_curves_adaptive(b, c, d, f, time_range, tolerance)[0]
+    return {name: curves[i] for i, name in enumerate(category_names)}
+
+def calculate_category_survival_curves_in_blocks(time_range, parameters=None, n_max=n_max, block_size=65536, tolerance=None):
+    #calculate_category_survival_curves over block_size time points at a time, so the (time x n_max) series terms
+    #never exceed block_size*n_max values however long the grid is
+    #the adaptive series (with a tolerance) only holds a few arrays of the grid's size, so it is evaluated in one piece
+    if tolerance is not None and n_max is not None:
+        return calculate_category_survival_curves(time_range, parameters, n_max, tolerance)
+    time_range = np.asarray(time_range, dtype=float)
+    curves = {name: np.empty(time_range.shape) for name in category_names}
+    for start in range(0, time_range.size, block_size):
+        block = calculate_category_survival_curves(time_range[start:start + block_size], parameters, n_max)
+        for name in category_names:
+            curves[name][start:start + block_size] = block[name]
+    return curves
+
+def patch_survival_immediately_post_wgd(survival, time_range):
+    #replace s(0) = 1 by survival_immediately_post_wgd so the pratio does not divide by zero (Dec 2022 convention)
+    time_range = np.asarray(time_range, dtype=float)
+    return np.where(time_range == 0, survival_immediately_post_wgd, survival)
+
+def series_term_factor(c, n):
+    #term(n+1) / term(n) divided by x = -b*t**c: (c*n+1) / ((n+1)*(c*n+c+1))
+    return (c * n + 1) / ((n + 1) * (c * (n + 1) + 1))
+
+def count_adaptive_series_terms(largest_x, largest_t, c, f, tolerance=series_tolerance, n_max=max_series_terms, block_terms=64):
+    #number of terms after which |f| times the tail bound is below tolerance at every point, per parameter set
+    #|term(n)| <= largest_t * largest_x**n * product of the factors, whatever the point, so the bound is taken on that
+    #majorant (in logs, block_terms terms at a time); parameter sets that do not get there stop at n_max
+    largest_x, largest_t, c, f = [x.ravel() for x in np.broadcast_arrays(*[np.abs(np.asarray(x, dtype=float)) for x in (largest_x, largest_t, c, f)])]
+    number_of_terms = np.full(c.shape, n_max, dtype=np.int64)
+    decided = np.zeros(c.shape, dtype=bool)
+    with np.errstate(over='ignore', invalid='ignore', divide='ignore'):
+        log_x, log_f = np.log(largest_x)[:, np.newaxis], np.log(f)[:, np.newaxis]
+        log_majorant = np.log(largest_t)
+        for start in range(0, n_max - 1, block_terms):
+            #n terms summed, tested on the bound of term(n) and beyond
+            n = np.arange(start + 1, min(start + block_terms, n_max - 1) + 1)
+            log_terms = log_majorant[:, np.newaxis] + np.cumsum(log_x + np.log(np.abs(series_term_factor(c[:, np.newaxis], n - 1))), axis=1)
+            ratio = largest_x[:, np.newaxis] * series_term_factor(c[:, np.newaxis], n)
+            converged = (log_terms == -np.inf) | ((ratio < 1) & (log_f + log_terms - np.log1p(-ratio) <= np.log(tolerance)))
+            found = ~decided & converged.any(axis=1)
+            number_of_terms[found] = n[np.argmax(converged[found], axis=1)]
+            decided |= found
+            if decided.all():
+                break
+            log_majorant = log_terms[:, -1]
+    return number_of_terms
+
+def calculate_survival_curves_adaptive(b, c, d, f, time_range, tolerance=series_tolerance, n_max=max_series_terms):
+    #survival curves with the series truncated adaptively, separately for every parameter set (see the module docstring)
+    #returns (survival_probability, relative_error_bound, number_of_terms), each of shape broadcast(b, c, d, f).shape + time_range.shape
+    #(relative_error_bound covers truncation and rounding; number_of_terms is 0 where the untruncated evaluation was used)
+    #terms are built by the recurrence term(n) = term(n-1) * (-b*t**c) * (c*(n-1)+1) / (n*(c*n+1)), starting from term(0) = t
+    time_range = np.asarray(time_range, dtype=float)
+    b, c, d, f = np.broadcast_arrays(*[np.asarray(x, dtype=float) for x in (b, c, d, f)])
+    output_shape = b.shape + time_range.shape
+    b, c, d, f = [x.reshape(-1, 1) for x in (b, c, d, f)]
+    time = time_range.reshape(1, -1)
+    with np.errstate(over='ignore', invalid='ignore', divide='ignore'):
+        x = np.where(b == 0, 0.0, -b * np.power(time, c))
+    largest_t = np.max(np.abs(time), initial=0.0)
+    terms_per_set = count_adaptive_series_terms(np.max(np.abs(x), axis=1, initial=0.0), largest_t, c[:, 0], f[:, 0], tolerance, n_max)
+    #parameter sets sorted by decreasing term count, so the sets still being summed are always the first rows
+    order = np.argsort(-terms_per_set, kind='stable')
+    x, sorted_c, terms_per_set = x[order], c[order], terms_per_set[order]
+    summation = np.repeat(time, len(order), axis=0)
+    term = summation.copy()
+    absolute_summation = np.abs(summation)
+    factors = series_term_factor(sorted_c, np.arange(int(terms_per_set.max(initial=1)) - 1))
+    with np.errstate(over='ignore', invalid='ignore', under='ignore'):
+        for n in range(factors.shape[1]):
+            rows = np.count_nonzero(terms_per_set > n + 1)
+            term[:rows] *= x[:rows] * factors[:rows, n:n + 1]
+            summation[:rows] += term[:rows]
+            absolute_summation[:rows] += np.abs(term[:rows])
+        #tail bound of every point after its parameter set's last term, plus the rounding of the terms summed
+        last = terms_per_set[:, np.newaxis] - 1
+        next_term = np.abs(term * x * series_term_factor(sorted_c, last))
+        next_ratio = np.abs(x) * series_term_factor(sorted_c, last + 1)
+        tail_bound = np.where(next_ratio < 1, np.where(next_term == 0, 0.0, next_term / (1 - next_ratio)), np.inf)
+        tail_bound += series_rounding_factor * terms_per_set[:, np.newaxis] * np.finfo(float).eps * absolute_summation
+    unsort = np.argsort(order)
+    summation, tail_bound, terms_per_set = summation[unsort], tail_bound[unsort], terms_per_set[unsort]
+    with np.errstate(over='ignore', invalid='ignore'):
+        survival_probability = np.exp(-d * time - f * summation)
+        #truncation and rounding of the series, plus the rounding of -d*t - f*sum and its exponential
+        relative_error_bound = np.expm1(np.abs(f) * tail_bound + 2 * np.finfo(float).eps * (np.abs(d * time) + np.abs(f * summation) + 1))
+        number_of_terms = np.repeat(terms_per_set[:, np.newaxis], time.shape[1], axis=1)
+        fallback = ~(np.abs(f) * tail_bound <= tolerance) | ~np.isfinite(survival_probability)
+    for row in np.flatnonzero(fallback.any(axis=1)):
+        #points the series cannot give to the tolerance: untruncated evaluation, one parameter set at a time
+        columns = np.flatnonzero(fallback[row])
+        log_survival = calculate_log_survival_curves(b[row, 0], c[row, 0], d[row, 0], f[row, 0], time[0, columns])
+        d_t = d[row, 0] * time[0, columns]
+        with np.errstate(over='ignore', under='ignore', invalid='ignore'):
+            survival_probability[row, columns] = np.exp(log_survival)
+            relative_error_bound[row, columns] = np.expm1(untruncated_rounding_factor * np.finfo(float).eps * (np.abs(log_survival + d_t) + np.abs(d_t) + 1))
+        number_of_terms[row, columns] = 0
+    gene_dup_profile.count('survival_adaptive_fallbacks', int(np.count_nonzero(fallback)))
+    count_survival_evaluations(survival_probability, time_range)
+    gene_dup_profile.count('survival_adaptive_terms', int(number_of_terms.sum()))
+    return (survival_probability.reshape(output_shape), relative_error_bound.reshape(output_shape), number_of_terms.reshape(output_shape))
+
+def calculate_log_lower_incomplete_gamma(a, x):
+    #log of integral_0^x v**(a-1)*exp(-v) dv for arrays a > 0, x > 0 of the same shape
+    #x < a+1: exp(-x)*x**a * sum_n x**n/(a*(a+1)*...*(a+n)), all terms positive
+    #x >= a+1: Gamma(a) minus the upper incomplete gamma, from its continued fraction (modified Lentz)
+    log_gamma = np.vectorize(math.lgamma, otypes=[float])(a)
+    result = np.empty(x.shape)
+    small = x < a + 1
+    a_s, x_s = a[small], x[small]
+    term = 1 / a_s
+    summation = term.copy()
+    n = 0
+    while term.size and n < max_series_terms and np.any(term > hazard_integral_tolerance * summation):
+        n += 1
+        term = term * x_s / (a_s + n)
+        summation += term
+    result[small] = a_s * np.log(x_s) - x_s + np.log(summation)
+    a_l, x_l = a[~small], x[~small]
+    tiny = 1e-300
+    b_l = x_l + 1 - a_l
+    c_l = np.full(x_l.shape, 1 / tiny)
+    d_l = 1 / b_l
+    h_l = d_l.copy()
+    i = 0
+    while h_l.size and i < max_series_terms:
+        i += 1
+        an = -i * (i - a_l)
+        b_l = b_l + 2
+        d_l = an * d_l + b_l
+        d_l = np.where(np.abs(d_l) < tiny, tiny, d_l)
+        c_l = b_l + an / c_l
+        c_l = np.where(np.abs(c_l) < tiny, tiny, c_l)
+        d_l = 1 / d_l
+        delta = d_l * c_l
+        h_l = h_l * delta
+        if np.all(np.abs(delta - 1) <= hazard_integral_tolerance):
+            break
+    upper_regularized = np.exp(-x_l + a_l * np.log(x_l) - log_gamma[~small]) * h_l
+    result[~small] = log_gamma[~small] + np.log1p(-upper_regularized)
+    return result
+
+def calculate_log_exponential_integral(a, x):
+    #log of integral_0^x v**(a-1)*exp(v) dv for arrays a > 0, x > 0 of the same shape
+    #x <= asymptotic_threshold: exp(x)*x**a * sum_n p_n/(a+n) with Poisson weights p_n = exp(-x)*x**n/n!
+    #beyond: exp(x)*x**(a-1) * sum_k (a-1)*(a-2)*...*(a-k)/x**k, stopped at its smallest term
+    result = np.empty(x.shape)
+    small = x <= asymptotic_threshold
+    a_s, x_s = a[small], x[small]
+    weight = np.exp(-x_s)
+    summation = weight / a_s
+    n = 0
+    while weight.size and (n <= x_s.max() or np.any(weight / (a_s + n) > hazard_integral_tolerance * summation)):
+        n += 1
+        weight = weight * x_s / n
+        summation += weight / (a_s + n)
+    result[small] = x_s + a_s * np.log(x_s) + np.log(summation)
+    a_l, x_l = a[~small], x[~small]
+    term = np.ones(x_l.shape)
+    summation = term.copy()
+    smallest = np.abs(term)
+    k = 0
+    while term.size and k < max_series_terms and np.any(np.abs(term) > hazard_integral_tolerance * np.abs(summation)):
+        k += 1
+        next_term = term * (a_l - k) / x_l
+        #keep adding only while the terms still shrink (the expansion diverges past its smallest term)
+        shrinking = np.abs(next_term) < smallest
+        if not np.any(shrinking):
+            break
+        term = np.where(shrinking, next_term, 0.0)
+        smallest = np.where(shrinking, np.abs(next_term), smallest)
+        summation += term
+    result[~small] = x_l + (a_l - 1) * np.log(x_l) + np.log(summation)
+    return result
+
+def calculate_log_hazard_integral(b, c, time_range):
+    #log of sum_{n>=0} (-b)**n * t**(c*n+1) / (n! * (c*n+1)) = log integral_0^t exp(-b*u**c) du, untruncated
+    #output shape is broadcast(b, c).shape + time_range.shape (log 0 = -inf at t = 0)
+    time_range = np.asarray(time_range, dtype=float)
+    b, c = np.broadcast_arrays(*[np.asarray(x, dtype=float) for x in (b, c)])
+    output_shape = b.shape + time_range.shape
+    expand = (Ellipsis,) + (np.newaxis,) * time_range.ndim
+    b, c, time = [np.broadcast_to(x, output_shape).ravel() for x in (b[expand], c[expand], time_range)]
+    with np.errstate(divide='ignore'):
+        log_integral = np.log(time)
+    for sign, evaluate in ((1, calculate_log_lower_incomplete_gamma), (-1, calculate_log_exponential_integral)):
+        selected = (np.sign(b) == sign) & (time > 0)
+        if np.any(selected):
+            a = 1 / c[selected]
+            x = np.abs(b[selected]) * np.power(time[selected], c[selected])
+            log_integral[selected] = -np.log(c[selected]) - a * np.log(np.abs(b[selected])) + evaluate(a, x)
+    return log_integral.reshape(output_shape)
+
+def calculate_log_survival_curves(b, c, d, f, time_range):
+    #log probability of survival, -d*t - f*I(t), with the untruncated hazard integral I(t)
+    #output shape is broadcast(b, c, d, f).shape + time_range.shape
+    time_range = np.asarray(time_range, dtype=float)
+    b, c, d, f = np.broadcast_arrays(*[np.asarray(x, dtype=float) for x in (b, c, d, f)])
+    expand = (Ellipsis,) + (np.newaxis,) * time_range.ndim
+    log_integral = calculate_log_hazard_integral(b, c, time_range)
+    with np.errstate(over='ignore', invalid='ignore'):
+        hazard = np.where(f[expand] == 0, 0.0, f[expand] * np.exp(log_integral))
+        return -d[expand] * time_range - hazard
+
+def calculate_survival_curves_untruncated(b, c, d, f, time_range):
+    #calculate_survival_curves without truncating the series, accurate for t far beyond the range of the n_max series
+    with np.errstate(over='ignore', under='ignore'):
+        return np.exp(calculate_log_survival_curves(b, c, d, f, time_range))
+
+def calculate_survival_reference(b, c, d, f, t, digits=reference_digits):
+    #high-precision reference for one (b, c, d, f, t): the original series summed in decimal arithmetic with enough
+    #extra digits to absorb its cancellation (the largest term is about exp(|b|*t**c)), returned as a float
+    b, c, d, f, t = [decimal.Decimal(repr(float(x))) for x in (b, c, d, f, t)]
+    if t == 0:
+        return 1.0
+    x = abs(b) * t ** c
+    with decimal.localcontext() as context:
+        context.prec = digits + int(x / decimal.Decimal(10).ln()) + 10
+        step = -b * t ** c
+        power_over_factorial = decimal.Decimal(1)
+        summation = t
+        n = 0
+        while True:
+            n += 1
+            power_over_factorial = power_over_factorial * step / n
+            term = t * power_over_factorial / (c * n + 1)
+            summation += term
+            if n > x and abs(term) <= abs(summation) * decimal.Decimal(10) ** -(digits + 5):
+                break
+        return float((-d * t - f * summation).exp())
+
+def calculate_reference_relative_error(b, c, d, f, time_range, n_max=None):
+    #largest relative difference between calculate_survival_curves (n_max terms, or untruncated with None) and
+    #calculate_survival_reference over time_range, for one (b, c, d, f) set
+    time_range = np.asarray(time_range, dtype=float).ravel()
+    evaluated = calculate_survival_curves(b, c, d, f, time_range, n_max)
+    reference = np.array([calculate_survival_reference(b, c, d, f, t) for t in time_range])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        error = np.abs(evaluated - reference) / np.abs(reference)
+    return float(np.max(np.where(reference == 0, np.abs(evaluated), error)))
@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+"""
+Uncertainty bands on pratio surfaces and survival curves when the parameters come as samples.
+
+Purpose:
+    1) Push N samples of the survival parameters (bootstrap fits, posterior draws, ...) and, optionally, of the
+       category fractions and the switch through the model, in batches along a leading sample axis.
+    2) Reduce the results on the fly into per-cell mean, standard deviation and quantile surfaces, so memory stays
+       O(q1*q2) whatever N is: only one batch of surfaces (at most gene_dup_pratio.max_batch_cells values) exists at a time.
+    3) Give the same summaries for the survival curve of each category, for banded versions of the survival plot.
+
+Quantiles are tracked per cell with the P-squared algorithm (Jain and Chlamtac 1985): five markers per quantile
+whose heights are adjusted by piecewise-parabolic interpolation as every new value arrives. It needs no stored
+values and no prior range, and is vectorized over all cells. The markers start at the exact order statistics of the
+first batch (until five samples have been seen the quantiles are exact). Means and variances are accumulated with
+Welford's update.
+
+Parameter samples are given either as a list of parameter dicts (the form of default_survival_parameters, as
+returned by gene_dup_fit.fit_category_survival_parameters) or as a dict of category -> (N, 4) array of (b, c, d, f).
+
+"""
+import numpy as np
+
+import gene_dup_io
+import gene_dup_plots
+import gene_dup_pratio
+import gene_dup_sensitivity
+import gene_dup_survival
+
+###########################################################################
+#initialize parameters
+#median and the central 95% band
+band_probabilities = (0.025, 0.5, 0.975)
+
+
+###########################################################################
+#Functions
+
+class StreamingQuantiles:
+    #P-squared estimates of several quantiles of every cell of a stream of equally shaped arrays
+    def __init__(self, shape, probabilities=band_probabilities):
+        self.shape = tuple(shape)
+        self.probabilities = tuple(probabilities)
+        self.count = 0
+        cells = int(np.prod(self.shape))
+        #per quantile: marker heights and (per cell) marker positions, 1-based as in the paper
+        self.heights = np.empty((len(self.probabilities), 5, cells))
+        self.positions = np.tile(np.arange(1.0, 6.0)[:, np.newaxis], (len(self.probabilities), 1, cells))
+        p = np.array(self.probabilities)[:, np.newaxis]
+        self.desired = np.hstack([np.ones_like(p), 1 + 2*p, 1 + 4*p, 3 + 2*p, 5*np.ones_like(p)])
+        self.increments = np.hstack([np.zeros_like(p), p/2, p, (1 + p)/2, np.ones_like(p)])
+
+    def update(self, values):
+        #add one array of shape self.shape
+        values = np.asarray(values, dtype=float).reshape(-1)
+        if self.count < 5:
+            self.heights[:, self.count] = values
+            self.count += 1
+            if self.count == 5:
+                self.heights.sort(axis=1)
+            return
+        self.count += 1
+        heights, positions = self.heights, self.positions
+        #markers above the new value move one position up, the outer markers stretch to cover it
+        for i in (1, 2, 3):
+            positions[:, i] += values < heights[:, i]
+        positions[:, 4] += 1
+        np.minimum(heights[:, 0], values, out=heights[:, 0])
+        np.maximum(heights[:, 4], values, out=heights[:, 4])
+        self.desired += self.increments
+        for i in (1, 2, 3):
+            offset = self.desired[:, i, np.newaxis] - positions[:, i]
+            gap_above = positions[:, i + 1] - positions[:, i]
+            gap_below = positions[:, i - 1] - positions[:, i]
+            quantile, cell = np.nonzero(((offset >= 1) & (gap_above > 1)) | ((offset <= -1) & (gap_below < -1)))
+            if quantile.size == 0:
+                continue
+            #only the markers that move are adjusted: parabolic prediction, or linear if it would leave the neighbours
+            step = np.sign(offset[quantile, cell])
+            below, here, above = heights[quantile, i - 1, cell], heights[quantile, i, cell], heights[quantile, i + 1, cell]
+            n_here = positions[quantile, i, cell]
+            n_below, n_above = n_here + gap_below[quantile, cell], n_here + gap_above[quantile, cell]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                parabolic = here + step / (n_above - n_below) * ((n_here - n_below + step) * (above - here) / (n_above - n_here)
+                                                                 + (n_above - n_here - step) * (here - below) / (n_here - n_below))
+                linear = here + step * (np.where(step > 0, above, below) - here) / np.where(step > 0, n_above - n_here, n_below - n_here)
+            heights[quantile, i, cell] = np.where((below < parabolic) & (parabolic < above), parabolic, linear)
+            positions[quantile, i, cell] += step
+
+    def update_many(self, batch):
+        #add every array along the first axis of batch
+        #a first batch of at least five arrays starts the markers at its exact order statistics (instead of at its
+        #first five values), which makes the tail quantiles much more accurate
+        batch = np.asarray(batch, dtype=float).reshape((-1, self.heights.shape[2]))
+        if self.count == 0 and batch.shape[0] >= 5:
+            self.initialize(batch)
+            return
+        for values in batch:
+            self.update(values)
+
+    def initialize(self, batch):
+        #markers at the order statistics nearest their desired positions 1 + (n - 1)*(0, p/2, p, (1 + p)/2, 1)
+        count = batch.shape[0]
+        ordered = np.sort(batch, axis=0)
+        self.desired = 1 + (count - 1) * self.increments
+        for j in range(len(self.probabilities)):
+            ranks = np.rint(self.desired[j]).astype(int)
+            #distinct ranks, so every pair of neighbouring markers has room to move
+            for i in range(1, 4):
+                ranks[i] = max(ranks[i], ranks[i - 1] + 1)
+            ranks[4] = count
+            for i in range(3, -1, -1):
+                ranks[i] = min(ranks[i], ranks[i + 1] - 1)
+            self.heights[j] = ordered[ranks - 1]
+            self.positions[j] = ranks[:, np.newaxis]
+        self.count = count
+
+    def quantiles(self):
+        #{probability: array of self.shape}, exact while fewer than five values have been added
+        if self.count == 0:
+            return {p: np.full(self.shape, np.nan) for p in self.probabilities}
+        if self.count < 5:
+            return {p: np.quantile(self.heights[j, :self.count], p, axis=0).reshape(self.shape) for j, p in enumerate(self.probabilities)}
+        return {p: self.heights[j, 2].reshape(self.shape).copy() for j, p in enumerate(self.probabilities)}
+
+class StreamingSummary:
+    #count, mean, standard deviation and quantiles of every cell of a stream of equally shaped arrays
+    def __init__(self, shape, probabilities=band_probabilities):
+        self.count = 0
+        self.mean = np.zeros(shape)
+        self.sum_of_squares = np.zeros(shape)
+        self.quantile_estimates = StreamingQuantiles(shape, probabilities)
+
+    def update(self, values):
+        values = np.asarray(values, dtype=float)
+        self.count += 1
+        difference = values - self.mean
+        self.mean += difference / self.count
+        self.sum_of_squares += difference * (values - self.mean)
+        self.quantile_estimates.update(values)
+
+    def update_many(self, batch):
+        #add every array along the first axis of batch
+        batch = np.asarray(batch, dtype=float)
+        for values in batch:
+            self.count += 1
+            difference = values - self.mean
+            self.mean += difference / self.count
+            self.sum_of_squares += difference * (values - self.mean)
+        self.quantile_estimates.update_many(batch)
+
+    def result(self):
+        #{'mean', 'std', 'quantiles': {probability: array}, 'count'}
+        std = np.sqrt(self.sum_of_squares / (self.count - 1)) if self.count > 1 else np.full(self.mean.shape, np.nan)
+        return {'mean': self.mean.copy(), 'std': std, 'quantiles': self.quantile_estimates.quantiles(), 'count': self.count}
+
+def parameter_sample_arrays(parameter_samples):
+    #{category: (N, 4) array of (b, c, d, f)} from a list of parameter dicts or a dict of arrays
+    if isinstance(parameter_samples, dict):
+        return {name: np.atleast_2d(np.asarray(parameter_samples[name], dtype=float)) for name in gene_dup_survival.category_names}
+    return {name: np.array([sample[name] for sample in parameter_samples], dtype=float) for name in gene_dup_survival.category_names}
+
+def broadcast_samples(values, count, width=None):
+    #per-sample values: a single value (or composition) repeated count times, or one entry per sample
+    values = np.asarray(values, dtype=float)
+    single_shape = () if width is None else (width,)
+    if values.shape == single_shape:
+        return np.broadcast_to(values, (count,) + single_shape)
+    if values.shape[0] != count:
+        raise ValueError('expected ' + str(count) + ' samples, got ' + str(values.shape[0]))
+    return values
+
+def propagate_uncertainty(t1_range, parameter_samples, compositions, switches=0.0, t2_range=None, n_max=gene_dup_survival.n_max,
+                          scale='pratio', probabilities=band_probabilities):
+    #mean, standard deviation and quantile surfaces of pratio (or log10 pratio, scale 'log of pratio') over N samples
+    #compositions is one (Alpha_Alt_func, Alpha_Dos, Alpha_Non) or one per sample, switches one value or one per sample
+    #returns a dict: 'pratio' (summary of the (q1, q2) surfaces, see StreamingSummary.result), 'survival'
+    #({category: summary of the t1 survival curves}), 'samples', 'scale', 't1_range', 't2_range'
+    if t2_range is None:
+        t2_range = t1_range
+    t1_range = np.asarray(t1_range, dtype=float)
+    t2_range = np.asarray(t2_range, dtype=float)
+    same_grid = np.array_equal(t1_range, t2_range)
+    scale = gene_dup_pratio.normalize_scale(scale)
+    arrays = parameter_sample_arrays(parameter_samples)
+    count = arrays['alt_func'].shape[0]
+    compositions = broadcast_samples(compositions, count, 3)
+    switches = broadcast_samples(switches, count)
+    surface_summary = StreamingSummary((t1_range.size, t2_range.size), probabilities)
+    survival_summaries = {name: StreamingSummary((t1_range.size,), probabilities) for name in gene_dup_survival.category_names}
+    chunk = max(1, gene_dup_pratio.max_batch_cells // (t1_range.size * t2_range.size))
+    for start in range(0, count, chunk):
+        part = slice(start, start + chunk)
+        st1 = {name: gene_dup_sensitivity.batched_survival(t1_range, *arrays[name][part].T, n_max) for name in gene_dup_survival.category_names}
+        st2 = st1 if same_grid else {name: gene_dup_sensitivity.batched_survival(t2_range, *arrays[name][part].T, n_max) for name in gene_dup_survival.category_names}
+        pratio = gene_dup_pratio.calculate_pratio_surface(st1, st2, compositions[part, 0], compositions[part, 1], compositions[part, 2], switches[part])
+        if scale != 'pratio':
+            with np.errstate(divide='ignore', invalid='ignore'):
+                pratio = np.log10(pratio)
+        surface_summary.update_many(pratio)
+        for name in gene_dup_survival.category_names:
+            survival_summaries[name].update_many(st1[name])
+    return {'pratio': surface_summary.result(), 'survival': {name: summary.result() for name, summary in survival_summaries.items()},
+            'samples': count, 'scale': scale, 't1_range': t1_range, 't2_range': t2_range}
+
+def write_uncertainty_csv(result, file_name_full):
+    #long format csv, one row per (t1, t2) cell in t1-major order: t1, t2, mean, std, then one column per quantile
+    summary = result['pratio']
+    t1, t2 = np.meshgrid(result['t1_range'], result['t2_range'], indexing='ij')
+    columns = ['t1', 't2', 'mean', 'std'] + ['q' + str(p) for p in summary['quantiles']]
+    return gene_dup_io.write_columns_csv(file_name_full, columns, [t1, t2, summary['mean'], summary['std']] + list(summary['quantiles'].values()))
+
+def render_survival_bands(result, file_name, title='Survival over Time (t1)', image_format=gene_dup_plots.image_format, dpi=gene_dup_plots.dpi):
+    #banded survival plot (median line, band between the outermost quantiles) written to file_name + '_survival_bands.' + image_format
+    probabilities = sorted(result['survival']['alt_func']['quantiles'])
+    bands = {name: {'center': summary['quantiles'][probabilities[len(probabilities) // 2]],
+                    'lower': summary['quantiles'][probabilities[0]], 'upper': summary['quantiles'][probabilities[-1]]}
+             for name, summary in result['survival'].items()}
+    fig = gene_dup_plots.plot_survival_bands(result['t1_range'], bands, title)
+    return gene_dup_plots.save_figure(fig, file_name + '_survival_bands.' + image_format, dpi)
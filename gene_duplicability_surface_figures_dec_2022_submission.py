@@ -6,9 +6,10 @@ author: Amanda Erin Wilson
 
 Code associated with data and figures for Wilson AE, Liberles DA. Expectations of Duplicate Gene Retention Under the Gene Duplicability Hypothesis.
 Purpose: 
-    1) Generate the 3D Surface Plots t1 vs t2 vs pratio
+    1) Generate the 3D Surface Plots t1 vs t2 vs pratio (or log10(pratio), see scale)
     2) To create csv files that contain a 3D and 2D version of the arrays that contain the pratios for various t1 and t2 values.
     3) Generate the survival curves over time for each category Alt_func, Dos, and Non.
+    (gene_duplicability_surface_figures_logscale_dec_2022_submission.py runs this script with scale = 'log of pratio')
     
 B-F parameters:
 F+d (rate at which fully redundant genes get lost from the genome) to d (d is the rate at which non duplicated genes are lost)
@@ -22,20 +23,49 @@ For genes in the Alt_func category, that have potential to subfunctionalize or n
 import math
 #import numpy as np
 import matplotlib.pyplot as plt
-from matplotlib import cm
 
 import numpy as np
-import csv
+
+import gene_dup_grids
+import gene_dup_io
+import gene_dup_plots
+import gene_dup_pratio
+import gene_dup_profile
+import gene_dup_runner
 
 ###########################################################################
 #initialize parameters
 # n_max = 170
 n_max = 100
+#n_max = None #untruncated series (exact hazard integral), stable for t ranges of 10 and beyond
 
 # q = time points
 q = 51 #number of time points in t1 and t2 
 #q = 81 #may be more clear
 
+#t1 and t2 grid: q points 0, 0.01, 0.02, ... computed exactly OR any other grid spec of gene_dup_grids
+time_grid = {'start': 0, 'step': 0.01, 'count': q}
+#time_grid = {'kind': 'log', 'start': 0.001, 'stop': 0.5, 'count': q, 'zero': True} #most points near t = 0
+#time_grid = {'kind': 'adaptive', 'initial': {'start': 0, 'step': 0.05, 'count': 11}, 'tolerance': 0.01, 'max_points': q} #points only where pratio changes rapidly
+
+#worker processes for the percent combos (None uses every core, 1 runs them in this process)
+number_of_workers = None
+
+#draw figures on screen OR (headless = True) write them to image files without needing a display
+headless = False
+
+#figures and csv files of pratio OR (scale = 'log of pratio') of log10(pratio)
+scale = 'pratio'
+
+#figure kinds and output file name prefixes for each scale (csv_3d None: no 3D array csv), as in the two Dec 2022 submissions
+scale_outputs = {
+    'pratio': {'kinds': ['scatter'], 'figures': 'pratio', 'csv_3d': None, 'csv_2d': 'pratio_array_2D_'},
+    'log of pratio': {'kinds': ['surface', 'scatter'], 'figures': 'log_pratio', 'csv_3d': 'log_pratio_array_3D_', 'csv_2d': 'log_array_practice_file_2D_'},
+    }
+
+#None OR a directory to write a per-stage profile report (profile.json) and one cProfile dump per combo to
+profile_directory = None
+
 #number_percent_combos = 1
 number_percent_combos = 16
 percentages = [' 100% Alt_func, 0% Dos, 0% Non \n (Independence Hypothesis)', ' 75% Alt_func, 0% Dos, 25% Non \n (Duplicability Hypothesis)', ' 60% Alt_func, 15% Dos, 25% Non \n (Duplicability Hypothesis)', ' 45% Alt_func, 30% Dos, 25% Non \n (Duplicability Hypothesis)', ' 30% Alt_func, 45% Dos, 25% Non \n (Duplicability Hypothesis)', ' 15% Alt_func, 60% Dos, 25% Non \n (Duplicability Hypothesis)', ' 0% Alt_func, 75% Dos, 25% Non \n (Duplicability Hypothesis)', ' 50% Alt_func, 0% Dos, 50% Non \n (Duplicability Hypothesis)', ' 40% Alt_func, 10% Dos, 50% Non \n (Duplicability Hypothesis)', ' 30% Alt_func, 20% Dos, 50% Non \n (Duplicability Hypothesis)', ' 20% Alt_func, 30% Dos, 50% Non \n (Duplicability Hypothesis', ' 10% Alt_func, 40% Dos, 50% Non \n (Duplicability Hypothesis)', ' 0% Alt_func, 50% Dos, 50% Non \n (Duplicability Hypothesis)', ' 25% Alt_func, 0% Dos, 75% Non \n (Duplicability Hypothesis)', ' 10% Alt_func, 15% Dos, 75% Non \n (Duplicability Hypothesis)', ' 0% Alt_func, 25% Dos, 75% Non \n (Duplicability Hypothesis)']
@@ -65,6 +95,12 @@ c_non = 1
 d_non = 20
 f_non = 5
 
+survival_parameters = {
+    'alt_func': (b_alt_func, c_alt_func, d_alt_func, f_alt_func),
+    'dos': (b_dos, c_dos, d_dos, f_dos),
+    'non': (b_non, c_non, d_non, f_non),
+    }
+
 
 ###########################################################################
 #Functions
@@ -108,7 +144,7 @@ def calculate_pratio(st1_alt_func, st1_dos, st1_non, st2_alt_func, st2_dos, st2_
         for j in range(0,q):
             #probability of (survival in t2 given survived in t1)/(survival in t2 given lost in t1)
             psurv = (((st2_ret1_alt_func * st2_alt_func[j])+(st2_ret1_dos * st2_dos[j])+(st2_ret1_non * st2_non[j]))/((st2_notret1_alt_func * st2_alt_func[j])+(st2_notret1_dos * st2_dos[j])+(st2_notret1_non * st2_non[j]))) * (((st2_notret1_alt_func)+(st2_notret1_dos)+(st2_notret1_non))/((st2_ret1_alt_func)+(st2_ret1_dos)+(st2_ret1_non)))
-            prob_surv[i][j] = psurv
+            prob_surv[i][j] = psurv if scale == 'pratio' else math.log10(psurv)
             
 #    print("this is prob_surv")
 #    print(prob_surv)
@@ -141,7 +177,7 @@ def calculate_pratio_2d(t1, t2, st1_alt_func, st1_dos, st1_non, st2_alt_func, st
             t2_value = t2[j]
             p_survs_array_part[0, 0] = t1_value
             p_survs_array_part[0, 1] = t2_value
-            p_survs_array_part[0, 2] = psurv                           
+            p_survs_array_part[0, 2] = psurv if scale == 'pratio' else math.log10(psurv)
             prob_surv_2d_array = np.concatenate((prob_surv_2d_array, p_survs_array_part), axis = 0)                               
            
 #    print("this is prob_surv")
@@ -149,146 +185,80 @@ def calculate_pratio_2d(t1, t2, st1_alt_func, st1_dos, st1_non, st2_alt_func, st
     return prob_surv_2d_array    
 
 ###########################################################################
-def main_calculations(alt_func_percent, dos_percent, non_percent):
-    t1_range = []
-    for i in range(0,q):
-        t1_range.append(i/100)
+def make_scenario(alt_func_percent, dos_percent, non_percent):
+    t1_range = gene_dup_grids.resolve_time_grid(time_grid, (alt_func_percent, dos_percent, non_percent), 0.0, survival_parameters, n_max)
 #    print(t1_range)
-    
-    #calculate s(t1) for alt_functionalization
-    list_of_probabilities_of_survival_by_alt_functionalization = calculate_probability_of_survival_of_duplicate_gene_copy_by_time(b_alt_func, c_alt_func, d_alt_func, f_alt_func, t1_range)
-#    print ("List of prob of surv by alt_func in t1: ")
-#    print (list_of_probabilities_of_survival_by_alt_functionalization)
-    list_of_probabilities_of_survival_by_alt_functionalization_in_t1 = []
-    list_of_probabilities_of_survival_by_alt_functionalization_in_t1.append(survival_immediately_post_wgd)
-    for each_time_point in range(1,q):
-        list_of_probabilities_of_survival_by_alt_functionalization_in_t1.append(list_of_probabilities_of_survival_by_alt_functionalization[each_time_point])
-#    print ("List of prob of surv by alt_func in t1 adjusted to avoid division by zero: ")
-#    print(list_of_probabilities_of_survival_by_alt_functionalization_in_t1)
+    #everything the scenario needs is passed explicitly, so it can run in a worker process
+    return gene_dup_runner.make_scenario((alt_func_percent, dos_percent, non_percent), 0.0, t1_range, parameters=survival_parameters, n_max=n_max)
 
-        
-    #calculate s(t1) for dosage
-    list_of_probabilities_of_survival_by_dosage = calculate_probability_of_survival_of_duplicate_gene_copy_by_time(b_dos, c_dos, d_dos, f_dos, t1_range)
-#    print ("List of prob of surv by dos in t1: ")
-#    print(list_of_probabilities_of_survival_by_dosage)
-    list_of_probabilities_of_survival_by_dosage_in_t1 = []
-    list_of_probabilities_of_survival_by_dosage_in_t1.append(survival_immediately_post_wgd)
-    for each_time_point in range(1,q):
-        list_of_probabilities_of_survival_by_dosage_in_t1.append(list_of_probabilities_of_survival_by_dosage[each_time_point])    
-#    print ("List of prob of surv by dos in t1 adjusted to avoid division by zero: ")
-#    print(list_of_probabilities_of_survival_by_dosage_in_t1)
-
-    #calculate s(t1) for nonfunctionalization
-    list_of_probabilities_of_survival_of_genes_that_can_only_be_nonfunctionalized = calculate_probability_of_survival_of_duplicate_gene_copy_by_time(b_non, c_non, d_non, f_non, t1_range)
-#    print ("List of prob of surv in non category in t1: ")
-#    print(list_of_probabilities_of_survival_of_genes_that_can_only_be_nonfunctionalized)    
-    list_of_probabilities_of_survival_of_genes_that_can_only_be_nonfunctionalized_in_t1 = []
-    list_of_probabilities_of_survival_of_genes_that_can_only_be_nonfunctionalized_in_t1.append(survival_immediately_post_wgd)
-    for each_time_point in range(1,q):
-        list_of_probabilities_of_survival_of_genes_that_can_only_be_nonfunctionalized_in_t1.append(list_of_probabilities_of_survival_of_genes_that_can_only_be_nonfunctionalized[each_time_point])
-#    print ("List of prob of surv in non category in t1 adjusted to avoid division by zero: ")
-#    print (list_of_probabilities_of_survival_of_genes_that_can_only_be_nonfunctionalized_in_t1)
-
-    #Establish t2_range
-    t2_range = []
-    i = 0
-    for i in range(q):
-        t2_range.append(i/100)
-#    print(t2_range)
-
-    #calculate sn(t2) for alt_functionalization
-    list_of_probabilities_of_survival_by_alt_functionalization_in_t2 = list_of_probabilities_of_survival_by_alt_functionalization_in_t1
-#    print ("List of prob of surv by alt_func in t2: ")
-#    print (list_of_probabilities_of_survival_by_alt_functionalization_in_t2)
-    #calculate sd(t2) for dosage compensation
-    list_of_probabilities_of_survival_by_dosage_in_t2 = list_of_probabilities_of_survival_by_dosage_in_t1
-#    print ("List of prob of surv by dos in t2: " )
-#    print(list_of_probabilities_of_survival_by_dosage_in_t2)    
-    #calculate so(t2) for non-functionalization
-    list_of_probabilities_of_survival_of_genes_that_can_only_be_nonfunctionalized_in_t2 = list_of_probabilities_of_survival_of_genes_that_can_only_be_nonfunctionalized_in_t1
-#    print ("List of prob of surv in non category in t2: ")
-#    print(list_of_probabilities_of_survival_of_genes_that_can_only_be_nonfunctionalized_in_t2) 
-
-
-    probability_ratio = calculate_pratio(list_of_probabilities_of_survival_by_alt_functionalization_in_t1, list_of_probabilities_of_survival_by_dosage_in_t1, list_of_probabilities_of_survival_of_genes_that_can_only_be_nonfunctionalized_in_t1, list_of_probabilities_of_survival_by_alt_functionalization_in_t2, list_of_probabilities_of_survival_by_dosage_in_t2, list_of_probabilities_of_survival_of_genes_that_can_only_be_nonfunctionalized_in_t2)
-
-    probability_ratio_2d = calculate_pratio_2d(t1_range, t2_range, list_of_probabilities_of_survival_by_alt_functionalization_in_t1, list_of_probabilities_of_survival_by_dosage_in_t1, list_of_probabilities_of_survival_of_genes_that_can_only_be_nonfunctionalized_in_t1, list_of_probabilities_of_survival_by_alt_functionalization_in_t2, list_of_probabilities_of_survival_by_dosage_in_t2, list_of_probabilities_of_survival_of_genes_that_can_only_be_nonfunctionalized_in_t2)
+def main_calculations(alt_func_percent, dos_percent, non_percent):
+    #survival in t1 and t2 and the pratio surface are computed once, with s(0) adjusted to survival_immediately_post_wgd to avoid division by zero
+    #(calculate_probability_of_survival_of_duplicate_gene_copy_by_time, calculate_pratio and calculate_pratio_2d above are the scalar reference)
+    surface = gene_dup_runner.run_scenario(make_scenario(alt_func_percent, dos_percent, non_percent))
+    return unpack_calculations(surface)
+
+def unpack_calculations(surface):
+    t1_range = list(surface.t1_range)
+    t2_range = list(surface.t2_range)
+    list_of_probabilities_of_survival_by_alt_functionalization_in_t1 = surface.st1['alt_func']
+    list_of_probabilities_of_survival_by_dosage_in_t1 = surface.st1['dos']
+    list_of_probabilities_of_survival_of_genes_that_can_only_be_nonfunctionalized_in_t1 = surface.st1['non']
+    list_of_probabilities_of_survival_by_alt_functionalization_in_t2 = surface.st2['alt_func']
+    list_of_probabilities_of_survival_by_dosage_in_t2 = surface.st2['dos']
+    list_of_probabilities_of_survival_of_genes_that_can_only_be_nonfunctionalized_in_t2 = surface.st2['non']
+
+    probability_ratio = surface.surface(scale)
+
+    #long format (t1, t2, pratio) rows after the placeholder first row that calculate_pratio_2d starts with
+    probability_ratio_2d = np.concatenate(([[0, 1, 2]], surface.long_format(scale)), axis = 0)
 
     return t1_range, t2_range, probability_ratio, list_of_probabilities_of_survival_by_alt_functionalization_in_t1, list_of_probabilities_of_survival_by_dosage_in_t1, list_of_probabilities_of_survival_of_genes_that_can_only_be_nonfunctionalized_in_t1, list_of_probabilities_of_survival_by_alt_functionalization_in_t2, list_of_probabilities_of_survival_by_dosage_in_t2, list_of_probabilities_of_survival_of_genes_that_can_only_be_nonfunctionalized_in_t2, probability_ratio_2d
     
+def main():
+    #every combo is independent: compute them in worker processes, then plot and write them in combo order
+    outputs = scale_outputs[gene_dup_pratio.normalize_scale(scale)]
+    if profile_directory is not None:
+        gene_dup_profile.enable(True, profile_directory)
+    surfaces = gene_dup_runner.run_scenarios([make_scenario(alt_func_percentages[k], dos_percentages[k], non_percentages[k]) for k in range(0, number_percent_combos)], number_of_workers)
+
+    figure_jobs = []
+    for each_percentage_combo in range (0, number_percent_combos):
+        #Run calculations and extract info from it
+        surface = surfaces[each_percentage_combo]
+        calc = unpack_calculations(surface)
+        probability_ratio = calc[2]
+        print (probability_ratio)
+        probability_ratio_2d = calc[9]
+        print (probability_ratio_2d)
+
+        if headless:
+            #figures are rendered after the loop, in worker processes, straight to image files
+            figure_jobs.append({'surface': surface, 'file_name': outputs['figures'] + '_' + percentages_file_name[each_percentage_combo], 'percents': percentages[each_percentage_combo].strip(), 'kinds': outputs['kinds'], 'scale': scale})
+        else:
+            #plot 3D surface and/or 3D scatter
+            for kind in outputs['kinds']:
+                gene_dup_plots.plot_figure(surface, kind, percentages[each_percentage_combo].strip(), scale)
+                plt.draw()
+                plt.pause(.001)
+
+        with gene_dup_profile.stage('csv_write'):
+            if outputs['csv_3d'] is not None:
+                gene_dup_io.write_surface_matrix_csv(surface, outputs['csv_3d'] + percentages_file_name[each_percentage_combo] + '.csv', scale)
+            #every (t1, t2) row after the placeholder, under an 'a,b,p' header; adaptive and log grids do not have q points
+            gene_dup_io.write_rows_csv(outputs['csv_2d'] + percentages_file_name[each_percentage_combo] + '.csv', [list('abp')] + probability_ratio_2d[1:].tolist())
+
+    #Plot survival curves
+    if headless:
+        figure_jobs.append({'surface': surfaces[-1], 'file_name': outputs['figures'], 'percents': '', 'kinds': ['survival']})
+        gene_dup_plots.render_figures(figure_jobs, number_of_workers)
+    else:
+        gene_dup_plots.plot_survival_curves(surfaces[-1], 'Survival over Time')
+        plt.show()
+
+    if profile_directory is not None:
+        print('profile report: ' + gene_dup_profile.write_report(profile_directory))
+
 #############################################################################
 #Main
-for each_percentage_combo in range (0, number_percent_combos):
-    #Run calculations and extract info from it
-    alt_func_percent = alt_func_percentages[each_percentage_combo]
-    dos_percent = dos_percentages[each_percentage_combo]
-    non_percent = non_percentages[each_percentage_combo]
-    
-    calc = main_calculations(alt_func_percent, dos_percent, non_percent)
-    t1_range = calc[0]
-    t2_range = calc[1]
-    probability_ratio = calc[2]
-    print (probability_ratio)
-    list_of_probabilities_of_survival_by_alt_functionalization_in_t1 = calc[3]
-    list_of_probabilities_of_survival_by_dosage_in_t1 = calc[4]
-    list_of_probabilities_of_survival_of_genes_that_can_only_be_nonfunctionalized_in_t1 = calc[5]
-    list_of_probabilities_of_survival_by_alt_functionalization_in_t2 = calc[6]
-    list_of_probabilities_of_survival_by_dosage_in_t2 = calc[7]
-    list_of_probabilities_of_survival_of_genes_that_can_only_be_nonfunctionalized_in_t2 = calc[8]
-    probability_ratio_2d = calc[9]
-    print (probability_ratio_2d)
-
-    #plot 3D surface
-    # fig = plt.figure()
-    # ax = plt.axes(projection='3d')
-    # x, y = np.meshgrid(t1_range, t2_range, indexing='ij') 
-    # surf = ax.plot_surface(x, y, probability_ratio, cmap=cm.cividis)
-    # fig.colorbar(surf)
-    # ax.set_title('Pratio for t1 and t2:' + percentages[each_percentage_combo], fontsize=14)
-    # ax.set_xlabel('$t1$', fontsize=12)
-    # ax.set_ylabel('$t2$', fontsize=12)
-    # ax.set_zlabel(r'probability ratio', fontsize=11)
-    # ax.view_init(15, 45)
-    # plt.draw()
-    # plt.pause(.001)
-    
-    # file = open('array_practice_file_3D_' + percentages_file_name[each_percentage_combo] +'.csv', 'a', newline='')
-    # writer = csv.writer(file)
-    # i = 0
-    # for i in range (0, q):
-    #     writer.writerow(probability_ratio[i])
-    # file.close()
- 
-
-    #plot 3D scatter
-    fig2 = plt.figure()
-    ax2 = plt.axes(projection='3d')
-    surf2 = ax2.scatter3D(probability_ratio_2d[1:,0], probability_ratio_2d[1:,1], probability_ratio_2d[1:,2], c = probability_ratio_2d[1:,2], cmap=cm.cividis)
-    fig2.colorbar(surf2)
-    ax2.set_title('Pratio for t1 and t2:' + percentages[each_percentage_combo], fontsize=14)
-    ax2.set_xlabel('$t1$', fontsize=12)
-    ax2.set_ylabel('$t2$', fontsize=12)
-    ax2.set_zlabel(r'probability ratio', fontsize=11)
-    ax2.view_init(15, 45)
-    plt.draw()
-    plt.pause(.001)
-    
-    file2 = open('pratio_array_2D_' + percentages_file_name[each_percentage_combo] +'.csv', 'a', newline='')
-    writer2 = csv.writer(file2)
-    writer2.writerow('abp')
-    i = 1
-    for i in range (1, q*q):
-        writer2.writerow(probability_ratio_2d[i])
-    file2.close()    
-
-
-#Plot survival curves
-fig, t1_plot = plt.subplots()
-t1_plot.plot(t1_range, list_of_probabilities_of_survival_by_alt_functionalization_in_t1, color = 'red', label = 'Alt_func')
-t1_plot.plot(t1_range, list_of_probabilities_of_survival_by_dosage_in_t1, color = 'blue', label = 'Dos')
-t1_plot.plot(t1_range, list_of_probabilities_of_survival_of_genes_that_can_only_be_nonfunctionalized_in_t1, color = 'yellow', label = 'Non')
-legend = t1_plot.legend(loc = 'upper right', shadow = True, fontsize = '12')
-t1_plot.set_title('Survival over Time', fontsize=14)
-t1_plot.set_xlabel('Time Since Duplication Event', fontsize=12)
-t1_plot.set_ylabel('Proportion Gene Duplicate Copies Surviving', fontsize=12)
-plt.show()
\ No newline at end of file
+if __name__ == '__main__':
+    main()